@@ -0,0 +1,92 @@
+import threading
+from models import User
+
+class PathACL:
+    """
+    A user's granted folder paths compiled into a trie of path segments.
+    A grant on a path covers that folder and everything below it.
+    """
+    # Trie keys are path segments; this key marks a node as granted
+    GRANTED = None
+
+    def __init__(self, paths, unrestricted=False):
+        self.unrestricted = unrestricted
+        self.trie = {}
+        # A node holding GRANTED covers its whole subtree, so nothing below it needs to be stored
+        for path in sorted({self._normalize(p) for p in paths if self._normalize(p)}):
+            node = self.trie
+            for segment in path.split('/'):
+                if node.get(self.GRANTED):
+                    break
+                node = node.setdefault(segment, {})
+            else:
+                node.clear()
+                node[self.GRANTED] = True
+
+    @staticmethod
+    def _normalize(path):
+        return '/'.join(segment for segment in path.strip().split('/') if segment)
+
+    def _walk(self, folder_path):
+        """Follows folder_path down the trie. Returns (granted, node), node being None once off the trie."""
+        node = self.trie
+        for segment in self._normalize(folder_path).split('/'):
+            if node.get(self.GRANTED):
+                return True, node
+            node = node.get(segment)
+            if node is None:
+                return False, None
+        return bool(node.get(self.GRANTED)), node
+
+    def can_access(self, folder_path):
+        """True if folder_path is a granted folder or lies inside one."""
+        return self.unrestricted or self._walk(folder_path)[0]
+
+    def can_browse(self, folder_path):
+        """True if folder_path can be accessed or is on the way to a granted folder."""
+        if self.unrestricted:
+            return True
+        granted, node = self._walk(folder_path)
+        return granted or node is not None
+
+    def child_paths(self, folder_path):
+        """Paths of the subfolders of folder_path that lead towards granted folders."""
+        granted, node = self._walk(folder_path)
+        if granted or node is None:
+            return []
+        folder_path = self._normalize(folder_path)
+        return [f'{folder_path}/{segment}' for segment in node if segment is not self.GRANTED]
+
+    @property
+    def roots(self):
+        """The granted paths with every path nested inside another one removed, so their subtrees never overlap."""
+        roots = []
+        stack = [('', self.trie)]
+        while stack:
+            prefix, node = stack.pop()
+            if node.get(self.GRANTED):
+                roots.append(prefix)
+                continue
+            stack.extend((f'{prefix}/{segment}' if prefix else segment, child)
+                         for segment, child in node.items() if segment is not self.GRANTED)
+        return sorted(roots)
+
+_acl_cache = {}
+_acl_lock = threading.Lock()
+
+def get_user_acl(user_id):
+    """Returns the compiled ACL for a user, loading their paths only the first time."""
+    acl = _acl_cache.get(user_id)
+    if acl is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return PathACL([])
+        acl = PathACL([p.path for p in user.paths], unrestricted=user.username == 'admin')
+        with _acl_lock:
+            _acl_cache[user_id] = acl
+    return acl
+
+def invalidate_user_acl(user_id):
+    """Drops a user's compiled ACL after their paths have changed."""
+    with _acl_lock:
+        _acl_cache.pop(user_id, None)
@@ -45,6 +45,42 @@ def create_app():
             db.create_all()
             click.echo("Database tables created.")
 
+        # Columns added to existing tables have to be there before the models query them
+        for column in database.ensure_columns():
+            click.echo(f"Column added: {column}")
+        for column in database.relax_not_null_columns():
+            click.echo(f"Column made nullable: {column}")
+
+        # Checked before the folders migration below, whose create_all also creates folder_stats
+        needs_folder_stats = not inspector.has_table("folder_stats")
+
+        if not inspector.has_table("folders"):
+            click.echo("Folders table not found, migrating folder markers...")
+            db.create_all()
+            database.migrate_folder_markers()
+            click.echo("Folder markers migrated.")
+
+        if needs_folder_stats:
+            db.create_all()
+            database.recompute_folder_stats()
+            click.echo("Folder statistics computed.")
+
+        if not inspector.has_table("upload_tasks"):
+            db.create_all()
+            click.echo("Upload tasks table created.")
+
+        database.backfill_deleted_at()
+
+        for change in database.ensure_indexes():
+            click.echo(f"Index {'created' if change.startswith('+') else 'dropped'}: {change[1:]}")
+
+        if database.get_root_folder_id() is None:
+            database.create_folder('root')
+
+        # Create (and on first run, build) the filename search index
+        from search_index import get_search_index
+        get_search_index()
+
         # Check if admin user needs to be created
         from models import User
         if not User.query.first():
@@ -54,6 +90,16 @@ def create_app():
             add_user(ADMIN_USERNAME, ADMIN_PASSWORD)
             click.echo(f"Admin user '{ADMIN_USERNAME}' created.")
 
+    # Recycle bin purges run in the background
+    from purge import purge_engine
+    from config import PURGE_BATCH_SIZE
+    purge_engine.batch_size = PURGE_BATCH_SIZE
+    purge_engine.init_app(app)
+
+    # Uploads to Telegram run on background workers fed from the upload_tasks table
+    from uploads import upload_engine
+    upload_engine.init_app(app)
+
     # Jinja2 extensions and filters
     app.jinja_env.add_extension('jinja2.ext.do')
     app.jinja_env.filters['basename'] = os.path.basename
@@ -135,6 +181,10 @@ def cache_cleanup_worker():
 from bot_handler import pyrogram_runner
 
 if __name__ == '__main__':
+    # Fork the thumbnail worker processes before any background thread is running
+    from user_handler import thumbnail_generator
+    thumbnail_generator.start()
+
     from config import CACHE_CLEANUP_INTERVAL_MINUTES
     # Start the cache cleanup worker in a background thread if interval is set
     if CACHE_CLEANUP_INTERVAL_MINUTES > 0:
@@ -143,6 +193,18 @@ if __name__ == '__main__':
     else:
         logging.info("Automatic cache cleanup is disabled.")
 
+    # Start the recycle bin retention purge if a retention period is set
+    from config import RECYCLE_BIN_RETENTION_DAYS, RECYCLE_BIN_PURGE_INTERVAL_MINUTES
+    from purge import purge_engine
+    if RECYCLE_BIN_RETENTION_DAYS > 0:
+        purge_engine.start_retention(RECYCLE_BIN_RETENTION_DAYS, RECYCLE_BIN_PURGE_INTERVAL_MINUTES)
+    else:
+        logging.info("Automatic recycle bin purge is disabled.")
+
+    # Start the upload workers; uploads interrupted by the last shutdown are queued again
+    from uploads import upload_engine
+    upload_engine.start()
+
     # Start the Pyrogram Runner
     logging.info("Starting Pyrogram Runner...")
     pyrogram_runner.start()
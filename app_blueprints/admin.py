@@ -225,14 +225,12 @@ def clear_items_cache():
                     bot_handler.clear_file_cache(file.file_id, file.thumbnail_file_id)
                     cleared_files += 1
             elif item_type == 'folder':
-                folder = database.get_file_by_id(item_id)
-                if folder and folder.filename == '.folder_marker':
-                    folder_path = folder.folder
-                    files_in_folder = database.get_all_files_in_folder(folder_path)
+                folder = database.get_folder_by_id(item_id)
+                if folder:
+                    files_in_folder = database.get_all_files_in_folder(folder.path)
                     for file in files_in_folder:
-                        if file.filename != '.folder_marker':
-                            bot_handler.clear_file_cache(file.file_id, file.thumbnail_file_id)
-                            cleared_files += 1
+                        bot_handler.clear_file_cache(file.file_id, file.thumbnail_file_id)
+                        cleared_files += 1
 
         return jsonify({'success': True, 'message': f'Cleared cache for {cleared_files} files.'})
     except Exception as e:
@@ -1,28 +1,30 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, session
 import database
 import bot_handler
+from purge import purge_engine
+from prewarm import prewarm_engine
+from uploads import upload_engine
 import os
-import threading
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Largest file a bot can upload through MTProto
+STREAM_UPLOAD_LIMIT = 2000 * 1024 * 1024
+
 # --- Cache Control APIs ---
 
 @api_bp.route('/cache_file/<string:telegram_file_id>', methods=['POST'])
 def cache_file_route(telegram_file_id):
-    # Use a simple in-memory dict to track threads. For a more robust solution,
-    # a proper task queue like Celery or Redis Queue would be better.
-    if not hasattr(cache_file_route, "cache_threads"):
-        cache_file_route.cache_threads = {}
-
-    if telegram_file_id in cache_file_route.cache_threads and cache_file_route.cache_threads[telegram_file_id].is_alive():
+    file_info = database.get_file_by_telegram_file_id(telegram_file_id)
+    job = prewarm_engine.submit([(telegram_file_id, file_info.size if file_info else None)],
+                                f'Cache {file_info.filename if file_info else telegram_file_id}', session.get('user_id'))
+    if job.skipped['in_flight'] or job.skipped['queued']:
         return jsonify({'success': False, 'message': 'Caching is already in progress for this file.'}), 409
-
-    thread = threading.Thread(target=bot_handler.download_file_to_cache, args=(telegram_file_id,))
-    thread.start()
-    cache_file_route.cache_threads[telegram_file_id] = thread
-    
-    return jsonify({'success': True, 'message': f'Started caching file {telegram_file_id} in the background.'})
+    if job.skipped['cached']:
+        return jsonify({'success': True, 'message': 'This file is already cached.', 'job_id': job.id})
+    if not job.queued_files:
+        return jsonify({'success': False, 'message': 'The caching queue is full, please try again later.'}), 429
+    return jsonify({'success': True, 'message': f'Started caching file {telegram_file_id} in the background.', 'job_id': job.id})
 
 @api_bp.route('/cache_status/<string:telegram_file_id>', methods=['GET'])
 def cache_status_route(telegram_file_id):
@@ -31,38 +33,101 @@ def cache_status_route(telegram_file_id):
         return jsonify({'status': 'error', 'message': 'File not found or file size is unknown.'}), 404
 
     total_size = file_info.size
-    cache_file_path = os.path.join(bot_handler.CACHE_DIR, telegram_file_id)
-
-    if not os.path.exists(cache_file_path):
-        return jsonify({'status': 'not_cached', 'cached_bytes': 0, 'total_bytes': total_size})
-
-    cached_size = os.path.getsize(cache_file_path)
-
-    if cached_size >= total_size:
-        return jsonify({'status': 'completed', 'cached_bytes': cached_size, 'total_bytes': total_size})
-    else:
-        return jsonify({'status': 'caching', 'cached_bytes': cached_size, 'total_bytes': total_size})
+    status, cached_bytes = bot_handler.get_cache_status(telegram_file_id)
+    return jsonify({'status': status, 'cached_bytes': cached_bytes, 'total_bytes': total_size})
+
+@api_bp.route('/download_queue', methods=['GET'])
+def download_queue_route():
+    return jsonify(bot_handler.pyrogram_runner.metrics())
+
+# --- Cache Prewarm APIs ---
+
+@api_bp.route('/prewarm', methods=['POST'])
+def start_prewarm_api():
+    """Queues files, and every file inside folders, for caching: {"items": [{"id": 1, "type": "file" | "folder"}, ...]}."""
+    data = request.get_json(silent=True) or {}
+    items = data.get('items') or []
+    if not items:
+        return jsonify({'status': 'error', 'message': 'No items selected.'}), 400
+    files = database.get_file_ids_for_items(items)
+    job = prewarm_engine.submit(files, f'Cache {len(items)} item(s)', session.get('user_id'))
+    return jsonify(job.to_dict()), 202
+
+@api_bp.route('/prewarm', methods=['GET'])
+def list_prewarms_api():
+    return jsonify({'jobs': [job.to_dict() for job in prewarm_engine.jobs()], 'queue': prewarm_engine.metrics()})
+
+@api_bp.route('/prewarm/<string:job_id>', methods=['GET'])
+def prewarm_status_api(job_id):
+    job = prewarm_engine.get_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Prewarm job not found.'}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/prewarm/<string:job_id>/cancel', methods=['POST'])
+def cancel_prewarm_api(job_id):
+    if not prewarm_engine.cancel(job_id):
+        return jsonify({'status': 'error', 'message': 'Prewarm job not found.'}), 404
+    return jsonify(prewarm_engine.get_job(job_id).to_dict())
 
 # --- Upload Task APIs ---
 
 @api_bp.route('/tasks')
 def get_tasks_api():
     tasks = database.get_upload_tasks()
-    return jsonify([task.to_dict() for task in tasks])
+    return jsonify([upload_engine.describe(task) for task in tasks])
+
+@api_bp.route('/tasks', methods=['POST'])
+def create_tasks_api():
+    """Queues uploaded files for upload to Telegram: multipart "files", with optional "folder" and "priority"."""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'status': 'error', 'message': 'No files uploaded.'}), 400
+    folder = request.form.get('folder') or 'root'
+    priority = request.form.get('priority', 0, type=int)
+    tasks = [upload_engine.submit(f.stream, os.path.basename(f.filename or 'file'), folder, f.mimetype, priority, session.get('user_id'))
+             for f in files]
+    return jsonify([upload_engine.describe(task) for task in tasks]), 202
+
+@api_bp.route('/tasks/stream', methods=['PUT'])
+def stream_task_api():
+    """
+    Uploads the raw request body to Telegram while it is being received, without staging it on disk.
+    The file name and folder come from the "filename" and "folder" query arguments, the MIME type from
+    Content-Type, and Content-Length is required, since Telegram needs the size before the first part.
+    """
+    size = request.content_length
+    if not size:
+        return jsonify({'status': 'error', 'message': 'A non-empty body with a Content-Length is required.'}), 411
+    if size > STREAM_UPLOAD_LIMIT:
+        return jsonify({'status': 'error', 'message': 'Files larger than 2000 MiB cannot be uploaded to Telegram.'}), 413
+    filename = os.path.basename(request.args.get('filename') or '')
+    if not filename:
+        return jsonify({'status': 'error', 'message': 'The filename argument is required.'}), 400
+    folder = request.args.get('folder') or 'root'
+    task = upload_engine.stream(request.stream, size, filename, folder, request.mimetype or None, session.get('user_id'))
+    status_code = {'completed': 201, 'cancelled': 409}.get(task.status if task else 'cancelled', 502)
+    return jsonify(upload_engine.describe(task) if task else {'status': 'deleted'}), status_code
+
+@api_bp.route('/tasks/metrics')
+def upload_metrics_api():
+    return jsonify(upload_engine.metrics())
 
 @api_bp.route('/tasks/bulk_update_status', methods=['POST'])
 def bulk_update_task_status_api():
     data = request.get_json()
     task_ids = data.get('task_ids')
     status = data.get('status')
-    database.bulk_update_upload_task_status(task_ids, status)
-    return jsonify(success=True)
+    if status not in database.UPLOAD_TASK_TRANSITIONS:
+        return jsonify({'success': False, 'message': f'Invalid status: {status}'}), 400
+    tasks = upload_engine.set_status(task_ids, status)
+    return jsonify(success=True, updated=[task.id for task in tasks])
 
 @api_bp.route('/tasks/bulk_delete', methods=['POST'])
 def bulk_delete_tasks_api():
     data = request.get_json()
     task_ids = data.get('task_ids')
-    database.bulk_delete_upload_tasks(task_ids)
+    upload_engine.delete(task_ids)
     return jsonify(success=True)
 
 @api_bp.route('/tasks/update_status', methods=['POST'])
@@ -70,20 +135,62 @@ def update_task_status_route_api():
     data = request.get_json()
     task_id = data.get('task_id')
     status = data.get('status')
-    database.update_upload_task_status(task_id, status)
-    return jsonify(success=True)
+    if status not in database.UPLOAD_TASK_TRANSITIONS:
+        return jsonify({'success': False, 'message': f'Invalid status: {status}'}), 400
+    tasks = upload_engine.set_status([task_id], status)
+    return jsonify(success=bool(tasks))
 
 @api_bp.route('/tasks/delete', methods=['POST'])
 def delete_task_api():
     data = request.get_json()
     task_id = data.get('task_id')
-    database.delete_upload_task(task_id)
+    upload_engine.delete([task_id])
     return jsonify(success=True)
 
 @api_bp.route('/tasks/update_priority', methods=['POST'])
 def update_task_priority_route_api():
     data = request.get_json()
     task_id = data.get('task_id')
-    priority = data.get('priority')
-    database.update_upload_task_priority(task_id, priority)
-    return jsonify(success=True)
+    try:
+        priority = int(data.get('priority'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Priority must be an integer.'}), 400
+    task = upload_engine.set_priority(task_id, priority)
+    return jsonify(success=task is not None)
+
+# --- Recycle Bin Purge APIs ---
+
+@api_bp.route('/purge', methods=['POST'])
+def start_purge_api():
+    """
+    Permanently deletes recycle-bin items in the background. The body must name exactly what to purge:
+    {"items": [...]}, {"older_than_days": N} or {"all": true}; anything else is rejected.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'A JSON object body is required.'}), 400
+    if data.get('items'):
+        job = purge_engine.purge_items(data['items'])
+    elif 'older_than_days' in data:
+        days = data['older_than_days']
+        if isinstance(days, str) and days.strip().isdigit():
+            days = int(days)
+        if isinstance(days, bool) or not isinstance(days, int) or days < 0:
+            return jsonify({'status': 'error', 'message': 'older_than_days must be a non-negative integer.'}), 400
+        job = purge_engine.purge_older_than(days)
+    elif data.get('all') is True:
+        job = purge_engine.empty_recycle_bin()
+    else:
+        return jsonify({'status': 'error', 'message': 'Specify "items", "older_than_days" or "all": true.'}), 400
+    return jsonify(job.to_dict()), 202
+
+@api_bp.route('/purge', methods=['GET'])
+def list_purges_api():
+    return jsonify([job.to_dict() for job in purge_engine.jobs()])
+
+@api_bp.route('/purge/<string:job_id>', methods=['GET'])
+def purge_status_api(job_id):
+    job = purge_engine.get_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Purge job not found.'}), 404
+    return jsonify(job.to_dict())
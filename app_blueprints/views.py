@@ -1,13 +1,39 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response, send_file, jsonify, abort, current_app
+from datetime import datetime, timezone
+from urllib.parse import quote
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 import database
+import http_range
+from config import CACHE_SENDFILE_MODE, CACHE_ACCEL_REDIRECT_PREFIX
+from thumbnails import FORMATS
+from purge import purge_engine
 import os
 import math
 import json
-from datetime import datetime
 import bot_handler
 
 views_bp = Blueprint('views', __name__, template_folder='templates')
 
+# Browser cache lifetime of thumbnails, which are immutable
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
+def _wrap_folder(item):
+    size, file_count = (item.stats.total_size, item.stats.file_count) if item.stats else (0, 0)
+    return {'type': 'folder', 'obj': item, 'name': item.name, 'size': size, 'file_count': file_count, 'date': item.upload_date, 'folder': item.path, 'mime_type': 'folder'}
+
+def _wrap_file(item):
+    return {'type': 'file', 'obj': item, 'name': item.filename, 'size': item.size, 'date': item.upload_date, 'folder': item.folder, 'mime_type': item.mime_type}
+
+def _paginate(file_query, folder_query, sort_by, sort_order, page, per_page):
+    """Fetches one page in SQL and returns (items, total_pages, next_cursor, prev_cursor) for the templates."""
+    files, folders, total_items, next_cursor, prev_cursor = database.paginate_files_and_folders(
+        file_query, folder_query, sort_by, sort_order, per_page, page,
+        cursor=request.args.get('cursor'), before=request.args.get('before'))
+    items = [_wrap_folder(item) for item in folders] + [_wrap_file(item) for item in files]
+    total_pages = int(math.ceil(total_items / per_page)) if per_page else 1
+    return items, total_pages, next_cursor, prev_cursor
+
 @views_bp.route('/')
 @views_bp.route('/index')
 def index():
@@ -18,21 +44,8 @@ def index():
     per_page_str = request.args.get('per_page', '20')
     per_page = int(per_page_str) if per_page_str != 'all' else None
 
-    all_files = database.get_all_files_for_user(session['user_id'], sort_by, sort_order)
-
-    all_items = []
-    for item in all_files:
-        all_items.append({'type': 'file', 'obj': item, 'name': item.filename, 'size': item.size, 'date': item.upload_date, 'folder': item.folder, 'mime_type': item.mime_type})
-
-    if per_page is not None:
-        total_items = len(all_items)
-        total_pages = int(math.ceil(total_items / per_page))
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_items = all_items[start:end]
-    else:
-        total_pages = 1
-        paginated_items = all_items
+    file_query = database.get_all_files_query_for_user(session['user_id'])
+    paginated_items, total_pages, next_cursor, prev_cursor = _paginate(file_query, None, sort_by, sort_order, page, per_page)
 
     return render_template('index.html', 
                            items=paginated_items, 
@@ -42,6 +55,8 @@ def index():
                            page=page, 
                            per_page=per_page_str, 
                            total_pages=total_pages, 
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            pagination_endpoint='views.index')
 
 @views_bp.route('/folders', strict_slashes=False)
@@ -57,58 +72,26 @@ def folders(folder_id=None):
     if folder_id is None:
         current_folder_path = 'root'
     else:
-        folder = database.get_file_by_id(folder_id)
-        if folder and folder.filename == '.folder_marker':
-            current_folder_path = folder.folder
+        folder = database.get_folder_by_id(folder_id)
+        if folder and not folder.is_deleted:
+            current_folder_path = folder.path
         else:
             flash('Invalid folder ID or not a folder.')
             return redirect(url_for('views.folders'))
 
-    files, subfolders = database.get_folder_contents_for_user(session['user_id'], current_folder_path)
-    if files is None and subfolders is None:
+    file_query, folder_query = database.get_folder_contents_query_for_user(session['user_id'], current_folder_path)
+    if file_query is None and folder_query is None:
         flash('You do not have permission to access this folder.')
         return redirect(url_for('views.folders'))
 
-    all_items = []
-    for item in subfolders:
-        all_items.append({'type': 'folder', 'obj': item, 'name': os.path.basename(item.folder), 'size': 0, 'date': item.upload_date, 'folder': item.folder, 'mime_type': 'folder'})
-    for item in files:
-        all_items.append({'type': 'file', 'obj': item, 'name': item.filename, 'size': item.size, 'date': item.upload_date, 'folder': item.folder, 'mime_type': item.mime_type})
-
-    reverse = (sort_order == 'desc')
-    if sort_by == 'name':
-        all_items.sort(key=lambda x: x['name'].lower(), reverse=reverse)
-    elif sort_by == 'size':
-        all_items.sort(key=lambda x: x['size'] if x['size'] is not None else 0, reverse=reverse)
-    elif sort_by == 'date':
-        all_items.sort(key=lambda x: x['date'] if x['date'] is not None else datetime.min, reverse=reverse)
-    elif sort_by == 'type':
-        all_items.sort(key=lambda x: x['mime_type'].lower() if x['mime_type'] else '', reverse=reverse)
-    elif sort_by == 'folder':
-        all_items.sort(key=lambda x: x['folder'].lower(), reverse=reverse)
-    all_items.sort(key=lambda x: 0 if x['type'] == 'folder' else 1)
-
-    if per_page is not None:
-        total_items = len(all_items)
-        total_pages = int(math.ceil(total_items / per_page))
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_items = all_items[start:end]
-    else:
-        total_pages = 1
-        paginated_items = all_items
+    paginated_items, total_pages, next_cursor, prev_cursor = _paginate(file_query, folder_query, sort_by, sort_order, page, per_page)
 
-    path_parts = current_folder_path.split('/')
-    breadcrumbs = []
-    for i, part in enumerate(path_parts):
-        full_path_for_crumb = '/'.join(path_parts[:i+1])
-        crumb_id = database.get_folder_id_by_path(full_path_for_crumb)
-        breadcrumbs.append({'name': part, 'id': crumb_id})
+    ancestors = database.get_folder_ancestors(current_folder_path)
+    breadcrumbs = [{'name': ancestor.name, 'id': ancestor.id} for ancestor in ancestors]
 
     parent_folder_id = None
-    if current_folder_path != 'root':
-        parent_folder_path = os.path.dirname(current_folder_path)
-        parent_folder_id = database.get_folder_id_by_path(parent_folder_path)
+    if current_folder_path != 'root' and len(ancestors) > 1:
+        parent_folder_id = ancestors[-2].id
 
     return render_template('folders.html', 
                            items=paginated_items,
@@ -122,6 +105,8 @@ def folders(folder_id=None):
                            page=page,
                            per_page=per_page_str,
                            total_pages=total_pages,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            pagination_endpoint='views.folders')
 
 @views_bp.route('/create_folder', methods=['POST'])
@@ -209,13 +194,13 @@ def delete_item_route():
     try:
         if item_type == 'bulk':
             items = json.loads(item_ids_str)
-            # Extract the integer IDs from the list of dicts
-            ids_to_delete = [int(item['id']) for item in items]
-            database.delete_item(ids_to_delete, is_bulk=True)
+            # Files and folders live in separate tables, so keep the type alongside each ID
+            items_to_delete = [{'id': int(item['id']), 'type': item['type']} for item in items]
+            database.delete_item(items_to_delete, is_bulk=True)
         else:
             # Single item deletion
-            ids_to_delete = [int(item_ids_str)]
-            database.delete_item(ids_to_delete)
+            items_to_delete = [{'id': int(item_ids_str), 'type': item_type}]
+            database.delete_item(items_to_delete)
         
         flash('Items moved to recycle bin.', 'success')
 
@@ -233,33 +218,8 @@ def recycle_bin():
     per_page_str = request.args.get('per_page', '20')
     per_page = int(per_page_str) if per_page_str != 'all' else None
 
-    deleted_items = database.get_deleted_items(sort_by, sort_order)
-
-    all_items = []
-    for item in deleted_items:
-        if item.filename == '.folder_marker':
-            all_items.append({'type': 'folder', 'obj': item, 'name': os.path.basename(item.folder), 'size': 0, 'date': item.upload_date, 'folder': item.folder, 'mime_type': 'folder'})
-        else:
-            all_items.append({'type': 'file', 'obj': item, 'name': item.filename, 'size': item.size, 'date': item.upload_date, 'folder': item.folder, 'mime_type': item.mime_type})
-
-    reverse = (sort_order == 'desc')
-    if sort_by == 'name':
-        all_items.sort(key=lambda x: x['name'].lower(), reverse=reverse)
-    elif sort_by == 'size':
-        all_items.sort(key=lambda x: x['size'] if x['size'] is not None else 0, reverse=reverse)
-    elif sort_by == 'date':
-        all_items.sort(key=lambda x: x['date'] if x['date'] is not None else datetime.min, reverse=reverse)
-    all_items.sort(key=lambda x: 0 if x['type'] == 'folder' else 1)
-
-    if per_page is not None:
-        total_items = len(all_items)
-        total_pages = int(math.ceil(total_items / per_page))
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_items = all_items[start:end]
-    else:
-        total_pages = 1
-        paginated_items = all_items
+    file_query, folder_query = database.get_deleted_items_query()
+    paginated_items, total_pages, next_cursor, prev_cursor = _paginate(file_query, folder_query, sort_by, sort_order, page, per_page)
 
     return render_template('recycle_bin.html', 
                            items=paginated_items, 
@@ -269,6 +229,8 @@ def recycle_bin():
                            page=page, 
                            per_page=per_page_str, 
                            total_pages=total_pages, 
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            pagination_endpoint='views.recycle_bin')
 
 @views_bp.route('/restore_items', methods=['POST'])
@@ -285,8 +247,8 @@ def restore_items_route():
 def permanent_delete_items_route():
     items = json.loads(request.form.get('item_ids'))
     try:
-        database.permanent_delete_items(items)
-        flash(f'Permanently deleted {len(items)} item(s).')
+        purge_engine.purge_items(items)
+        flash(f'Permanently deleting {len(items)} item(s) in the background.')
     except Exception as e:
         flash(f'Error permanently deleting items: {e}')
     return redirect(request.referrer or url_for('views.recycle_bin'))
@@ -294,8 +256,8 @@ def permanent_delete_items_route():
 @views_bp.route('/empty_recycle_bin', methods=['POST'])
 def empty_recycle_bin_route():
     try:
-        database.empty_recycle_bin()
-        return jsonify({'success': True, 'message': 'Recycle bin emptied successfully.'})
+        job = purge_engine.empty_recycle_bin()
+        return jsonify({'success': True, 'message': 'Emptying the recycle bin in the background.', 'job_id': job.id})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -307,13 +269,100 @@ def preview_file(db_id):
         return redirect(url_for('views.index'))
     return redirect(file.message_link)
 
+def _send_cached_file(file_id, mimetype, etag, filename=None, last_modified=None):
+    """
+    Serves a fully cached file, or returns None if it is not cached. Unless a byte range is asked for,
+    the body never passes through Python: it goes to the WSGI server's file_wrapper (sendfile), or with
+    CACHE_SENDFILE_MODE set to x-accel-redirect or x-sendfile, to the web server in front of the app.
+    """
+    cached = bot_handler.open_cached_file(file_id)
+    if not cached:
+        return None
+    f, size = cached
+    if last_modified is None:
+        last_modified = datetime.fromtimestamp(os.fstat(f.fileno()).st_mtime, timezone.utc)
+    headers = http_range.file_headers(etag, last_modified, filename)
+
+    if not is_resource_modified(request.environ, etag=etag.strip('"'), last_modified=last_modified):
+        f.close()
+        return Response(status=304, headers=headers)
+
+    if CACHE_SENDFILE_MODE in ('x-accel-redirect', 'x-sendfile'):
+        # The web server reads the file itself and also takes care of Range requests
+        f.close()
+        if CACHE_SENDFILE_MODE == 'x-accel-redirect':
+            headers['X-Accel-Redirect'] = CACHE_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(file_id)
+        else:
+            headers['X-Sendfile'] = os.path.abspath(bot_handler.cache_manager.path(file_id))
+        headers['Content-Length'] = str(size)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    if request.range is not None and http_range.if_range_matches(request, etag, last_modified):
+        response = http_range.ranged_response(request, size, lambda start, stop: bot_handler.read_file_range(f, start, stop),
+                                              mimetype, etag, last_modified, filename)
+        response.call_on_close(f.close)
+        return response
+
+    headers['Content-Length'] = str(size)
+    return Response(wrap_file(request.environ, f), 200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+def _send_telegram_file(file_id, mimetype, size=None, filename=None, last_modified=None):
+    """
+    Sends a Telegram file with Range support. Cached files are served from disk; otherwise a request
+    for the whole file downloads it into the cache, while a request for a range further in fetches
+    only that range. Without a known size an uncached file is simply streamed in full.
+    """
+    etag = http_range.file_etag(file_id)
+    user = session.get('user_id')
+    cached = _send_cached_file(file_id, mimetype, etag, filename, last_modified)
+    if cached is not None:
+        return cached
+
+    if size is None:
+        return Response(bot_handler.stream_and_cache_telegram_file(file_id, user=user), mimetype=mimetype)
+
+    def read_range(start, stop):
+        if start == 0 and stop == size:
+            return bot_handler.stream_and_cache_telegram_file(file_id, user=user, size=size)
+        return bot_handler.stream_telegram_range(file_id, start, stop, user, size)
+
+    return http_range.ranged_response(request, size, read_range, mimetype, etag, last_modified, filename)
+
+@views_bp.route('/download/<string:telegram_file_id>')
+def download_file(telegram_file_id):
+    file = database.get_file_by_telegram_file_id(telegram_file_id)
+    if not file:
+        abort(404)
+    return _send_telegram_file(telegram_file_id, file.mime_type or 'application/octet-stream', size=file.size,
+                               filename=file.filename, last_modified=file.upload_date)
+
 @views_bp.route('/thumbnail/<string:thumbnail_file_id>')
 def get_thumbnail(thumbnail_file_id):
-    cache_file_path = os.path.join(bot_handler.CACHE_DIR, thumbnail_file_id)
-    if os.path.exists(cache_file_path):
-        return send_file(cache_file_path, mimetype='image/jpeg')
-    file_stream = bot_handler.stream_and_cache_telegram_file(thumbnail_file_id)
-    return Response(file_stream, mimetype='image/jpeg')
+    """
+    Sends a thumbnail, or with ?w= a copy resized to about that width, as WebP when the browser accepts
+    it (or as asked with ?format=). Thumbnails never change, so browsers may cache them for good.
+    """
+    thumbnails = bot_handler.thumbnail_service
+    width = request.args.get('w', type=int)
+    width = thumbnails.pick_width(width) if width else None
+    fmt = request.args.get('format')
+    negotiated = fmt not in FORMATS
+    if negotiated:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+
+    etag = http_range.file_etag(thumbnails.key(thumbnail_file_id, width, fmt))
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={THUMBNAIL_MAX_AGE}, immutable'}
+    if width and negotiated:
+        headers['Vary'] = 'Accept'
+    if not is_resource_modified(request.environ, etag=etag.strip('"')):
+        return Response(status=304, headers=headers)
+
+    try:
+        data, mimetype = thumbnails.get(thumbnail_file_id, width, fmt)
+    except Exception as e:
+        current_app.logger.error(f"Could not serve thumbnail {thumbnail_file_id}: {e}")
+        abort(404)
+    return Response(data, headers=headers, mimetype=mimetype)
 
 @views_bp.route('/search')
 def search():
@@ -347,7 +396,8 @@ def search_results():
     max_size_unit = request.args.get('max_size_unit', 'MB')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
-    sort_by = request.args.get('sort_by', 'name')
+    # Text searches are ranked by the full-text index unless a column sort is picked
+    sort_by = request.args.get('sort_by', 'relevance' if query else 'name')
     sort_order = request.args.get('sort_order', 'asc')
     view_mode = request.args.get('view_mode', 'list')
     page = request.args.get('page', 1, type=int)
@@ -360,26 +410,8 @@ def search_results():
     min_size = convert_size_to_bytes(min_size_input, min_size_unit)
     max_size = convert_size_to_bytes(max_size_input, max_size_unit)
 
-    results = database.search_files(query, path, file_type, min_size, max_size, start_date, end_date, sort_by, sort_order)
-
-    all_items = []
-    for item in results:
-        if item.filename == '.folder_marker':
-            all_items.append({'type': 'folder', 'obj': item, 'name': os.path.basename(item.folder), 'size': 0, 'date': item.upload_date})
-        else:
-            all_items.append({'type': 'file', 'obj': item, 'name': item.filename, 'size': item.size, 'date': item.upload_date})
-
-    all_items.sort(key=lambda x: 0 if x['type'] == 'folder' else 1)
-
-    if per_page is not None:
-        total_items = len(all_items)
-        total_pages = int(math.ceil(total_items / per_page))
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_items = all_items[start:end]
-    else:
-        total_pages = 1
-        paginated_items = all_items
+    file_query, folder_query = database.search_query(query, path, file_type, min_size, max_size, start_date, end_date, sort_by)
+    paginated_items, total_pages, next_cursor, prev_cursor = _paginate(file_query, folder_query, sort_by, sort_order, page, per_page)
 
     return render_template('search.html', 
                            items=paginated_items,
@@ -398,6 +430,8 @@ def search_results():
                            page=page,
                            per_page=per_page_str,
                            total_pages=total_pages,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
                            pagination_endpoint='views.search_results')
 
 def convert_size_to_bytes(size, unit):
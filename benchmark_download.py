@@ -0,0 +1,140 @@
+"""
+Measures large-file download throughput at different parallelism degrees, end to end through the
+download registry, bot_handler's fetch and the PyrogramRunner pool, and checks every run streams
+back exactly the original bytes.
+
+Telegram is replaced by two local fakes: an HTTP server standing in for the Bot API, which answers
+getFile with "file is too big" so downloads take the MTProto path, and a fake Pyrogram client whose
+sessions each cost a setup delay and are limited to a per-session bandwidth, under a shared link cap.
+
+    python benchmark_download.py --size-mb 256 --parallelism 1,2,4,8
+"""
+import asyncio
+import hashlib
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+import bot_handler
+from cache_manager import CacheManager
+from downloads import DownloadRegistry
+from pyrogram_clients import client_manager
+
+CHUNK = bot_handler.STREAM_CHUNK_SIZE
+
+def chunk_bytes(index, size):
+    """Deterministic content for MTProto chunk `index`, different for every chunk so misordering shows."""
+    length = min(CHUNK, size - index * CHUNK)
+    seed = hashlib.sha256(index.to_bytes(8, 'little')).digest()
+    return (seed * (CHUNK // len(seed)))[:length]
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'{"ok":false,"error_code":400,"description":"Bad Request: file is too big"}'
+        self.send_response(400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class FakeMTProtoClient:
+    """Serves stream_media like Pyrogram does: one new media session per call, 1 MiB chunks from a chunk offset."""
+    is_connected = True
+
+    def __init__(self, size, session_setup, session_mbps, link_mbps):
+        self.size = size
+        self.session_setup = session_setup
+        self.session_rate = session_mbps * 1024 * 1024
+        self.link_rate = link_mbps * 1024 * 1024
+        self.sessions = 0
+        self._link_free_at = 0.0
+
+    async def _link_delay(self, nbytes):
+        # The shared link serialises transfers at link_rate on top of each session's own rate
+        loop = asyncio.get_running_loop()
+        start = max(loop.time(), self._link_free_at)
+        self._link_free_at = start + nbytes / self.link_rate
+        await asyncio.sleep(max(self._link_free_at - loop.time(), nbytes / self.session_rate))
+
+    async def stream_media(self, file_id, limit=0, offset=0):
+        self.sessions += 1
+        await asyncio.sleep(self.session_setup)
+        total_chunks = -(-self.size // CHUNK)
+        index = offset
+        while index < total_chunks and (not limit or index - offset < limit):
+            data = chunk_bytes(index, self.size)
+            await self._link_delay(len(data))
+            yield data
+            index += 1
+
+def run_once(registry, file_id, size):
+    cache = registry.cache_manager
+    start = time.perf_counter()
+    first_byte = None
+    digest = hashlib.sha256()
+    download = registry.attach(file_id, size=size)
+    try:
+        for chunk in download.tail():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            digest.update(chunk)
+    finally:
+        registry.detach(download)
+    elapsed = time.perf_counter() - start
+    cache.remove(file_id)
+    return elapsed, first_byte, digest.hexdigest()
+
+@click.command()
+@click.option('--size-mb', default=256, help='Size of the simulated file in MB.')
+@click.option('--parallelism', default='1,2,4,8', help='Comma-separated parallelism degrees to compare.')
+@click.option('--block-mb', default=16, help='Consecutive chunks each session takes at a time.')
+@click.option('--session-mbps', default=4.0, help='Bandwidth of a single simulated MTProto session, in MB/s.')
+@click.option('--link-mbps', default=100.0, help='Total simulated link bandwidth, in MB/s.')
+@click.option('--session-setup', default=0.3, help='Seconds to open each simulated media session.')
+def benchmark(size_mb, parallelism, block_mb, session_mbps, link_mbps, session_setup):
+    """Benchmark parallel chunked downloads against local fake Bot API and MTProto servers."""
+    size = size_mb * 1024 * 1024 - 12345  # a short final chunk, as real files have
+    expected = hashlib.sha256(b''.join(chunk_bytes(i, size) for i in range(-(-size // CHUNK)))).hexdigest()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    bot_handler.bot_api.api_url = f'http://127.0.0.1:{server.server_port}/botTOKEN'
+
+    client = FakeMTProtoClient(size, session_setup, session_mbps, link_mbps)
+    client_manager.client = client
+    runner = bot_handler.pyrogram_runner
+    runner.block_chunks = block_mb
+    runner.start()
+    while not runner.running:
+        time.sleep(0.01)
+
+    cache_dir = tempfile.mkdtemp(prefix='benchmark_download_')
+    registry = DownloadRegistry(CacheManager(cache_dir), bot_handler._fetch_telegram_file)
+    failed = False
+    try:
+        click.echo(f'{size / 1024 / 1024:.1f} MB file, {session_mbps} MB/s per session, {link_mbps} MB/s link, {session_setup}s session setup')
+        baseline = None
+        for degree in [int(p) for p in parallelism.split(',')]:
+            runner.parallelism = degree
+            client.sessions = 0
+            elapsed, first_byte, digest = run_once(registry, f'benchmark_{degree}', size)
+            throughput = size / 1024 / 1024 / elapsed
+            baseline = baseline or throughput
+            ok = digest == expected
+            failed = failed or not ok
+            click.echo(f'parallelism {degree:>2}: {elapsed:7.2f} s  {throughput:7.1f} MB/s  x{throughput / baseline:4.1f}  '
+                       f'first byte {first_byte:.2f} s  {client.sessions:>3} sessions  {"ok" if ok else "CONTENT MISMATCH"}')
+    finally:
+        server.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    benchmark()
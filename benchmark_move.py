@@ -0,0 +1,78 @@
+"""
+Times database.move_items, rename_item and copy_items on a folder holding a large number of files.
+
+Runs against a throwaway in-memory SQLite database by default. Set BENCHMARK_DATABASE_URL
+to point it at a scratch MySQL database instead (its tables are dropped and recreated).
+
+    python benchmark_move.py --rows 100000
+"""
+import os
+import time
+import click
+from flask import Flask
+from sqlalchemy import insert
+from models import db, File, Folder
+import database
+
+def create_benchmark_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('BENCHMARK_DATABASE_URL', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed(rows, subfolders):
+    db.drop_all()
+    db.create_all()
+    database.create_folder('root/destination')
+    for i in range(subfolders):
+        database.create_folder(f'root/source/sub{i}')
+    # A sibling sharing the prefix must not be touched by any of the operations
+    database.create_folder('root/source_sibling')
+
+    batch = []
+    for i in range(rows):
+        batch.append({
+            'filename': f'file_{i}.bin',
+            'file_id': f'file_id_{i}',
+            'folder': f'root/source/sub{i % subfolders}',
+            'size': i,
+            'mime_type': 'application/octet-stream',
+            'is_deleted': False
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(File), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(File), batch)
+    db.session.execute(insert(File), [{'filename': 'sibling.bin', 'file_id': 'sibling', 'folder': 'root/source_sibling', 'is_deleted': False}])
+    db.session.commit()
+
+def timed(label, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    click.echo(f'{label:<40} {elapsed:8.3f} s')
+
+@click.command()
+@click.option('--rows', default=100000, help='Number of files inside the folder being moved.')
+@click.option('--subfolders', default=100, help='Number of subfolders the files are spread across.')
+def benchmark(rows, subfolders):
+    """Benchmark subtree move, rename and copy."""
+    app = create_benchmark_app()
+    with app.app_context():
+        click.echo(f'Seeding {rows} files in {subfolders} subfolders...')
+        seed(rows, subfolders)
+        source_id = database.get_folder_id_by_path('root/source')
+
+        timed(f'move_items ({rows} rows)', lambda: database.move_items([{'id': source_id, 'type': 'folder'}], 'root/destination'))
+        timed(f'rename_item ({rows} rows)', lambda: database.rename_item(source_id, 'renamed', is_folder=True))
+        timed(f'copy_items ({rows} rows)', lambda: database.copy_items([{'id': source_id, 'type': 'folder'}], 'root'))
+
+        moved = File.query.filter(database._subtree_filter(File.folder, 'root/destination/renamed')).count()
+        copied = File.query.filter(database._subtree_filter(File.folder, 'root/renamed')).count()
+        sibling = File.query.filter_by(folder='root/source_sibling').count()
+        click.echo(f'Moved files: {moved}, copied files: {copied}, untouched sibling files: {sibling}, folders: {Folder.query.count()}')
+
+if __name__ == '__main__':
+    benchmark()
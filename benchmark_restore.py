@@ -0,0 +1,134 @@
+"""
+Times database.restore_items against the previous per-item work-queue implementation and checks
+that both leave the database in the same state.
+
+Runs against a throwaway in-memory SQLite database by default. Set BENCHMARK_DATABASE_URL
+to point it at a scratch MySQL database instead (its tables are dropped and recreated).
+
+    python benchmark_restore.py --rows 20000
+"""
+import os
+import sys
+import time
+import click
+from flask import Flask
+from sqlalchemy import insert, update
+from models import db, File, Folder
+import database
+
+def create_benchmark_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('BENCHMARK_DATABASE_URL', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def legacy_restore_items(items):
+    """The work-queue restore_items this benchmark replaced, kept as the reference for the end state."""
+    processed_keys = set()
+    items_to_process = [(item.get('type', 'file'), int(item['id'])) for item in items]
+
+    while items_to_process:
+        item_key = items_to_process.pop(0)
+        if item_key in processed_keys:
+            continue
+
+        item_type, item_id = item_key
+        item = Folder.query.get(item_id) if item_type == 'folder' else File.query.get(item_id)
+        if not item:
+            continue
+
+        item.is_deleted = False
+        processed_keys.add(item_key)
+
+        if item_type == 'folder':
+            folder_path = item.path
+            child_folders = Folder.query.filter(database._descendant_filter(Folder.path, folder_path)).filter(Folder.is_deleted == True).all()
+            child_files = File.query.filter(database._subtree_filter(File.folder, folder_path)).filter(File.is_deleted == True).all()
+            for child in child_folders:
+                if ('folder', child.id) not in processed_keys:
+                    items_to_process.append(('folder', child.id))
+            for child in child_files:
+                if ('file', child.id) not in processed_keys:
+                    items_to_process.append(('file', child.id))
+
+        parent_path = item.path if item_type == 'folder' else item.folder
+        for current_path in database._path_prefixes(parent_path):
+            parent_folder = Folder.query.filter_by(path=current_path).first()
+            if parent_folder and parent_folder.is_deleted:
+                parent_folder.is_deleted = False
+                processed_keys.add(('folder', parent_folder.id))
+
+    db.session.commit()
+
+def seed(rows, subfolders):
+    db.drop_all()
+    db.create_all()
+    for i in range(subfolders):
+        database.create_folder(f'root/trash/big/sub{i}')
+    database.create_folder('root/trash/small')
+    database.create_folder('root/trash/big_sibling')
+
+    batch = []
+    for i in range(rows):
+        batch.append({'filename': f'file_{i}.bin', 'file_id': f'file_id_{i}', 'folder': f'root/trash/big/sub{i % subfolders}', 'is_deleted': False})
+        if len(batch) == 10000:
+            db.session.execute(insert(File), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(File), batch)
+    db.session.execute(insert(File), [
+        {'filename': f'small_{i}.bin', 'file_id': f'small_{i}', 'folder': 'root/trash/small', 'is_deleted': False} for i in range(10)
+    ] + [{'filename': 'sibling.bin', 'file_id': 'sibling', 'folder': 'root/trash/big_sibling', 'is_deleted': False}])
+    db.session.commit()
+
+    # Delete the whole tree, then pick a restore selection mixing a big folder and single files
+    database.delete_item([{'id': database.get_folder_id_by_path('root/trash'), 'type': 'folder'}])
+    big = Folder.query.filter_by(path='root/trash/big').first()
+    small_files = File.query.filter_by(folder='root/trash/small').order_by(File.id).limit(3).all()
+    return [{'id': big.id, 'type': 'folder'}] + [{'id': f.id, 'type': 'file'} for f in small_files]
+
+def snapshot():
+    files = {r[0] for r in db.session.query(File.id).filter(File.is_deleted == True)}
+    folders = {r[0] for r in db.session.query(Folder.id).filter(Folder.is_deleted == True)}
+    return files, folders
+
+def reset(state):
+    files, folders = state
+    db.session.execute(update(File).values(is_deleted=File.id.in_(files)))
+    db.session.execute(update(Folder).values(is_deleted=Folder.id.in_(folders)))
+    db.session.commit()
+
+def timed(label, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    click.echo(f'{label:<40} {elapsed:8.3f} s')
+
+@click.command()
+@click.option('--rows', default=20000, help='Number of files inside the folder being restored.')
+@click.option('--subfolders', default=100, help='Number of subfolders the files are spread across.')
+def benchmark(rows, subfolders):
+    """Benchmark restore_items and check it matches the previous implementation."""
+    app = create_benchmark_app()
+    with app.app_context():
+        click.echo(f'Seeding {rows} deleted files in {subfolders} subfolders...')
+        items = seed(rows, subfolders)
+        deleted = snapshot()
+
+        timed(f'legacy restore_items ({rows} rows)', lambda: legacy_restore_items(items))
+        expected = snapshot()
+        reset(deleted)
+        db.session.expire_all()
+
+        timed(f'restore_items ({rows} rows)', lambda: database.restore_items(items))
+        actual = snapshot()
+
+        click.echo(f'Still deleted: {len(actual[0])} files, {len(actual[1])} folders')
+        if actual != expected:
+            click.echo('End state differs from the previous implementation.')
+            sys.exit(1)
+        click.echo('End state matches the previous implementation.')
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+class FileTooBig(Exception):
+    """getFile refused the file because it is over the Bot API download limit."""
+
+class FilePathCache:
+    """
+    Remembers the file_path getFile returned for each file_id, least recently used first. Telegram
+    keeps a file_path valid for at least an hour, so entries expire after ttl_seconds.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=55 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                return None
+            file_path, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[file_id]
+                return None
+            self._entries.move_to_end(file_id)
+            return file_path
+
+    def put(self, file_id, file_path, ttl_seconds=None):
+        """Stores file_path for file_id; a ttl_seconds of 0 keeps it until it is evicted."""
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[file_id] = (file_path, time.monotonic() + ttl_seconds if ttl_seconds else None)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class BotAPIClient:
+    """
+    Talks to the Telegram Bot API over one pooled, keep-alive requests Session with timeouts and
+    retries with exponential backoff for connection errors, 429s and 5xx responses. Resolved file
+    paths are cached, so repeat downloads of a file go straight to the file URL.
+    """
+    # Stands in the path cache for files getFile refused, which never become smaller
+    TOO_BIG = object()
+
+    def __init__(self, api_url, file_url, pool_size=16, connect_timeout=5, read_timeout=30, retries=3, backoff=0.5,
+                 path_cache_size=1024, path_ttl_seconds=55 * 60):
+        self.api_url = api_url
+        self.file_url = file_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.file_paths = FilePathCache(path_cache_size, path_ttl_seconds)
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_file_path(self, file_id):
+        """Returns the file_path of file_id, from the cache when possible. Raises FileTooBig for files over the Bot API limit."""
+        file_path = self.file_paths.get(file_id)
+        if file_path is self.TOO_BIG:
+            raise FileTooBig(file_id)
+        if file_path is not None:
+            return file_path
+
+        response = self.session.get(f"{self.api_url}/getFile", params={'file_id': file_id}, timeout=self.timeout)
+        if response.status_code == 400 and "file is too big" in response.text:
+            self.file_paths.put(file_id, self.TOO_BIG, ttl_seconds=0)
+            raise FileTooBig(file_id)
+        if not response.ok:
+            logger.error(f"HTTPError getting file_path from Telegram API. Full response: {response.text}")
+        response.raise_for_status()
+        file_path = response.json()['result']['file_path']
+        self.file_paths.put(file_id, file_path)
+        return file_path
+
+    def open_file(self, file_id, offset=0):
+        """
+        Starts a streaming download of file_id from byte `offset` and returns the response, which the
+        caller must close. A cached file_path that has expired is resolved again once.
+        """
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        for attempt in range(2):
+            cached = self.file_paths.get(file_id) is not None
+            file_path = self.get_file_path(file_id)
+            response = self.session.get(f"{self.file_url}/{file_path}", stream=True, headers=headers, timeout=self.timeout)
+            if response.status_code == 404 and cached and not attempt:
+                response.close()
+                self.file_paths.forget(file_id)
+                continue
+            if not response.ok:
+                response.close()
+            response.raise_for_status()
+            return response
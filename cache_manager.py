@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+# Segment maps, lock files and temp files of downloads are not cache entries of their own
+IGNORED_SUFFIXES = ('.map', '.lock', '.tmp')
+
+class CacheEntry:
+    """What the cache manager knows about one cached file. Incomplete entries are partly downloaded `.part` files."""
+    __slots__ = ('size', 'last_access', 'pins', 'complete', 'writing')
+
+    def __init__(self, size=0, last_access=None, complete=False):
+        self.size = size
+        self.last_access = last_access if last_access is not None else time.time()
+        self.pins = 0
+        self.complete = complete
+        self.writing = False
+
+    @property
+    def evictable(self):
+        return not self.pins and not self.writing
+
+class CacheManager:
+    """
+    Keeps an in-memory index of the files in the cache directory, in least-recently-used order,
+    with a running byte total so the cache size never needs a directory walk. Entries are evicted
+    once they have been idle longer than max_age_seconds, or least recently used first while the
+    cache is over max_bytes. Pinned entries (files being streamed) and files still being written
+    are never evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=0, max_age_seconds=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def configure(self, max_bytes=None, max_age_seconds=None):
+        """Changes the limits; 0 disables a limit. They take effect at the next eviction."""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if max_age_seconds is not None:
+            self.max_age_seconds = max_age_seconds
+
+    def path(self, file_id):
+        return os.path.join(self.cache_dir, file_id)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def scan(self):
+        """Rebuilds the index from the cache directory, using modification times as last access."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(IGNORED_SUFFIXES):
+                    stat = entry.stat()
+                    complete = not entry.name.endswith(PART_SUFFIX)
+                    file_id = entry.name if complete else entry.name[:-len(PART_SUFFIX)]
+                    found.append((stat.st_mtime, file_id, stat.st_size, complete))
+        found.sort()
+        with self._lock:
+            pinned = {file_id: entry for file_id, entry in self._entries.items() if not entry.evictable}
+            self._entries = OrderedDict((file_id, CacheEntry(size, mtime, complete)) for mtime, file_id, size, complete in found)
+            for file_id, entry in pinned.items():
+                self._entries[file_id] = entry
+            self._total_bytes = sum(entry.size for entry in self._entries.values())
+        logger.info(f"Cache index loaded: {len(self._entries)} files, {self._total_bytes} bytes.")
+
+    def adopt(self, file_id):
+        """Indexes a complete file that appeared in the cache directory, e.g. written by another process."""
+        try:
+            stat = os.stat(self.path(file_id))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                entry = self._entries[file_id] = CacheEntry()
+            elif entry.writing:
+                return
+            self._total_bytes += stat.st_size - entry.size
+            entry.size = stat.st_size
+            entry.complete = True
+            entry.last_access = time.time()
+            self._entries.move_to_end(file_id)
+
+    def lookup(self, file_id):
+        """Returns the path of a fully cached file and marks it as used, or None if it is not cached (or still downloading)."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None or not entry.complete:
+                return None
+            entry.last_access = time.time()
+            self._entries.move_to_end(file_id)
+            return self.path(file_id)
+
+    def touch(self, file_id):
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                entry.last_access = time.time()
+                self._entries.move_to_end(file_id)
+
+    @contextmanager
+    def pin(self, file_id):
+        """Keeps file_id from being evicted for the duration of the block."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                entry = self._entries[file_id] = CacheEntry()
+            entry.pins += 1
+            entry.last_access = time.time()
+            self._entries.move_to_end(file_id)
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                # A pin on a file that was never written leaves nothing behind
+                if entry.evictable and not entry.complete and not entry.size and self._entries.get(file_id) is entry:
+                    self._pop(file_id)
+
+    def begin_write(self, file_id, size=0):
+        """
+        Claims file_id for a download that (re)writes the cache file starting with `size` bytes already
+        on disk. Returns False if another download is already writing it, in which case the caller
+        should not touch the file.
+        """
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                entry = self._entries[file_id] = CacheEntry()
+            elif entry.writing:
+                return False
+            self._total_bytes += size - entry.size
+            entry.size = size
+            entry.complete = False
+            entry.writing = True
+            return True
+
+    def end_write(self, file_id):
+        """Releases a download that stopped early. Its partial file stays indexed (and evictable) until it is resumed."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                entry.writing = False
+                entry.last_access = time.time()
+
+    def finish_write(self, file_id):
+        """Marks a file claimed with begin_write as fully downloaded."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                entry.writing = False
+                entry.complete = True
+
+    def record_write(self, file_id, nbytes):
+        """Accounts for nbytes appended to a cached file, evicting other entries if that puts the cache over its size limit."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                entry = self._entries[file_id] = CacheEntry()
+            entry.size += nbytes
+            entry.last_access = time.time()
+            self._entries.move_to_end(file_id)
+            self._total_bytes += nbytes
+            victims = self._collect_over_size() if self.max_bytes and self._total_bytes > self.max_bytes else []
+        self._unlink(victims)
+
+    def remove(self, file_id, force=False):
+        """Drops a file from the cache. Pinned or downloading files are kept unless force is set. Returns True if it was removed."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and not entry.evictable and not force:
+                return False
+            victim = self._pop(file_id) if entry is not None else file_id
+        self._unlink([victim])
+        return True
+
+    def clean(self):
+        """Evicts expired entries, then least recently used ones until the cache fits in max_bytes."""
+        now = time.time()
+        with self._lock:
+            victims = []
+            if self.max_age_seconds:
+                for file_id, entry in list(self._entries.items()):
+                    # Entries are in access order, so the first fresh one ends the expired run
+                    if not self._expired(entry, now):
+                        break
+                    if entry.evictable:
+                        victims.append(self._pop(file_id))
+            victims.extend(self._collect_over_size())
+        self._unlink(victims)
+        return len(victims)
+
+    def clear(self):
+        """Removes every cached file that is not pinned or downloading."""
+        with self._lock:
+            victims = [self._pop(file_id) for file_id, entry in list(self._entries.items()) if entry.evictable]
+        self._unlink(victims)
+        return len(victims)
+
+    def _expired(self, entry, now):
+        return bool(self.max_age_seconds) and now - entry.last_access > self.max_age_seconds
+
+    def _pop(self, file_id):
+        entry = self._entries.pop(file_id)
+        self._total_bytes -= entry.size
+        return file_id
+
+    def _collect_over_size(self):
+        victims = []
+        if not self.max_bytes:
+            return victims
+        for file_id, entry in list(self._entries.items()):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if entry.evictable:
+                victims.append(self._pop(file_id))
+        return victims
+
+    def _unlink(self, file_ids):
+        for file_id in file_ids:
+            removed = False
+            for path in (self.path(file_id), self.path(file_id) + PART_SUFFIX, self.path(file_id) + '.map'):
+                try:
+                    os.remove(path)
+                    removed = True
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Could not remove cached file {path}: {e}")
+            if removed:
+                logger.info(f"Evicted {file_id} from the cache.")
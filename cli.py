@@ -1,5 +1,5 @@
 import click
-from database import init_db, add_file, create_folder, rename_item, add_vip_user, remove_vip_user, get_all_vip_users, move_items, copy_items, restore_items, permanent_delete_items, empty_recycle_bin, delete_item # Moved delete_item to end
+from database import add_files_bulk, create_folder, rename_item, move_items, copy_items, restore_items, permanent_delete_items, empty_recycle_bin, delete_item # Moved delete_item to end
 from user_handler import scan_channel_history
 from config import TELEGRAM_CHAT_ID
 import asyncio
@@ -14,16 +14,31 @@ def cli():
 @click.command()
 def initdb():
     """Initialize the database."""
-    init_db()
+    from app import app
+    from models import db
+    with app.app_context():
+        db.create_all()
     click.echo('Initialized the database.')
 
 @click.command()
 @click.option('--chat_id', default=TELEGRAM_CHAT_ID, help='Telegram Chat ID to scan.')
 def scan_history(chat_id):
     """Scan Telegram channel/group history for files."""
+    from app import app # Import app here to avoid circular dependency
     click.echo(f'Starting to scan history for chat ID: {chat_id}')
-    asyncio.run(scan_channel_history(chat_id, add_file))
-    click.echo('History scan complete.')
+    added = 0
+
+    def add_files(records):
+        nonlocal added
+        with app.app_context():
+            outcomes = add_files_bulk(records)
+        added += sum(1 for outcome in outcomes if outcome['added'])
+        for outcome in outcomes:
+            if not outcome['added']:
+                click.echo(f"Failed to add {outcome['filename']}: {outcome['error']}")
+
+    asyncio.run(scan_channel_history(chat_id, add_files))
+    click.echo(f'History scan complete. {added} files added.')
 
 @click.command()
 @click.argument('folder_path')
@@ -69,37 +84,6 @@ def delete(item_id, is_folder): # Removed db_only as it's now always logical del
         delete_item(items_to_delete, is_bulk=True) # Treat single delete as bulk for consistency
     click.echo(f'Moved "{item_id}" to recycle bin.')
 
-@click.command()
-@click.argument('user_id', type=int)
-def add_vip(user_id):
-    """Add a user to the VIP list."""
-    from app import app
-    with app.app_context():
-        add_vip_user(user_id)
-    click.echo(f'User {user_id} added as VIP.')
-
-@click.command()
-@click.argument('user_id', type=int)
-def remove_vip(user_id):
-    """Remove a user from the VIP list."""
-    from app import app
-    with app.app_context():
-        remove_vip_user(user_id)
-    click.echo(f'User {user_id} removed from VIPs.')
-
-@click.command()
-def list_vips():
-    """List all VIP users."""
-    from app import app
-    with app.app_context():
-        vips = get_all_vip_users()
-    if vips:
-        click.echo("VIP Users:")
-        for user_id in vips:
-            click.echo(f'- {user_id}')
-    else:
-        click.echo("No VIP users found.")
-
 @click.command()
 @click.argument('items_json')
 @click.argument('destination_folder')
@@ -155,13 +139,45 @@ def permanent_delete_bulk(item_ids_json):
     click.echo(f'Permanently deleted {len(item_ids)} items.')
 
 @click.command()
-def empty_recycle_bin():
+def rebuild_search_index():
+    """Rebuild the full-text filename search index for the existing catalog."""
+    from app import app
+    from search_index import rebuild_search_index as rebuild
+    with app.app_context():
+        indexed = rebuild()
+    click.echo(f'Search index rebuilt for {indexed} files.')
+
+@click.command()
+def recompute_folder_stats():
+    """Recompute folder sizes and file counts from the files table."""
+    from app import app
+    from database import recompute_folder_stats as recompute
+    with app.app_context():
+        folders = recompute()
+    click.echo(f'Folder statistics recomputed for {folders} folders.')
+
+@click.command('empty-recycle-bin')
+def empty_recycle_bin_cli():
     """Empty the recycle bin, permanently deleting all items."""
     from app import app
     with app.app_context():
         empty_recycle_bin()
     click.echo('Recycle bin emptied.')
 
+@click.command()
+@click.option('--older_than_days', type=click.IntRange(min=0), required=True, help='Purge items deleted more than this many days ago.')
+def purge_recycle_bin(older_than_days):
+    """Permanently delete recycle bin items past the retention age, in small batches."""
+    from app import app
+    from datetime import datetime, timedelta
+    from database import iter_purge, purge_scope_for_retention
+    with app.app_context():
+        purged = {'files': 0, 'folders': 0}
+        scope = purge_scope_for_retention(datetime.utcnow() - timedelta(days=older_than_days))
+        for kind, deleted in iter_purge(*scope):
+            purged[kind] += deleted
+    click.echo(f"Purged {purged['files']} files and {purged['folders']} folders.")
+
 
 cli.add_command(initdb)
 cli.add_command(scan_history)
@@ -169,15 +185,15 @@ cli.add_command(create_folder_cli)
 cli.add_command(rename)
 # cli.add_command(move) # Removed
 cli.add_command(delete)
-cli.add_command(add_vip)
-cli.add_command(remove_vip)
-cli.add_command(list_vips)
 cli.add_command(move_bulk)
 cli.add_command(copy_bulk)
 cli.add_command(delete_bulk)
 cli.add_command(restore_bulk) # Added
 cli.add_command(permanent_delete_bulk) # Added
-cli.add_command(empty_recycle_bin) # Added
+cli.add_command(empty_recycle_bin_cli) # Added
+cli.add_command(purge_recycle_bin)
+cli.add_command(rebuild_search_index)
+cli.add_command(recompute_folder_stats)
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file
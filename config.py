@@ -23,12 +23,50 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID") # 從環境變量獲取 Telegra
 API_ID = os.getenv("API_ID") # 從環境變量獲取 Telegram API ID
 API_HASH = os.getenv("API_HASH") # 從環境變量獲取 Telegram API Hash
 BOT_API_UPLOAD_LIMIT = 48 * 1024 * 1024 # 48 MB
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", 16)) # Bot API 連接池中每個主機保持的最大連接數
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", 5)) # 連接 Bot API 的超時時間（秒）
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", 30)) # 等待 Bot API 響應數據的超時時間（秒）
+BOT_API_RETRIES = int(os.getenv("BOT_API_RETRIES", 3)) # 連接錯誤、429 和 5xx 響應的最大重試次數
+BOT_API_BACKOFF = float(os.getenv("BOT_API_BACKOFF", 0.5)) # 重試的指數退避基數（秒）
+FILE_PATH_CACHE_SIZE = int(os.getenv("FILE_PATH_CACHE_SIZE", 1024)) # 緩存的 getFile file_path 數量上限
+FILE_PATH_CACHE_TTL_MINUTES = int(os.getenv("FILE_PATH_CACHE_TTL_MINUTES", 55)) # file_path 緩存時間（分鐘），Telegram 保證鏈接至少一小時有效
 MONITORED_CHAT_ID = os.getenv("MONITORED_CHAT_ID") # 從環境變量獲取監控的聊天 ID
 
 # 緩存配置
 CACHE_CLEANUP_INTERVAL_MINUTES = int(os.getenv("CACHE_CLEANUP_INTERVAL_MINUTES", 60)) # 從環境變量獲取緩存清理間隔（分鐘），默認為 60 分鐘
 CACHE_MAX_SIZE_GB = float(os.getenv("CACHE_MAX_SIZE_GB", 2.0)) # 從環境變量獲取緩存最大大小（GB），默認為 2.0 GB
 CACHE_MAX_AGE_MINUTES = int(os.getenv("CACHE_MAX_AGE_MINUTES", 10)) # 從環境變量獲取緩存最大存活時間（分鐘），默認為 10 分鐘
+CACHE_SENDFILE_MODE = os.getenv("CACHE_SENDFILE_MODE", "sendfile").lower() # 已緩存文件的發送方式：sendfile（交給 WSGI 服務器零拷貝發送）、x-accel-redirect（nginx）或 x-sendfile（Apache/lighttpd）
+CACHE_ACCEL_REDIRECT_PREFIX = os.getenv("CACHE_ACCEL_REDIRECT_PREFIX", "/cache-internal/") # x-accel-redirect 模式下 nginx 中指向緩存目錄的 internal location
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", 320)) # 上傳時生成的縮略圖最大寬度（像素）
+THUMBNAIL_HEIGHT = int(os.getenv("THUMBNAIL_HEIGHT", 320)) # 上傳時生成的縮略圖最大高度（像素）
+THUMBNAIL_VARIANT_WIDTHS = [int(w) for w in os.getenv("THUMBNAIL_VARIANT_WIDTHS", "64,128,256,512,1024").split(",")] # 縮略圖可生成的寬度（像素），請求的寬度向上取到其中之一
+THUMBNAIL_MEMORY_CACHE_MB = int(os.getenv("THUMBNAIL_MEMORY_CACHE_MB", 32)) # 內存中緩存的熱門縮略圖總大小上限（MB）
+THUMBNAIL_DISK_CACHE_MB = int(os.getenv("THUMBNAIL_DISK_CACHE_MB", 256)) # 磁盤上縮放後的縮略圖總大小上限（MB）
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80)) # 縮放後 WebP/JPEG 的壓縮質量
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2)) # 生成上傳縮略圖（Pillow 解碼、ffmpeg 截圖）的進程數
+UPLOAD_THUMBNAIL_CACHE_DIR = os.getenv("UPLOAD_THUMBNAIL_CACHE_DIR", "./cache/upload_thumbnails") # 上傳縮略圖按文件內容緩存的目錄
+UPLOAD_THUMBNAIL_CACHE_MB = int(os.getenv("UPLOAD_THUMBNAIL_CACHE_MB", 64)) # 上傳縮略圖緩存的總大小上限（MB）
+
+# 大文件下載配置
+PYROGRAM_WORKERS = int(os.getenv("PYROGRAM_WORKERS", 4)) # 同時進行的 Pyrogram 下載數上限（全局）
+PYROGRAM_MAX_DOWNLOADS_PER_USER = int(os.getenv("PYROGRAM_MAX_DOWNLOADS_PER_USER", 2)) # 每個用戶同時進行的 Pyrogram 下載數上限
+PYROGRAM_DOWNLOAD_PARALLELISM = int(os.getenv("PYROGRAM_DOWNLOAD_PARALLELISM", 4)) # 單個大文件同時下載的分段數（每段一個 MTProto 會話），1 表示順序下載
+PYROGRAM_PARALLEL_BLOCK_MB = int(os.getenv("PYROGRAM_PARALLEL_BLOCK_MB", 16)) # 並行下載時每個會話一次領取的連續分塊大小（MB）
+BOT_CLIENT_POOL_SIZE = int(os.getenv("BOT_CLIENT_POOL_SIZE", 2)) # 上傳、刪除等操作共用的 Pyrogram Bot 客戶端數量
+BOT_CLIENT_HEALTH_CHECK_SECONDS = int(os.getenv("BOT_CLIENT_HEALTH_CHECK_SECONDS", 60)) # 客戶端閒置超過此秒數後，借出前先檢查連接是否正常
+PREWARM_WORKERS = int(os.getenv("PREWARM_WORKERS", 2)) # 預先緩存文件的後台線程數
+PREWARM_MAX_QUEUED_FILES = int(os.getenv("PREWARM_MAX_QUEUED_FILES", 500)) # 預先緩存隊列中最多等待的文件數
+PREWARM_CACHE_SHARE = float(os.getenv("PREWARM_CACHE_SHARE", 0.5)) # 排隊中的預先緩存文件總大小最多佔緩存上限的比例
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 2)) # 同時上傳到 Telegram 的文件數，每個上傳佔用一個 Bot 客戶端（見 BOT_CLIENT_POOL_SIZE）
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", "./uploads") # 等待上傳的文件在本地暫存的目錄
+UPLOAD_STREAM_BUFFER_MB = int(os.getenv("UPLOAD_STREAM_BUFFER_MB", 8)) # 串流上傳時，從瀏覽器收到但尚未發往 Telegram 的數據上限（MB）
+UPLOAD_STREAM_PARALLEL_PARTS = int(os.getenv("UPLOAD_STREAM_PARALLEL_PARTS", 4)) # 串流上傳時同時發往 Telegram 的分塊數
+
+# 回收站配置
+RECYCLE_BIN_RETENTION_DAYS = int(os.getenv("RECYCLE_BIN_RETENTION_DAYS", 0)) # 回收站項目保留天數，超過後自動永久刪除，0 表示不自動清理
+RECYCLE_BIN_PURGE_INTERVAL_MINUTES = int(os.getenv("RECYCLE_BIN_PURGE_INTERVAL_MINUTES", 60)) # 自動清理回收站的檢查間隔（分鐘），默認為 60 分鐘
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", 500)) # 永久刪除時每個事務刪除的最大行數
 
 # 管理員憑據配置
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin") # 從環境變量獲取管理員用戶名，默認為 "admin"
@@ -1,27 +1,287 @@
-from models import db, File, User, UserPath
-from sqlalchemy import and_, or_, not_
+from models import db, File, Folder, FolderStats, User, UserPath, UploadTask
+from search_index import get_search_index, rebuild_search_index, RELEVANCE
+from acl import get_user_acl, invalidate_user_acl
+from sqlalchemy import and_, or_, not_, func, literal, insert, select, update, delete, exists, inspect, false, true, bindparam, text
+from sqlalchemy.orm import aliased
+from datetime import datetime
 import logging
 import os
 
+FILE_SORT_COLUMNS = {
+    'name': File.filename,
+    'size': File.size,
+    'date': File.upload_date,
+    'type': File.mime_type,
+    'folder': File.folder,
+}
+
+# Folder sizes come from folder_stats. Folders have no type of their own, and are not in
+# the filename search index, so those sorts fall back to the name
+FOLDER_SORT_COLUMNS = {
+    'name': Folder.name,
+    'size': FolderStats.total_size,
+    'date': Folder.upload_date,
+    'type': Folder.name,
+    'folder': Folder.path,
+    RELEVANCE: Folder.name,
+}
+
+def _sort_key_column(model, sort_by):
+    if model is Folder:
+        return FOLDER_SORT_COLUMNS.get(sort_by, Folder.upload_date)
+    return FILE_SORT_COLUMNS.get(sort_by, File.upload_date)
+
+def _sort_value(item, column):
+    """The value of a sort column for a loaded row, following it into folder_stats if needed."""
+    if column.class_ is FolderStats:
+        return getattr(item.stats, column.key) if item.stats else None
+    return getattr(item, column.key)
+
+def _join_sort_table(query, model, sort_by):
+    """Joins folder_stats into a folder query that is sorted by one of its columns."""
+    if model is Folder and _sort_key_column(Folder, sort_by).class_ is FolderStats:
+        return query.outerjoin(FolderStats, FolderStats.folder_id == Folder.id)
+    return query
+
+def _sort_column(model, sort_by, sort_order):
+    column = _sort_key_column(model, sort_by)
+    return column.desc() if sort_order == 'desc' else column.asc()
+
+# Indexes older databases may still carry that the composite indexes on the models now cover
+OBSOLETE_INDEXES = {
+    'files': ['ix_files_is_deleted'],
+    'folders': ['ix_folders_parent_id', 'ix_folders_is_deleted'],
+}
+
+def ensure_columns():
+    """Adds nullable columns declared on the models that are missing from an existing database."""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append(f'{table.name}.{column.name}')
+    if added:
+        logging.info(f"Added database columns: {', '.join(added)}")
+    return added
+
+def _rebuild_sqlite_table(connection, table):
+    """
+    SQLite cannot drop NOT NULL with ALTER TABLE, so the table is recreated from the model
+    and its rows copied over. Columns the model no longer declares are not carried across.
+    """
+    old_name = f'{table.name}_old'
+    existing = [column['name'] for column in inspect(connection).get_columns(table.name)]
+    old_indexes = [index['name'] for index in inspect(connection).get_indexes(table.name)]
+    connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {old_name}'))
+    # The renamed table keeps its indexes under the same names, which the new table needs
+    for name in old_indexes:
+        connection.execute(text(f'DROP INDEX {name}'))
+    table.create(connection)
+    columns = ', '.join(column.name for column in table.columns if column.name in existing)
+    connection.execute(text(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {old_name}'))
+    connection.execute(text(f'DROP TABLE {old_name}'))
+
+def relax_not_null_columns():
+    """Drops NOT NULL from existing columns that the models now declare nullable."""
+    inspector = inspect(db.engine)
+    relaxed = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        not_null = {column['name'] for column in inspector.get_columns(table.name) if not column['nullable']}
+        columns = [column for column in table.columns
+                   if column.name in not_null and column.nullable and not column.primary_key]
+        if not columns:
+            continue
+        with db.engine.begin() as connection:
+            if db.engine.dialect.name == 'sqlite':
+                _rebuild_sqlite_table(connection, table)
+            else:
+                for column in columns:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} MODIFY {column.name} {column_type} NULL'))
+        relaxed.extend(f'{table.name}.{column.name}' for column in columns)
+    if relaxed:
+        logging.info(f"Made database columns nullable: {', '.join(relaxed)}")
+    return relaxed
+
+def backfill_deleted_at():
+    """Items that went into the recycle bin before deletion times were recorded count as deleted now."""
+    now = datetime.utcnow()
+    for model in (File, Folder):
+        db.session.execute(
+            update(model).where(model.is_deleted == True, model.deleted_at.is_(None)).values(deleted_at=now),
+            execution_options={'synchronize_session': False}
+        )
+    db.session.commit()
+
+def ensure_indexes():
+    """Creates indexes declared on the models that are missing from an existing database and drops obsolete ones."""
+    inspector = inspect(db.engine)
+    changed = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name']: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                changed.append(f'+{index.name}')
+        for name in OBSOLETE_INDEXES.get(table.name, []):
+            if name in existing:
+                # Dropped by name: an Index built on the model's columns would attach itself to the
+                # model's table, and the next create would bring it back
+                on_table = f' ON {table.name}' if db.engine.dialect.name == 'mysql' else ''
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'DROP INDEX {name}{on_table}'))
+                changed.append(f'-{name}')
+    if changed:
+        logging.info(f"Updated database indexes: {', '.join(changed)}")
+    return changed
+
 def get_all_files(sort_by='date', sort_order='desc'):
-    query = File.query.filter(File.filename != '.folder_marker', File.is_deleted == False)
+    query = File.query.filter(File.is_deleted == False)
     if sort_by and sort_order:
-        if sort_by == 'name':
-            order = File.filename.desc() if sort_order == 'desc' else File.filename.asc()
-        elif sort_by == 'size':
-            order = File.size.desc() if sort_order == 'desc' else File.size.asc()
-        elif sort_by == 'date':
-            order = File.upload_date.desc() if sort_order == 'desc' else File.upload_date.asc()
-        elif sort_by == 'type':
-            order = File.mime_type.desc() if sort_order == 'desc' else File.mime_type.asc()
-        elif sort_by == 'folder':
-            order = File.folder.desc() if sort_order == 'desc' else File.folder.asc()
+        query = query.order_by(_sort_column(File, sort_by, sort_order))
+    return query.all()
+
+def _count(query):
+    if query is None:
+        return 0
+    return query.order_by(None).with_entities(func.count()).scalar()
+
+def _keyset_filter(column, id_column, value, last_id, descending):
+    """
+    Rows strictly after (value, last_id) in ORDER BY column, id (both in the same direction).
+    SQLite and MySQL both sort NULLs first ascending and last descending.
+    """
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < last_id)
+        return or_(column < value, and_(column == value, id_column < last_id), column.is_(None))
+    if value is None:
+        return or_(column.is_not(None), id_column > last_id)
+    return or_(column > value, and_(column == value, id_column > last_id))
+
+def _fetch_segment(query, model, sort_by, descending, after=None, limit=None, offset=None):
+    """Fetches one ordered slice of query, optionally continuing after the row `after`."""
+    if query is None or limit == 0:
+        return []
+    if sort_by == RELEVANCE and model is File:
+        # The search index has already ordered the query by its relevance score
+        pass
+    else:
+        column = _sort_key_column(model, sort_by)
+        query = _join_sort_table(query, model, sort_by)
+        if after is not None:
+            query = query.filter(_keyset_filter(column, model.id, _sort_value(after, column), after.id, descending))
+        if descending:
+            query = query.order_by(column.desc(), model.id.desc())
         else:
-            order = File.upload_date.desc()
-        query = query.order_by(order)
+            query = query.order_by(column.asc(), model.id.asc())
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
     return query.all()
 
-def add_file(filename, file_id, folder, size=None, mime_type=None, thumbnail_file_id=None, message_link=None):
+def _cursor_for(item):
+    return f"{'folder' if isinstance(item, Folder) else 'file'}:{item.id}"
+
+def _item_for_cursor(cursor):
+    try:
+        item_type, item_id = cursor.split(':', 1)
+        model = Folder if item_type == 'folder' else File
+        return model, model.query.get(int(item_id))
+    except (AttributeError, ValueError):
+        return None, None
+
+def paginate_files_and_folders(file_query, folder_query, sort_by, sort_order, per_page, page=1, cursor=None, before=None):
+    """
+    Returns one page of a listing where folders come before files, each ordered by sort_by.
+
+    Pages are cut in SQL with keyset pagination: `cursor` continues after the given item and
+    `before` walks back from it, so following Next/Previous links costs the same on any page.
+    Without a cursor the page number is turned into an OFFSET. Cursors are "folder:<id>" or
+    "file:<id>" strings. Returns (files, folders, total_items, next_cursor, prev_cursor).
+    Relevance scores are not stored on the rows, so relevance-ordered pages always use OFFSET.
+    """
+    if sort_by == RELEVANCE:
+        cursor = before = None
+
+    folder_count = _count(folder_query)
+    total_items = _count(file_query) + folder_count
+    descending = sort_order == 'desc'
+
+    if per_page is None:
+        folders = _fetch_segment(folder_query, Folder, sort_by, descending)
+        files = _fetch_segment(file_query, File, sort_by, descending)
+        return files, folders, total_items, None, None
+
+    cursor_model, cursor_item = _item_for_cursor(cursor) if cursor else (None, None)
+    before_model, before_item = _item_for_cursor(before) if before else (None, None)
+
+    if before_item is not None:
+        # Walk backwards by flipping the sort direction, then restore the display order
+        files = []
+        if before_model is File:
+            files = _fetch_segment(file_query, File, sort_by, not descending, after=before_item, limit=per_page + 1)
+        folders = []
+        if len(files) <= per_page:
+            folders = _fetch_segment(folder_query, Folder, sort_by, not descending,
+                                     after=before_item if before_model is Folder else None,
+                                     limit=per_page + 1 - len(files))
+        has_prev = len(files) + len(folders) > per_page
+        if len(files) > per_page:
+            files = files[:per_page]
+        else:
+            folders = folders[:per_page - len(files)]
+        folders.reverse()
+        files.reverse()
+        has_next = True
+    elif cursor_item is not None:
+        folders = []
+        if cursor_model is Folder:
+            folders = _fetch_segment(folder_query, Folder, sort_by, descending, after=cursor_item, limit=per_page + 1)
+        files = []
+        if len(folders) <= per_page:
+            files = _fetch_segment(file_query, File, sort_by, descending,
+                                   after=cursor_item if cursor_model is File else None,
+                                   limit=per_page + 1 - len(folders))
+        has_next = len(folders) + len(files) > per_page
+        has_prev = True
+    else:
+        offset = max(page - 1, 0) * per_page
+        folders = []
+        if offset < folder_count:
+            folders = _fetch_segment(folder_query, Folder, sort_by, descending, limit=per_page + 1, offset=offset)
+        files = []
+        if len(folders) <= per_page:
+            files = _fetch_segment(file_query, File, sort_by, descending,
+                                   limit=per_page + 1 - len(folders), offset=max(offset - folder_count, 0))
+        has_next = len(folders) + len(files) > per_page
+        has_prev = offset > 0
+
+    if before_item is None:
+        if len(folders) > per_page:
+            folders = folders[:per_page]
+        else:
+            files = files[:per_page - len(folders)]
+
+    page_items = folders + files
+    next_cursor = _cursor_for(page_items[-1]) if has_next and page_items and sort_by != RELEVANCE else None
+    prev_cursor = _cursor_for(page_items[0]) if has_prev and page_items and sort_by != RELEVANCE else None
+    return files, folders, total_items, next_cursor, prev_cursor
+
+def add_file(filename, file_id, folder, size=None, mime_type=None, thumbnail_file_id=None, message_link=None,
+             content_hash=None, file_unique_id=None):
     new_file = File(
         filename=filename, 
         file_id=file_id, 
@@ -29,121 +289,455 @@ def add_file(filename, file_id, folder, size=None, mime_type=None, thumbnail_fil
         size=size, 
         mime_type=mime_type, 
         thumbnail_file_id=thumbnail_file_id, 
-        message_link=message_link
+        message_link=message_link,
+        content_hash=content_hash,
+        file_unique_id=file_unique_id
     )
     db.session.add(new_file)
+    _apply_folder_stats_delta([(folder, size, 1)])
     db.session.commit()
 
+FILE_RECORD_FIELDS = ('filename', 'file_id', 'folder', 'size', 'mime_type', 'thumbnail_file_id', 'message_link',
+                      'content_hash', 'file_unique_id')
+
+def find_file_by_content(content_hash=None, file_unique_id=None):
+    """
+    An existing file row with the same content, preferring live rows, or None. Rows in the recycle bin
+    count too: purging only drops the row, the Telegram message and its file_id stay valid.
+    """
+    criteria = []
+    if content_hash:
+        criteria.append(File.content_hash == content_hash)
+    if file_unique_id:
+        criteria.append(File.file_unique_id == file_unique_id)
+    if not criteria:
+        return None
+    return File.query.filter(or_(*criteria)).order_by(File.is_deleted, File.id.desc()).first()
+
+def _share_known_file_ids(rows):
+    """Points rows at the file_id already stored for their file_unique_id, so copies of one file share a cache entry."""
+    unique_ids = {row['file_unique_id'] for row in rows if row.get('file_unique_id')}
+    if not unique_ids:
+        return
+    known = {}
+    for file_unique_id, file_id, content_hash in db.session.query(File.file_unique_id, File.file_id, File.content_hash) \
+            .filter(File.file_unique_id.in_(unique_ids)).order_by(File.is_deleted.desc(), File.id):
+        known[file_unique_id] = (file_id, content_hash)
+    for row in rows:
+        if row.get('file_unique_id') in known:
+            file_id, content_hash = known[row['file_unique_id']]
+            row['file_id'] = file_id
+            row['content_hash'] = row.get('content_hash') or content_hash
+
+def add_files_bulk(records):
+    """
+    Adds many files in one transaction. records are dicts with the add_file arguments.
+    Every folder they need is resolved and created once, and the rows go in as a single executemany.
+    A record whose file_unique_id is already known reuses the stored file_id.
+    Returns one outcome per record, in order: {'filename', 'added', 'error'}.
+    """
+    outcomes = []
+    rows = []
+    for record in records:
+        outcome = {'filename': record.get('filename'), 'added': False, 'error': None}
+        outcomes.append(outcome)
+        if not record.get('filename') or not record.get('file_id') or not (record.get('folder') or '').strip('/'):
+            outcome['error'] = 'filename, file_id and folder are required'
+            continue
+        row = {field: record.get(field) for field in FILE_RECORD_FIELDS}
+        row['folder'] = row['folder'].strip('/')
+        row['upload_date'] = datetime.utcnow()
+        row['is_deleted'] = False
+        rows.append((outcome, row))
+
+    if not rows:
+        return outcomes
+
+    try:
+        _share_known_file_ids([row for _, row in rows])
+        _ensure_folder_paths_exist({row['folder'] for _, row in rows})
+        db.session.execute(insert(File), [row for _, row in rows])
+        _apply_folder_stats_delta([(row['folder'], row['size'], 1) for _, row in rows])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Bulk insert of {len(rows)} files failed: {e}")
+        for outcome, _ in rows:
+            outcome['error'] = str(e)
+        return outcomes
+
+    for outcome, _ in rows:
+        outcome['added'] = True
+    return outcomes
+
 def get_files_by_folder(folder):
     return File.query.filter_by(folder=folder, is_deleted=False).all()
 
 def get_all_folders():
-    return [r[0] for r in db.session.query(File.folder).filter(File.is_deleted == False).distinct()]
+    return [r[0] for r in db.session.query(Folder.path).filter(Folder.is_deleted == False).order_by(Folder.path)]
+
+def _path_prefixes(folder_path):
+    """Returns every ancestor path of folder_path, including itself, from the top down."""
+    parts = folder_path.split('/')
+    return ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+
+def _descendant_filter(column, folder_path):
+    """
+    Matches every path strictly below folder_path as an index-friendly range.
+    '0' is the character right after '/', so 'root/a' never matches 'root/ab'.
+    """
+    return and_(column >= folder_path + '/', column < folder_path + '0')
+
+def _subtree_filter(column, folder_path):
+    """Matches folder_path itself and everything below it, but not siblings sharing its prefix."""
+    return or_(column == folder_path, _descendant_filter(column, folder_path))
+
+def _rebased_path(column, old_path, new_path):
+    """SQL expression that swaps the old_path prefix of column for new_path."""
+    return literal(new_path) + func.substr(column, len(old_path) + 1)
+
+def _ensure_folder_paths_exist(folder_paths):
+    """
+    Ensures that every folder along each of the given paths exists in the folders table, without committing.
+    Existing folders are looked up in one query and missing ones are created one depth level at a time.
+    Deleted ones are brought back. Returns a {path: Folder} dict covering every path and its ancestors.
+    """
+    prefixes = sorted({prefix for path in folder_paths if path for prefix in _path_prefixes(path)},
+                      key=lambda p: p.count('/'))
+    if not prefixes:
+        return {}
+    folders = {f.path: f for f in Folder.query.filter(Folder.path.in_(prefixes)).all()}
+
+    current_depth = None
+    for current_path in prefixes:
+        depth = current_path.count('/')
+        if depth != current_depth:
+            # Folders created at the previous depth need their ids before their children can point at them
+            db.session.flush()
+            current_depth = depth
+        folder = folders.get(current_path)
+        if folder is None:
+            parent = folders.get(os.path.dirname(current_path))
+            folder = Folder(
+                parent_id=parent.id if parent else None,
+                name=os.path.basename(current_path),
+                depth=depth,
+                path=current_path
+            )
+            db.session.add(folder)
+            folders[current_path] = folder
+        elif folder.is_deleted:
+            folder.is_deleted = False
+    db.session.flush()
+    return folders
 
 def _ensure_folder_path_exists(folder_path):
     """
-    Ensures that all parent folders for a given path exist in the database as .folder_marker files.
-    If they don't exist, they are created.
+    Ensures that every folder along the given path exists in the folders table.
+    Missing folders are created and deleted ones are brought back. Returns the leaf folder.
     """
-    if not folder_path or folder_path == 'root':
-        return
-    
-    parts = folder_path.split('/')
-    current_path = ''
-    for part in parts:
-        if current_path == '':
-            current_path = part
-        else:
-            current_path = f"{current_path}/{part}"
-        
-        # Use SQLAlchemy session to query for the folder marker
-        folder_marker = File.query.filter_by(folder=current_path, filename='.folder_marker').first()
-        
-        if not folder_marker:
-            # Use the existing SQLAlchemy-based create_folder function
-            create_folder(current_path)
+    if not folder_path:
+        return None
+
+    folders = _ensure_folder_paths_exist([folder_path])
+    db.session.commit()
+    return folders[folder_path]
 
 def create_folder(folder_path):
-    new_folder = File(filename=".folder_marker", file_id="FOLDER_MARKER", folder=folder_path, mime_type="application/x-folder")
-    db.session.add(new_folder)
+    return _ensure_folder_path_exists(folder_path.strip('/'))
+
+def _folder_totals(*criteria, is_deleted=False):
+    """Returns [(folder, size, count)] for the files matching criteria, grouped by the folder they are directly in."""
+    rows = db.session.query(File.folder, func.coalesce(func.sum(File.size), 0), func.count(File.id)) \
+        .filter(File.is_deleted == is_deleted, *criteria).group_by(File.folder)
+    return [(folder, size, count) for folder, size, count in rows]
+
+def _negated(totals):
+    return [(folder, -size, -count) for folder, size, count in totals]
+
+def _apply_folder_stats_delta(totals):
+    """
+    Adds (folder, size, count) deltas to folder_stats. Each delta is rolled up to the folder and
+    all of its ancestors in Python, then applied with one executemany UPDATE.
+    """
+    rolled = {}
+    for folder_path, size, count in totals:
+        for prefix in _path_prefixes(folder_path):
+            total_size, file_count = rolled.get(prefix, (0, 0))
+            rolled[prefix] = (total_size + (size or 0), file_count + count)
+    rolled = {path: delta for path, delta in rolled.items() if delta != (0, 0)}
+    if not rolled:
+        return
+
+    folder_ids = dict(db.session.query(Folder.path, Folder.id).filter(Folder.path.in_(rolled)))
+    if not folder_ids:
+        return
+    existing = {r[0] for r in db.session.query(FolderStats.folder_id).filter(FolderStats.folder_id.in_(folder_ids.values()))}
+    missing = [folder_id for folder_id in folder_ids.values() if folder_id not in existing]
+    if missing:
+        db.session.execute(insert(FolderStats.__table__), [{'folder_id': folder_id, 'total_size': 0, 'file_count': 0} for folder_id in missing])
+
+    stats = FolderStats.__table__
+    db.session.execute(
+        update(stats).where(stats.c.folder_id == bindparam('b_folder_id')).values(
+            total_size=stats.c.total_size + bindparam('b_size'),
+            file_count=stats.c.file_count + bindparam('b_count'),
+            last_modified=bindparam('b_now')
+        ),
+        [{'b_folder_id': folder_ids[path], 'b_size': size, 'b_count': count, 'b_now': datetime.utcnow()}
+         for path, (size, count) in rolled.items() if path in folder_ids]
+    )
+
+def recompute_folder_stats():
+    """Rebuilds folder_stats from the files table. Returns the number of folders with statistics."""
+    direct = db.session.query(
+        File.folder, func.coalesce(func.sum(File.size), 0), func.count(File.id), func.max(File.upload_date)
+    ).filter(File.is_deleted == False).group_by(File.folder)
+
+    rolled = {}
+    for folder_path, size, count, last_modified in direct:
+        for prefix in _path_prefixes(folder_path):
+            total_size, file_count, latest = rolled.get(prefix, (0, 0, None))
+            rolled[prefix] = (total_size + size, file_count + count,
+                              max(latest, last_modified) if latest and last_modified else latest or last_modified)
+
+    db.session.execute(delete(FolderStats))
+    rows = []
+    for folder_id, path in db.session.query(Folder.id, Folder.path):
+        total_size, file_count, last_modified = rolled.get(path, (0, 0, None))
+        rows.append({'folder_id': folder_id, 'total_size': total_size, 'file_count': file_count, 'last_modified': last_modified})
+    if rows:
+        db.session.execute(insert(FolderStats.__table__), rows)
     db.session.commit()
+    return len(rows)
 
-def delete_item(item_ids, is_bulk=False):
-    if not isinstance(item_ids, list):
-        item_ids = [item_ids]
+def migrate_folder_markers():
+    """
+    Converts legacy .folder_marker rows in the files table into Folder rows.
+    Folders that only exist implicitly through file paths are created as well.
+    """
+    live_paths = {'root'}
+    deleted_paths = set()
+    created_dates = {}
+
+    markers = File.query.filter_by(filename='.folder_marker').order_by(File.id).all()
+    for marker in markers:
+        path = marker.folder.strip('/')
+        if not path:
+            continue
+        created_dates.setdefault(path, marker.upload_date)
+        (deleted_paths if marker.is_deleted else live_paths).add(path)
+
+    file_folders = db.session.query(File.folder, File.is_deleted).filter(File.filename != '.folder_marker').distinct()
+    for path, is_deleted in file_folders:
+        path = path.strip('/')
+        if path:
+            (deleted_paths if is_deleted else live_paths).add(path)
+
+    # A folder stays visible if anything visible lives in or below it.
+    live_paths = {prefix for path in live_paths for prefix in _path_prefixes(path)}
+    deleted_paths = {prefix for path in deleted_paths for prefix in _path_prefixes(path)} - live_paths
+
+    folders_by_path = {f.path: f for f in Folder.query.all()}
+    for path in sorted(live_paths | deleted_paths, key=lambda p: p.count('/')):
+        if path in folders_by_path:
+            continue
+        parent = folders_by_path.get(os.path.dirname(path))
+        folder = Folder(
+            parent_id=parent.id if parent else None,
+            name=os.path.basename(path),
+            depth=path.count('/'),
+            path=path,
+            upload_date=created_dates.get(path),
+            is_deleted=path in deleted_paths
+        )
+        db.session.add(folder)
+        db.session.flush()
+        folders_by_path[path] = folder
+
+    File.query.filter_by(filename='.folder_marker').delete(synchronize_session=False)
+    db.session.commit()
+    logging.info(f"Migrated {len(markers)} folder markers into {len(folders_by_path)} folders.")
 
-    for item_id in item_ids:
-        item = File.query.get(item_id)
-        if item:
-            if item.filename == '.folder_marker':
-                # This is a folder. Mark the folder and all its contents as deleted.
-                folder_path = item.folder
-                File.query.filter(or_(File.folder == folder_path, File.folder.like(f'{folder_path}/%'))).update(
-                    {File.is_deleted: True}, synchronize_session=False
+def _move_folder_subtree(folder, new_path, new_parent):
+    """
+    Re-points a folder, its descendant folders and the files inside them at new_path.
+    Each table is rewritten with a single UPDATE, so no descendant rows are loaded.
+    """
+    old_path = folder.path
+    if new_path == old_path:
+        return
+    if Folder.query.filter_by(path=new_path).first():
+        raise ValueError(f'A folder named "{new_path}" already exists.')
+
+    new_depth = new_parent.depth + 1 if new_parent else 0
+    depth_delta = new_depth - folder.depth
+
+    # Stats inside the subtree move with the folder ids; only the old and new ancestors change
+    size, count = db.session.query(func.coalesce(func.sum(File.size), 0), func.count(File.id)) \
+        .filter(_subtree_filter(File.folder, old_path), File.is_deleted == False).one()
+    _apply_folder_stats_delta([(os.path.dirname(old_path), -size, -count), (os.path.dirname(new_path), size, count)])
+
+    db.session.execute(
+        update(Folder)
+        .where(_descendant_filter(Folder.path, old_path))
+        .values(path=_rebased_path(Folder.path, old_path, new_path), depth=Folder.depth + depth_delta)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(File)
+        .where(_subtree_filter(File.folder, old_path))
+        .values(folder=_rebased_path(File.folder, old_path, new_path))
+        .execution_options(synchronize_session=False)
+    )
+
+    folder.path = new_path
+    folder.name = os.path.basename(new_path)
+    folder.depth = new_depth
+    folder.parent_id = new_parent.id if new_parent else None
+
+def _copy_folder_subtree(folder, new_path):
+    """
+    Copies the live contents of folder to new_path with INSERT ... SELECT statements:
+    one per folder depth (so each level can resolve its new parent) and one for all files.
+    Folders that already exist at the destination are merged into rather than duplicated.
+    """
+    old_path = folder.path
+    new_root = _ensure_folder_path_exists(new_path)
+    depth_delta = new_root.depth - folder.depth
+    copied_totals = [(new_path + path[len(old_path):], size, count)
+                     for path, size, count in _folder_totals(_subtree_filter(File.folder, old_path))]
+
+    source = aliased(Folder)
+    source_parent = aliased(Folder)
+    new_parent = aliased(Folder)
+    existing = aliased(Folder)
+    now = datetime.utcnow()
+
+    max_depth = db.session.query(func.max(Folder.depth)).filter(
+        _descendant_filter(Folder.path, old_path), Folder.is_deleted == False
+    ).scalar()
+    for depth in range(folder.depth + 1, (max_depth or folder.depth) + 1):
+        level = (
+            select(
+                new_parent.id,
+                source.name,
+                source.depth + depth_delta,
+                _rebased_path(source.path, old_path, new_path),
+                literal(now),
+                literal(False)
+            )
+            .select_from(source)
+            .join(source_parent, source_parent.id == source.parent_id)
+            .join(new_parent, new_parent.path == _rebased_path(source_parent.path, old_path, new_path))
+            .where(
+                _descendant_filter(source.path, old_path),
+                source.depth == depth,
+                source.is_deleted == False,
+                ~exists().where(existing.path == _rebased_path(source.path, old_path, new_path))
+            )
+        )
+        db.session.execute(insert(Folder).from_select(
+            ['parent_id', 'name', 'depth', 'path', 'upload_date', 'is_deleted'], level
+        ))
+
+    files = select(
+        File.filename,
+        File.file_id,
+        _rebased_path(File.folder, old_path, new_path),
+        File.size,
+        File.mime_type,
+        File.thumbnail_file_id,
+        File.cover_file_id,
+        File.message_link,
+        File.content_hash,
+        File.file_unique_id,
+        literal(now),
+        literal(False)
+    ).where(_subtree_filter(File.folder, old_path), File.is_deleted == False)
+    db.session.execute(insert(File).from_select(
+        ['filename', 'file_id', 'folder', 'size', 'mime_type', 'thumbnail_file_id', 'cover_file_id', 'message_link',
+         'content_hash', 'file_unique_id', 'upload_date', 'is_deleted'],
+        files
+    ))
+    _apply_folder_stats_delta(copied_totals)
+
+def delete_item(items, is_bulk=False):
+    if not isinstance(items, list):
+        items = [items]
+
+    for item_data in items:
+        if item_data['type'] == 'folder':
+            # This is a folder. Mark the folder and all its contents as deleted.
+            folder = Folder.query.get(item_data['id'])
+            if folder:
+                now = datetime.utcnow()
+                _apply_folder_stats_delta(_negated(_folder_totals(_subtree_filter(File.folder, folder.path))))
+                Folder.query.filter(_subtree_filter(Folder.path, folder.path), Folder.is_deleted == False).update(
+                    {Folder.is_deleted: True, Folder.deleted_at: now}, synchronize_session=False
                 )
-            else:
-                # This is a file. Mark it as deleted.
+                File.query.filter(_subtree_filter(File.folder, folder.path), File.is_deleted == False).update(
+                    {File.is_deleted: True, File.deleted_at: now}, synchronize_session=False
+                )
+        else:
+            # This is a file. Mark it as deleted.
+            item = File.query.get(item_data['id'])
+            if item and not item.is_deleted:
                 item.is_deleted = True
+                item.deleted_at = datetime.utcnow()
+                _apply_folder_stats_delta([(item.folder, -(item.size or 0), -1)])
     db.session.commit()
 
 def rename_item(item_id, new_name, is_folder=False, current_folder=None):
-    item = File.query.get(item_id)
-    if not item:
-        return
-
     if is_folder:
-        old_full_path = item.folder
-        parent_path = os.path.dirname(old_full_path)
+        folder = Folder.query.get(item_id)
+        if not folder:
+            return
+        parent_path = os.path.dirname(folder.path)
         new_full_path = os.path.join(parent_path, new_name).replace('\\', '/')
-        # Update all affected paths
-        files_to_update = File.query.filter(or_(File.folder == old_full_path, File.folder.like(old_full_path + '%'))).all()
-        for file_to_update in files_to_update:
-            file_to_update.folder = file_to_update.folder.replace(old_full_path, new_full_path, 1)
+        parent = Folder.query.get(folder.parent_id) if folder.parent_id else None
+        _move_folder_subtree(folder, new_full_path, parent)
     else:
+        item = File.query.get(item_id)
+        if not item:
+            return
         item.filename = new_name
     db.session.commit()
 
 def move_items(items, destination_folder):
     destination_folder = destination_folder.strip('/')
     # Ensure destination folder exists
-    dest_folder_obj = File.query.filter_by(folder=destination_folder, filename='.folder_marker').first()
-    if not dest_folder_obj and destination_folder != 'root':
-        _ensure_folder_path_exists(destination_folder)
+    dest_folder = _ensure_folder_path_exists(destination_folder)
 
-    for item_data in items:
-        item = File.query.get(item_data['id'])
-        if not item:
-            continue
-        
-        if item_data['type'] == 'file':
-            item.folder = destination_folder
-        elif item_data['type'] == 'folder':
-            old_folder_path = item.folder
-            folder_name = os.path.basename(old_folder_path)
-            new_folder_path = os.path.join(destination_folder, folder_name).replace('\\', '/')
+    file_ids = [int(item_data['id']) for item_data in items if item_data['type'] == 'file']
+    if file_ids:
+        moved_totals = _folder_totals(File.id.in_(file_ids))
+        File.query.filter(File.id.in_(file_ids)).update({File.folder: destination_folder}, synchronize_session=False)
+        _apply_folder_stats_delta(_negated(moved_totals) + [(destination_folder, size, count) for _, size, count in moved_totals])
 
-            # Find all files and subfolders to move
-            files_to_move = File.query.filter(File.folder.like(old_folder_path + '%')).all()
-            for file_to_move in files_to_move:
-                # Replace the old path prefix with the new one
-                new_file_folder = file_to_move.folder.replace(old_folder_path, new_folder_path, 1)
-                file_to_move.folder = new_file_folder
+    for item_data in items:
+        if item_data['type'] == 'folder':
+            folder = Folder.query.get(item_data['id'])
+            if not folder:
+                continue
+            # A folder cannot be moved into itself or one of its own subfolders
+            if destination_folder == folder.path or destination_folder.startswith(folder.path + '/'):
+                continue
+            new_folder_path = os.path.join(destination_folder, folder.name).replace('\\', '/')
+            _move_folder_subtree(folder, new_folder_path, dest_folder)
 
     db.session.commit()
 
 def copy_items(items, destination_folder):
     destination_folder = destination_folder.strip('/')
     # Ensure destination folder exists
-    dest_folder_obj = File.query.filter_by(folder=destination_folder, filename='.folder_marker').first()
-    if not dest_folder_obj and destination_folder != 'root':
-        _ensure_folder_path_exists(destination_folder)
+    _ensure_folder_path_exists(destination_folder)
 
     for item_data in items:
-        item = File.query.get(item_data['id'])
-        if not item:
-            continue
-
         if item_data['type'] == 'file':
+            item = File.query.get(item_data['id'])
+            if not item:
+                continue
             new_file = File(
                 filename=item.filename,
                 file_id=item.file_id,
@@ -151,38 +745,34 @@ def copy_items(items, destination_folder):
                 size=item.size,
                 mime_type=item.mime_type,
                 thumbnail_file_id=item.thumbnail_file_id,
-                message_link=item.message_link
+                message_link=item.message_link,
+                content_hash=item.content_hash,
+                file_unique_id=item.file_unique_id
             )
             db.session.add(new_file)
+            _apply_folder_stats_delta([(destination_folder, item.size, 1)])
         elif item_data['type'] == 'folder':
-            old_folder_path = item.folder
-            folder_name = os.path.basename(old_folder_path)
-            new_folder_path = os.path.join(destination_folder, folder_name).replace('\\', '/')
-
-            # Find all files and subfolders to copy
-            items_to_copy = File.query.filter(File.folder.like(old_folder_path + '%')).all()
-            for item_to_copy in items_to_copy:
-                new_item_folder = item_to_copy.folder.replace(old_folder_path, new_folder_path, 1)
-                new_item = File(
-                    filename=item_to_copy.filename,
-                    file_id=item_to_copy.file_id,
-                    folder=new_item_folder,
-                    size=item_to_copy.size,
-                    mime_type=item_to_copy.mime_type,
-                    thumbnail_file_id=item_to_copy.thumbnail_file_id,
-                    message_link=item_to_copy.message_link
-                )
-                db.session.add(new_item)
+            folder = Folder.query.get(item_data['id'])
+            if not folder:
+                continue
+            # Copying a folder into its own subtree would copy the copy as well
+            if destination_folder == folder.path or destination_folder.startswith(folder.path + '/'):
+                continue
+            new_folder_path = os.path.join(destination_folder, folder.name).replace('\\', '/')
+            _copy_folder_subtree(folder, new_folder_path)
 
     db.session.commit()
 
 def bulk_rename_items(items, rename_method, new_name=None, rename_template=None, find_string=None, replace_string=None):
     for i, item_data in enumerate(items):
-        item = File.query.get(item_data['id'])
+        if item_data['type'] == 'folder':
+            item = Folder.query.get(item_data['id'])
+        else:
+            item = File.query.get(item_data['id'])
         if not item:
             continue
 
-        original_name = os.path.basename(item.folder) if item_data['type'] == 'folder' else item.filename
+        original_name = item.name if item_data['type'] == 'folder' else item.filename
         name, ext = os.path.splitext(original_name)
 
         if rename_method == 'new_name':
@@ -195,13 +785,10 @@ def bulk_rename_items(items, rename_method, new_name=None, rename_template=None,
             continue # Should not happen
 
         if item_data['type'] == 'folder':
-            old_full_path = item.folder
-            parent_path = os.path.dirname(old_full_path)
+            parent_path = os.path.dirname(item.path)
             new_full_path = os.path.join(parent_path, final_name).replace('\\', '/')
-            
-            files_to_update = File.query.filter(File.folder.like(old_full_path + '%')).all()
-            for file_to_update in files_to_update:
-                file_to_update.folder = file_to_update.folder.replace(old_full_path, new_full_path, 1)
+            parent = Folder.query.get(item.parent_id) if item.parent_id else None
+            _move_folder_subtree(item, new_full_path, parent)
         else:
             item.filename = final_name
 
@@ -231,90 +818,135 @@ def get_file_by_telegram_file_id_including_deleted(telegram_file_id):
     return File.query.filter_by(file_id=telegram_file_id).first()
 
 def get_root_folder_id():
-    file = File.query.filter_by(folder='root', filename='.folder_marker', is_deleted=False).first()
-    return file.id if file else None
+    return get_folder_id_by_path('root')
+
+def get_folder_by_id(folder_id):
+    return Folder.query.get(folder_id)
 
 def get_folder_id_by_path(folder_path):
-    file = File.query.filter_by(folder=folder_path, filename='.folder_marker', is_deleted=False).first()
-    return file.id if file else None
+    folder = Folder.query.filter_by(path=folder_path, is_deleted=False).first()
+    return folder.id if folder else None
 
-def get_folder_contents(current_folder):
-    files = File.query.filter_by(folder=current_folder, is_deleted=False).filter(File.filename != '.folder_marker').all()
+def get_folder_ancestors(folder_path):
+    """Returns the folders along folder_path, from the top down, in a single query."""
+    ancestors = Folder.query.filter(Folder.path.in_(_path_prefixes(folder_path)), Folder.is_deleted == False).all()
+    return sorted(ancestors, key=lambda f: f.depth)
+
+def get_folder_contents_query(current_folder):
+    files = File.query.filter_by(folder=current_folder, is_deleted=False)
 
-    if current_folder == 'root':
-        like_path = 'root/%'
+    folder = Folder.query.filter_by(path=current_folder, is_deleted=False).first()
+    if folder:
+        subfolders = Folder.query.filter_by(parent_id=folder.id, is_deleted=False)
     else:
-        like_path = current_folder + '/%'
-        
-    all_subfolders_query = File.query.filter(
-        File.folder.like(like_path),
-        File.filename == '.folder_marker',
-        File.is_deleted == False
-    )
-    
-    direct_subfolders = []
-    for sub in all_subfolders_query.all():
-        parent_path = os.path.dirname(sub.folder)
-        if parent_path == current_folder:
-            direct_subfolders.append(sub)
-            
-    subfolders = direct_subfolders
-    
+        subfolders = None
+
     return files, subfolders
 
-def get_folder_contents_for_user(user_id, current_folder, sort_by=None, sort_order=None):
-    user = get_user_by_id(user_id)
-    allowed_paths = [p.path for p in user.paths]
+def get_folder_contents(current_folder):
+    files, subfolders = get_folder_contents_query(current_folder)
+    return files.all(), subfolders.all() if subfolders is not None else []
 
-    if user.username != 'admin':
-        can_access = any(current_folder.startswith(p) for p in allowed_paths) or \
-                     any(p.startswith(current_folder + '/') for p in allowed_paths)
-        if not can_access:
-            return None, None
+def get_folder_contents_query_for_user(user_id, current_folder):
+    acl = get_user_acl(user_id)
+    if not acl.can_browse(current_folder):
+        return None, None
 
-    files, subfolders = get_folder_contents(current_folder)
+    files, subfolders = get_folder_contents_query(current_folder)
 
-    if user.username != 'admin':
-        allowed_subfolders = []
-        for subfolder in subfolders:
-            if any(subfolder.folder.startswith(p) for p in allowed_paths) or \
-               any(p.startswith(subfolder.folder + '/') for p in allowed_paths):
-                allowed_subfolders.append(subfolder)
-        subfolders = allowed_subfolders
+    if not acl.can_access(current_folder):
+        # A folder on the way to a granted path only shows the subfolders leading there
+        files = files.filter(false())
+        if subfolders is not None:
+            subfolders = subfolders.filter(Folder.path.in_(acl.child_paths(current_folder)))
 
     return files, subfolders
 
+def get_folder_contents_for_user(user_id, current_folder, sort_by=None, sort_order=None):
+    files, subfolders = get_folder_contents_query_for_user(user_id, current_folder)
+    if files is None:
+        return None, None
+    return files.all(), subfolders.all() if subfolders is not None else []
+
 def get_all_files_in_folder(folder_path):
-    return File.query.filter(File.folder.like(f'{folder_path}%')).all()
+    return File.query.filter(_subtree_filter(File.folder, folder_path)).all()
+
+def get_file_ids_for_items(items):
+    """
+    Returns (telegram_file_id, size) for the live files among items, {'id', 'type'} dicts as sent by
+    the bulk actions, and for every live file below the folders among them, each file once.
+    """
+    file_ids = [int(item['id']) for item in items if item.get('type') != 'folder']
+    folder_ids = [int(item['id']) for item in items if item.get('type') == 'folder']
+    folder_paths = [r[0] for r in db.session.query(Folder.path).filter(Folder.id.in_(folder_ids), Folder.is_deleted == False)] if folder_ids else []
+
+    conditions = [_subtree_filter(File.folder, p) for p in folder_paths]
+    if file_ids:
+        conditions.append(File.id.in_(file_ids))
+    if not conditions:
+        return []
+    rows = db.session.query(File.file_id, File.size).filter(File.is_deleted == False, or_(*conditions)).order_by(File.folder, File.filename)
+    seen = set()
+    return [(file_id, size) for file_id, size in rows if not (file_id in seen or seen.add(file_id))]
+
+
+def get_all_files_query_for_user(user_id):
+    acl = get_user_acl(user_id)
+    query = File.query.filter(File.is_deleted == False)
+    if acl.unrestricted:
+        return query
+
+    # One index range per granted subtree; the ACL has already dropped nested grants
+    roots = acl.roots
+    if not roots:
+        return None
 
+    return query.filter(or_(*[_subtree_filter(File.folder, p) for p in roots]))
 
 def get_all_files_for_user(user_id, sort_by=None, sort_order=None):
-    user = get_user_by_id(user_id)
-    if user.username == 'admin':
+    if get_user_acl(user_id).unrestricted:
         return get_all_files(sort_by, sort_order)
-    
-    allowed_paths = [p.path for p in user.paths]
-    if not allowed_paths:
+
+    query = get_all_files_query_for_user(user_id)
+    if query is None:
         return []
+    return query.order_by(_sort_column(File, sort_by, sort_order)).all()
 
-    query = File.query.filter(File.is_deleted == False, or_(*[File.folder.like(p + '%') for p in allowed_paths]))
-    # ... (implement sorting)
-    return query.all()
+def search_folders_query(query, path, start_date=None, end_date=None):
+    q = Folder.query.filter(Folder.is_deleted == False)
 
-def search_files(query, path, file_type, min_size=None, max_size=None, start_date=None, end_date=None, sort_by=None, sort_order=None):
+    if query:
+        q = q.filter(Folder.name.like(f'%{query}%'))
+
+    if path and path != 'root':
+        q = q.filter(_descendant_filter(Folder.path, path))
+
+    if start_date:
+        q = q.filter(Folder.upload_date >= start_date)
+
+    if end_date:
+        q = q.filter(Folder.upload_date <= end_date)
+
+    return q
+
+def search_folders(query, path, start_date=None, end_date=None, sort_by=None, sort_order=None):
+    q = search_folders_query(query, path, start_date, end_date)
+    return _join_sort_table(q, Folder, sort_by or 'name').order_by(_sort_column(Folder, sort_by or 'name', sort_order)).all()
+
+def search_files_query(query, path, file_type, min_size=None, max_size=None, start_date=None, end_date=None, sort_by=None):
     q = File.query.filter(File.is_deleted == False)
     
     if query:
-        q = q.filter(File.filename.like(f'%{query}%'))
+        if sort_by == RELEVANCE:
+            q = get_search_index().rank(q, query)
+        else:
+            q = get_search_index().filter(q, query)
     
     if path and path != 'root':
-        q = q.filter(File.folder.like(f'{path}%'))
+        q = q.filter(_subtree_filter(File.folder, path))
     
     if file_type:
-        if file_type == 'folder':
-            q = q.filter(File.filename == '.folder_marker')
-        else:
-            q = q.filter(File.mime_type.like(f'{file_type}%'))
+        q = q.filter(File.mime_type.like(f'{file_type}%'))
 
     if min_size is not None:
         q = q.filter(File.size >= min_size)
@@ -328,118 +960,163 @@ def search_files(query, path, file_type, min_size=None, max_size=None, start_dat
     if end_date:
         q = q.filter(File.upload_date <= end_date)
 
-    if sort_by and sort_order:
-        if sort_by == 'name':
-            if sort_order == 'asc':
-                q = q.order_by(File.filename.asc())
-            else:
-                q = q.order_by(File.filename.desc())
-        elif sort_by == 'size':
-            if sort_order == 'asc':
-                q = q.order_by(File.size.asc())
-            else:
-                q = q.order_by(File.size.desc())
-        elif sort_by == 'date':
-            if sort_order == 'asc':
-                q = q.order_by(File.upload_date.asc())
-            else:
-                q = q.order_by(File.upload_date.desc())
-        elif sort_by == 'type':
-            if sort_order == 'asc':
-                q = q.order_by(File.mime_type.asc())
-            else:
-                q = q.order_by(File.mime_type.desc())
-        elif sort_by == 'folder':
-            if sort_order == 'asc':
-                q = q.order_by(File.folder.asc())
-            else:
-                q = q.order_by(File.folder.desc())
+    return q
+
+def search_query(query, path, file_type, min_size=None, max_size=None, start_date=None, end_date=None, sort_by=None):
+    """Returns the (files, folders) queries for a search; the one that cannot match is None."""
+    if file_type == 'folder':
+        return None, search_folders_query(query, path, start_date, end_date)
+    return search_files_query(query, path, file_type, min_size, max_size, start_date, end_date, sort_by), None
+
+def search_files(query, path, file_type, min_size=None, max_size=None, start_date=None, end_date=None, sort_by=None, sort_order=None):
+    if file_type == 'folder':
+        return search_folders(query, path, start_date, end_date, sort_by, sort_order)
 
+    q = search_files_query(query, path, file_type, min_size, max_size, start_date, end_date, sort_by)
+    if sort_by and sort_order and sort_by != RELEVANCE:
+        q = q.order_by(_sort_column(File, sort_by, sort_order))
     return q.all()
 
+def get_deleted_items_query():
+    return File.query.filter_by(is_deleted=True), Folder.query.filter_by(is_deleted=True)
+
 def get_deleted_items(sort_by='date', sort_order='desc'):
-    query = File.query.filter_by(is_deleted=True)
+    query, folder_query = get_deleted_items_query()
     if sort_by and sort_order:
-        if sort_by == 'name':
-            order = File.filename.desc() if sort_order == 'desc' else File.filename.asc()
-        elif sort_by == 'size':
-            order = File.size.desc() if sort_order == 'desc' else File.size.asc()
-        elif sort_by == 'date':
-            order = File.upload_date.desc() if sort_order == 'desc' else File.upload_date.asc()
-        elif sort_by == 'type':
-            order = File.mime_type.desc() if sort_order == 'desc' else File.mime_type.asc()
-        elif sort_by == 'folder':
-            order = File.folder.desc() if sort_order == 'desc' else File.folder.asc()
-        else:
-            order = File.upload_date.desc()
-        query = query.order_by(order)
-    return query.all()
+        query = query.order_by(_sort_column(File, sort_by, sort_order))
+        folder_query = _join_sort_table(folder_query, Folder, sort_by).order_by(_sort_column(Folder, sort_by, sort_order))
+    return query.all(), folder_query.all()
 
 def restore_items(items):
-    # Use a set to keep track of file IDs we've already processed to avoid redundant DB calls
-    processed_ids = set()
-    items_to_process = [int(item['id']) for item in items]
+    """
+    Restores the selected files and folders from the recycle bin with set-based UPDATEs.
+    A restored folder brings back everything deleted below it, and every deleted folder
+    along the path of a restored item is brought back so it is reachable again.
+    """
+    file_ids = {int(item['id']) for item in items if item.get('type', 'file') != 'folder'}
+    folder_ids = {int(item['id']) for item in items if item.get('type', 'file') == 'folder'}
 
-    while items_to_process:
-        item_id = items_to_process.pop(0)
-        if item_id in processed_ids:
-            continue
+    folder_paths = [r[0] for r in db.session.query(Folder.path).filter(Folder.id.in_(folder_ids))] if folder_ids else []
+    file_folders = [r[0] for r in db.session.query(File.folder).filter(File.id.in_(file_ids)).distinct()] if file_ids else []
+    if not folder_paths and not file_folders:
+        return
 
-        item = File.query.get(item_id)
-        if not item:
-            continue
+    file_conditions = [_subtree_filter(File.folder, p) for p in folder_paths]
+    if file_ids:
+        file_conditions.append(File.id.in_(file_ids))
+    _apply_folder_stats_delta(_folder_totals(or_(*file_conditions), is_deleted=True))
+    db.session.execute(
+        update(File).where(File.is_deleted == True, or_(*file_conditions)).values(is_deleted=False, deleted_at=None),
+        execution_options={'synchronize_session': False}
+    )
 
-        # 1. Restore the item itself and mark as processed
-        item.is_deleted = False
-        processed_ids.add(item.id)
-
-        # 2. If it's a folder, find all its contents and add them to the list to be restored
-        if item.filename == '.folder_marker':
-            folder_path = item.folder
-            children = File.query.filter(
-                or_(File.folder == folder_path, File.folder.like(f'{folder_path}/%'))
-            ).filter(File.is_deleted == True).all()
-
-            for child in children:
-                if child.id not in processed_ids:
-                    # We don't restore the child immediately, but add it to the list
-                    # to ensure its parents are also handled if needed.
-                    items_to_process.append(child.id)
-
-        # 3. Ensure all parent folders of the restored item exist and are not deleted
-        parent_path = item.folder
-        if parent_path != 'root':
-            parts = parent_path.split('/')
-            current_path = ''
-            for part in parts:
-                if current_path == '':
-                    current_path = part
-                else:
-                    current_path = f"{current_path}/{part}"
-                
-                # Find the folder marker for this path
-                parent_folder_marker = File.query.filter_by(folder=current_path, filename='.folder_marker').first()
-                if parent_folder_marker and parent_folder_marker.is_deleted:
-                    parent_folder_marker.is_deleted = False
-                    processed_ids.add(parent_folder_marker.id)
+    # Ancestors are deduplicated across the whole selection, so each one is named once
+    ancestor_paths = {prefix for path in folder_paths + file_folders for prefix in _path_prefixes(path)}
+    folder_conditions = [Folder.path.in_(ancestor_paths)] + [_descendant_filter(Folder.path, p) for p in folder_paths]
+    db.session.execute(
+        update(Folder).where(Folder.is_deleted == True, or_(*folder_conditions)).values(is_deleted=False, deleted_at=None),
+        execution_options={'synchronize_session': False}
+    )
 
     db.session.commit()
 
+PURGE_BATCH_SIZE = 500
+
+def purge_scope_for_items(items):
+    """
+    Returns the (file_filter, folder_filter) purge scope for recycle-bin items: the selected files,
+    and each selected folder together with everything deleted below it.
+    """
+    file_ids = [int(item['id']) for item in items if item.get('type') != 'folder']
+    folder_ids = [int(item['id']) for item in items if item.get('type') == 'folder']
+    folder_paths = [r[0] for r in db.session.query(Folder.path).filter(Folder.id.in_(folder_ids))] if folder_ids else []
+
+    file_conditions = [_subtree_filter(File.folder, p) for p in folder_paths]
+    if file_ids:
+        file_conditions.append(File.id.in_(file_ids))
+    folder_conditions = [_subtree_filter(Folder.path, p) for p in folder_paths]
+    return (or_(*file_conditions) if file_conditions else false(),
+            or_(*folder_conditions) if folder_conditions else false())
+
+def purge_scope_for_retention(cutoff):
+    """Returns the purge scope for everything that went into the recycle bin before cutoff."""
+    return File.deleted_at < cutoff, Folder.deleted_at < cutoff
+
+def purge_scope_for_all():
+    """Returns the purge scope for the whole recycle bin."""
+    return true(), true()
+
+def count_purge_scope(file_filter, folder_filter):
+    files = File.query.filter(File.is_deleted == True, file_filter).with_entities(func.count()).scalar()
+    folders = Folder.query.filter(Folder.is_deleted == True, folder_filter).with_entities(func.count()).scalar()
+    return files, folders
+
+def iter_purge(file_filter, folder_filter, batch_size=PURGE_BATCH_SIZE):
+    """
+    Permanently deletes the recycle-bin rows in a purge scope, one bounded id range per transaction.
+    Yields ('files' | 'folders', rows_deleted) after each committed batch.
+
+    Every DELETE re-checks is_deleted, so rows restored while a purge is running are left alone.
+    Folders go deepest level first and only once nothing is left inside them.
+    """
+    last_id = 0
+    while True:
+        ids = [r[0] for r in db.session.query(File.id)
+               .filter(File.is_deleted == True, file_filter, File.id > last_id)
+               .order_by(File.id).limit(batch_size)]
+        if not ids:
+            break
+        last_id = ids[-1]
+        deleted = db.session.execute(
+            delete(File).where(File.id.between(ids[0], ids[-1]), File.is_deleted == True, file_filter),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        db.session.commit()
+        yield 'files', deleted
+
+    child = aliased(Folder)
+    emptied = and_(
+        Folder.is_deleted == True,
+        folder_filter,
+        ~exists().where(child.parent_id == Folder.id),
+        ~exists().where(File.folder == Folder.path)
+    )
+    max_depth = db.session.query(func.max(Folder.depth)).filter(Folder.is_deleted == True, folder_filter).scalar()
+    for depth in range(max_depth if max_depth is not None else -1, -1, -1):
+        last_id = 0
+        while True:
+            ids = [r[0] for r in db.session.query(Folder.id)
+                   .filter(Folder.depth == depth, emptied, Folder.id > last_id)
+                   .order_by(Folder.id).limit(batch_size)]
+            if not ids:
+                break
+            last_id = ids[-1]
+            # MySQL cannot delete from folders while a subquery reads it, so the emptiness
+            # check stays in the SELECT above and the DELETE names the ids
+            db.session.execute(
+                delete(FolderStats).where(FolderStats.folder_id.in_(ids)),
+                execution_options={'synchronize_session': False}
+            )
+            deleted = db.session.execute(
+                delete(Folder).where(Folder.id.in_(ids), Folder.is_deleted == True),
+                execution_options={'synchronize_session': False}
+            ).rowcount
+            db.session.commit()
+            yield 'folders', deleted
+
 def permanent_delete_items(items):
-    for item in items:
-        item_id = int(item['id'])
-        file = File.query.get(item_id)
-        if file:
-            db.session.delete(file)
-    db.session.commit()
+    for _ in iter_purge(*purge_scope_for_items(items)):
+        pass
 
 def empty_recycle_bin():
-    File.query.filter_by(is_deleted=True).delete()
-    db.session.commit()
+    for _ in iter_purge(*purge_scope_for_all()):
+        pass
 
 def clear_database():
     db.drop_all()
     db.create_all()
+    rebuild_search_index()
+    create_folder('root')
 
 def is_file_deleted(telegram_file_id):
     file = get_file_by_telegram_file_id(telegram_file_id, include_deleted=True)
@@ -468,6 +1145,7 @@ def delete_user(user_id):
     if user:
         db.session.delete(user)
         db.session.commit()
+        invalidate_user_acl(user_id)
 
 def update_user_paths(user_id, paths):
     UserPath.query.filter_by(user_id=user_id).delete()
@@ -475,5 +1153,137 @@ def update_user_paths(user_id, paths):
         new_path = UserPath(user_id=user_id, path=path)
         db.session.add(new_path)
     db.session.commit()
+    invalidate_user_acl(user_id)
+
+
 
+# Upload task statuses a task may be moved to through the API, and the statuses it may be moved from
+UPLOAD_TASK_TRANSITIONS = {
+    'paused': ('queued', 'uploading'),
+    'queued': ('paused', 'failed'),
+    'cancelled': ('queued', 'uploading', 'paused', 'failed'),
+}
 
+def add_upload_task(file_path, filename, folder, size=None, mime_type=None, priority=0, user_id=None, content_hash=None,
+                    status='queued'):
+    task = UploadTask(file_path=file_path, filename=filename, folder=folder, size=size, mime_type=mime_type, priority=priority,
+                      user_id=user_id, content_hash=content_hash, status=status,
+                      started_at=datetime.utcnow() if status == 'uploading' else None)
+    db.session.add(task)
+    db.session.commit()
+    return task
+
+def get_upload_tasks():
+    return UploadTask.query.order_by(UploadTask.created_at.desc(), UploadTask.id.desc()).all()
+
+def get_upload_task(task_id):
+    return db.session.get(UploadTask, task_id)
+
+def claim_upload_task(task_id):
+    """Marks one queued task as uploading. Returns False if it is not queued (e.g. a worker claimed it first)."""
+    claimed = db.session.execute(
+        update(UploadTask).where(UploadTask.id == task_id, UploadTask.status == 'queued')
+        .values(status='uploading', bytes_uploaded=0, error=None, started_at=datetime.utcnow(), finished_at=None),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+def claim_next_upload_task():
+    """
+    Marks the queued task with the highest priority, oldest first, as uploading and returns it, or None
+    if nothing is queued. The status check in the UPDATE keeps two workers from claiming the same task.
+    """
+    while True:
+        task_id = db.session.execute(
+            select(UploadTask.id).where(UploadTask.status == 'queued')
+            .order_by(UploadTask.priority.desc(), UploadTask.created_at, UploadTask.id).limit(1)
+        ).scalar()
+        if task_id is None:
+            return None
+        if claim_upload_task(task_id):
+            return db.session.get(UploadTask, task_id, populate_existing=True)
+
+def record_upload_progress(task_id, bytes_uploaded):
+    """Stores the bytes sent so far. Returns False once the task is no longer uploading (paused, cancelled or deleted)."""
+    updated = db.session.execute(
+        update(UploadTask).where(UploadTask.id == task_id, UploadTask.status == 'uploading')
+        .values(bytes_uploaded=bytes_uploaded),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return bool(updated)
+
+def finish_upload_task(task_id, status, error=None, telegram_file_id=None, bytes_uploaded=None, deduplicated=False):
+    """Records how an upload ended. A task paused, cancelled or deleted meanwhile is left as it is, unless it completed."""
+    values = {'status': status, 'error': error, 'telegram_file_id': telegram_file_id, 'deduplicated': deduplicated,
+              'finished_at': datetime.utcnow()}
+    if bytes_uploaded is not None:
+        values['bytes_uploaded'] = bytes_uploaded
+    query = update(UploadTask).where(UploadTask.id == task_id)
+    if status != 'completed':
+        query = query.where(UploadTask.status == 'uploading')
+    db.session.execute(query.values(**values), execution_options={'synchronize_session': False})
+    db.session.commit()
+
+def requeue_interrupted_upload_tasks():
+    """
+    Puts tasks that were uploading when the application stopped back in the queue; they start over.
+    Streamed uploads have no staged copy to start over from and fail instead.
+    """
+    db.session.execute(
+        update(UploadTask).where(UploadTask.status == 'uploading', UploadTask.file_path.is_(None))
+        .values(status='failed', error='Interrupted by a restart while streaming.', finished_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False}
+    )
+    requeued = db.session.execute(
+        update(UploadTask).where(UploadTask.status == 'uploading').values(status='queued', bytes_uploaded=0, started_at=None),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+def bulk_update_upload_task_status(task_ids, status):
+    """
+    Pauses, resumes (or retries) or cancels tasks. Tasks whose current status does not allow the change
+    are skipped, as are streamed uploads for anything but cancelling. Returns the tasks that changed.
+    """
+    if status not in UPLOAD_TASK_TRANSITIONS:
+        raise ValueError(f"Invalid upload task status: {status}")
+    query = UploadTask.query.filter(UploadTask.id.in_(task_ids or []), UploadTask.status.in_(UPLOAD_TASK_TRANSITIONS[status]))
+    if status != 'cancelled':
+        query = query.filter(UploadTask.file_path.isnot(None))
+    tasks = query.all()
+    for task in tasks:
+        task.status = status
+        if status == 'queued':
+            task.bytes_uploaded = 0
+            task.error = None
+            task.finished_at = None
+        elif status == 'cancelled':
+            task.finished_at = datetime.utcnow()
+    db.session.commit()
+    return tasks
+
+def update_upload_task_status(task_id, status):
+    return bulk_update_upload_task_status([task_id], status)
+
+def bulk_delete_upload_tasks(task_ids):
+    """Deletes tasks, whatever their status, and returns the staged file paths they leave behind."""
+    tasks = UploadTask.query.filter(UploadTask.id.in_(task_ids or [])).all()
+    file_paths = [task.file_path for task in tasks if task.status != 'completed' and task.file_path]
+    for task in tasks:
+        db.session.delete(task)
+    db.session.commit()
+    return file_paths
+
+def delete_upload_task(task_id):
+    return bulk_delete_upload_tasks([task_id])
+
+def update_upload_task_priority(task_id, priority):
+    task = db.session.get(UploadTask, task_id)
+    if not task:
+        return None
+    task.priority = int(priority)
+    db.session.commit()
+    return task
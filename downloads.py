@@ -0,0 +1,470 @@
+import logging
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: downloads are only coalesced within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+LOCK_SUFFIX = '.lock'
+MAP_SUFFIX = '.map'
+# Matches the MTProto download chunk, so an offset download always starts on a segment boundary
+SEGMENT_SIZE = 1024 * 1024
+
+class DownloadCancelled(Exception):
+    """Raised inside a fetch once every reader of the download has gone away."""
+
+class SegmentMap:
+    """
+    Which fixed-size segments of a part file hold downloaded data, kept as a bitmap in the sidecar
+    file `<file_id>.map`. The map is rewritten through a temp file and a rename, so a crash leaves
+    either the old or the new map, never a torn one.
+    """
+    MAGIC = b'TFDBSEG1'
+    HEADER = struct.Struct('<8sI')
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self.bits = bytearray()
+
+    @classmethod
+    def load(cls, path):
+        """Reads a map, or returns None if there is none or it was written with another segment size."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, segment_size = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or segment_size != SEGMENT_SIZE:
+            return None
+        segment_map = cls(path, segment_size)
+        segment_map.bits = bytearray(data[cls.HEADER.size:])
+        return segment_map
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.segment_size))
+            f.write(self.bits)
+        os.replace(tmp_path, self.path)
+
+    def has(self, index):
+        byte = index // 8
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << index % 8))
+
+    def mark(self, index):
+        byte = index // 8
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << index % 8
+
+    def clear_from(self, index):
+        """Forgets segment `index` and everything after it."""
+        for i in range(index, len(self.bits) * 8):
+            if self.has(i):
+                self.bits[i // 8] &= ~(1 << i % 8)
+
+    def first_missing(self):
+        index = 0
+        while self.has(index):
+            index += 1
+        return index
+
+    def missing(self, segment_count):
+        """Indexes of the segments below segment_count that are not on disk yet."""
+        return [i for i in range(segment_count) if not self.has(i)]
+
+    def prefix_bytes(self, size=None):
+        """Length of the run of downloaded bytes starting at byte 0."""
+        prefix = self.first_missing() * self.segment_size
+        return prefix if size is None else min(prefix, size)
+
+    def covers(self, start, stop):
+        """True if every segment overlapping bytes [start, stop) has been downloaded."""
+        return all(self.has(i) for i in range(start // self.segment_size, -(-stop // self.segment_size)))
+
+    def count(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+class FileLock:
+    """
+    An exclusive, non-blocking lock on `path` shared between processes. The lock file is removed on
+    release; acquiring checks the file on disk is still the one that was locked, so a process that
+    locked a file another process just unlinked does not believe it holds the lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def try_acquire(self):
+        if fcntl is None:
+            return True
+        while True:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    self._fd = fd
+                    return True
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+class InFlightDownload:
+    """
+    A download this process is writing to `<file_id>.part`, renamed to the cache file once complete.
+    Any number of readers tail the growing part file; they wait on a condition for new bytes.
+    `written` is the length of the downloaded run starting at byte 0, which is all readers may see:
+    a parallel download fills the part file out of order.
+    """
+
+    def __init__(self, file_id, path, size=None):
+        self.file_id = file_id
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.size = size
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.readers = 0
+        self.detached = False
+        self.user = None
+        self.cancel_requested = False
+        self.stopping = False
+        self._cond = threading.Condition()
+
+    def _advance_to(self, written):
+        with self._cond:
+            if written > self.written:
+                self.written = written
+                self._cond.notify_all()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def _wait_for(self, position, timeout=1.0):
+        """Blocks until bytes past `position` exist or the download ends. Returns (available, done, error)."""
+        with self._cond:
+            if self.written <= position and not self.done:
+                self._cond.wait(timeout)
+            return self.written, self.done, self.error
+
+    def wait(self, timeout=None):
+        """Blocks until the download ends. Returns True if it completed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+            return self.done and self.error is None
+
+    def tail(self, start=0, stop=None, chunk_size=64 * 1024):
+        """Yields bytes [start, stop) of the file as they arrive; stop=None reads to the end."""
+        f = _open_first(self.part_path, self.path)
+        try:
+            yield from _tail(f, self._wait_for, start, stop, chunk_size)
+        finally:
+            f.close()
+
+class ForeignDownload:
+    """A download another process is writing. Progress is polled from its segment map and lock file."""
+
+    def __init__(self, file_id, path, poll_interval=0.1):
+        self.file_id = file_id
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.lock = FileLock(path + LOCK_SUFFIX)
+        self.poll_interval = poll_interval
+        self.readers = 0
+        self.detached = False
+        self.cancel_requested = False
+
+    @property
+    def written(self):
+        if os.path.exists(self.path):
+            return os.path.getsize(self.path)
+        segment_map = SegmentMap.load(self.path + MAP_SUFFIX)
+        return segment_map.prefix_bytes() if segment_map else 0
+
+    def _writer_finished(self):
+        if self.lock.try_acquire():
+            self.lock.release()
+            return True
+        return False
+
+    def _wait_for(self, position, f):
+        # Once renamed the file is complete; before that only the segments the map lists are readable
+        if os.path.exists(self.path):
+            return os.fstat(f.fileno()).st_size, True, None
+        available = self.written
+        if available > position:
+            return available, False, None
+        if self._writer_finished():
+            # The writer renames the part file when it succeeds and leaves it in place when it stops early
+            if os.path.exists(self.path):
+                return os.fstat(f.fileno()).st_size, True, None
+            return available, True, IOError(f"Download of {self.file_id} failed in another process.")
+        time.sleep(self.poll_interval)
+        return available, False, None
+
+    def tail(self, start=0, stop=None, chunk_size=64 * 1024):
+        f = _open_first(self.part_path, self.path)
+        try:
+            yield from _tail(f, lambda position: self._wait_for(position, f), start, stop, chunk_size)
+        finally:
+            f.close()
+
+def _open_first(*paths):
+    # The part file may be renamed between attaching and opening it
+    for path in paths:
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            pass
+    raise FileNotFoundError(paths[-1])
+
+def _tail(f, wait_for, start, stop, chunk_size):
+    position = start
+    while stop is None or position < stop:
+        available, done, error = wait_for(position)
+        if available > position:
+            f.seek(position)
+            want = available - position if stop is None else min(available, stop) - position
+            chunk = f.read(min(chunk_size, want))
+            if chunk:
+                position += len(chunk)
+                yield chunk
+                continue
+        if error is not None:
+            raise error
+        if done:
+            return
+
+class DownloadRegistry:
+    """
+    Makes sure each file is downloaded at most once at a time. The first request for an uncached
+    file starts a download thread; later requests, in this process or (through lock files) in
+    another one, attach as readers that tail the growing file. A download is cancelled when its
+    last reader leaves, unless it was started detached to fill the cache.
+
+    Downloads write `<file_id>.part` with a SegmentMap beside it, so an interrupted or cancelled
+    download resumes from its first missing segment and its finished segments can be served meanwhile.
+    fetch(file_id, write, offset, user=..., background=..., size=..., segment_map=...) must either
+    call write(chunk) for every chunk of the file from byte `offset` (always a multiple of
+    SEGMENT_SIZE) on, in order, or call write(chunk, chunk_offset) for whole segments in any order,
+    covering every segment segment_map is missing.
+    """
+
+    def __init__(self, cache_manager, fetch):
+        self.cache_manager = cache_manager
+        self.fetch = fetch
+        self._downloads = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        """The download currently running for file_id, if any."""
+        return self._downloads.get(file_id)
+
+    def attach(self, file_id, detached=False, user=None, size=None):
+        """
+        Returns the download of file_id with one more reader, starting it if needed, or None if the
+        file is already cached. Every attach must be paired with a detach. A download started by a
+        detached attach runs as background work on behalf of `user`; knowing the file's `size` lets
+        the fetch download parts of it in parallel.
+        """
+        while True:
+            with self._lock:
+                download = self._downloads.get(file_id)
+                if download is None:
+                    if self.cache_manager.lookup(file_id):
+                        return None
+                    download = self._start(file_id, detached, user, size)
+                    if download is None:
+                        return None
+                    self._downloads[file_id] = download
+                if not getattr(download, 'stopping', False):
+                    download.readers += 1
+                    download.detached = download.detached or detached
+                    download.cancel_requested = False
+                    return download
+            # A cancelled download is still releasing its part and lock files
+            download.wait()
+
+    def detach(self, download):
+        with self._lock:
+            download.readers -= 1
+            if download.readers:
+                return
+            if isinstance(download, InFlightDownload):
+                if not download.detached:
+                    download.cancel_requested = True
+            elif self._downloads.get(download.file_id) is download:
+                del self._downloads[download.file_id]
+                if os.path.exists(download.path):
+                    self.cache_manager.adopt(download.file_id)
+
+    def _start(self, file_id, detached, user, size):
+        path = self.cache_manager.path(file_id)
+        lock = FileLock(path + LOCK_SUFFIX)
+        if not lock.try_acquire():
+            logger.info(f"{file_id} is being downloaded by another process, tailing it.")
+            return ForeignDownload(file_id, path)
+        if os.path.exists(path):
+            # Another process finished it since this one built its cache index
+            lock.release()
+            self.cache_manager.adopt(file_id)
+            return None
+        download = InFlightDownload(file_id, path, size)
+        download.detached = detached
+        download.user = user
+        segment_map = SegmentMap.load(path + MAP_SUFFIX) if os.path.exists(download.part_path) else None
+        if segment_map is None:
+            segment_map = SegmentMap(path + MAP_SUFFIX)
+            _remove_quietly(download.part_path)
+        # Create the part file before any reader tries to open it; segments already on disk are kept
+        open(download.part_path, 'ab').close()
+        segment_map.save()
+        download.written = segment_map.prefix_bytes(size)
+        self.cache_manager.begin_write(file_id, segment_map.count() * SEGMENT_SIZE)
+        if segment_map.count():
+            logger.info(f"Resuming download of {file_id}: {segment_map.count()} segments already cached.")
+        threading.Thread(target=self._run, args=(download, lock, segment_map), name=f'download-{file_id[:16]}', daemon=True).start()
+        return download
+
+    def _check_cancelled(self, download):
+        if not download.cancel_requested:
+            return
+        with self._lock:
+            if download.cancel_requested:
+                download.stopping = True
+                raise DownloadCancelled()
+
+    def _run(self, download, lock, segment_map):
+        file_id = download.file_id
+        error = None
+        # Where the next sequential chunk goes; sequential fetches resume at the first missing segment
+        position = download.written
+        try:
+            with open(download.part_path, 'r+b') as f:
+                def write(chunk, offset=None):
+                    """Writes a chunk at `offset`, or right after the previous sequential chunk."""
+                    nonlocal position
+                    self._check_cancelled(download)
+                    sequential = offset is None
+                    if sequential:
+                        offset = position
+                        position += len(chunk)
+                    f.seek(offset)
+                    f.write(chunk)
+                    f.flush()
+                    end = offset + len(chunk)
+                    self.cache_manager.record_write(file_id, _unmarked_bytes(segment_map, offset, end))
+                    # A sequential run completes every segment it has passed; a positional write
+                    # completes the segments it covers, including a short final one
+                    first = (download.written if sequential else offset) // SEGMENT_SIZE
+                    last = end // SEGMENT_SIZE
+                    if not sequential and len(chunk) % SEGMENT_SIZE:
+                        last += 1
+                    marked = False
+                    for index in range(first, last):
+                        if not segment_map.has(index):
+                            segment_map.mark(index)
+                            marked = True
+                    if marked:
+                        segment_map.save()
+                    download._advance_to(end if sequential else segment_map.prefix_bytes(download.size))
+
+                self.fetch(file_id, write, download.written, user=download.user, background=download.detached,
+                           size=download.size, segment_map=segment_map)
+            os.replace(download.part_path, download.path)
+            _remove_quietly(segment_map.path)
+            self.cache_manager.finish_write(file_id)
+            logger.info(f"Cached {file_id} ({download.written} bytes).")
+        except Exception as e:
+            error = e
+            if isinstance(e, DownloadCancelled):
+                logger.info(f"Download of {file_id} paused with {segment_map.count()} segments cached, no readers left.")
+            else:
+                logger.error(f"Download of {file_id} failed with {segment_map.count()} segments cached: {e}")
+            # The part file and its map stay behind, so the next request resumes where this one stopped
+            self.cache_manager.end_write(file_id)
+        finally:
+            with self._lock:
+                if self._downloads.get(file_id) is download:
+                    del self._downloads[file_id]
+            lock.release()
+            download._finish(error)
+
+def _unmarked_bytes(segment_map, start, end):
+    """How many bytes of [start, end) fall in segments the map does not list yet, i.e. are new on disk."""
+    total = 0
+    for index in range(start // SEGMENT_SIZE, -(-end // SEGMENT_SIZE)):
+        if not segment_map.has(index):
+            total += min(end, (index + 1) * SEGMENT_SIZE) - max(start, index * SEGMENT_SIZE)
+    return total
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def read_partial(cache_manager, file_id, start, stop):
+    """
+    Returns an iterator over bytes [start, stop) of a partly downloaded file if its segment map
+    covers them, or None.
+    """
+    path = cache_manager.path(file_id)
+    segment_map = SegmentMap.load(path + MAP_SUFFIX)
+    if segment_map is None or not segment_map.covers(start, stop):
+        return None
+    try:
+        f = open(path + PART_SUFFIX, 'rb')
+    except FileNotFoundError:
+        return None
+    if os.fstat(f.fileno()).st_size < stop:
+        f.close()
+        return None
+    return _read_and_close(f, start, stop)
+
+def _read_and_close(f, start, stop, chunk_size=64 * 1024):
+    try:
+        yield from _tail(f, lambda position: (stop, True, None), start, stop, chunk_size)
+    finally:
+        f.close()
+
+def partial_bytes(cache_manager, file_id):
+    """Bytes held by a partly downloaded file that nothing is downloading."""
+    segment_map = SegmentMap.load(cache_manager.path(file_id) + MAP_SUFFIX)
+    if segment_map is None:
+        return 0
+    try:
+        return min(segment_map.count() * segment_map.segment_size, os.path.getsize(cache_manager.path(file_id) + PART_SUFFIX))
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,212 @@
+"""
+Query-plan regression check for database.py.
+
+Seeds a throwaway database, calls the database.py read and write paths the views, the API and the
+bot use, records every SQL statement they issue and runs EXPLAIN on each one. Exits with status 1
+if any statement has to scan a whole table instead of searching an index, or if a paginated
+(LIMIT) query has to sort its matching rows instead of reading them in index order.
+
+Runs against an in-memory SQLite database by default. Set EXPLAIN_DATABASE_URL to check a scratch
+MySQL database instead (its tables are dropped and recreated).
+
+    python explain_queries.py --rows 20000
+"""
+import os
+import re
+import sys
+import click
+from flask import Flask
+from sqlalchemy import event, insert
+from models import db, File, Folder
+import database
+
+# Whole-table reads that are intended, such as the admin user list
+ALLOWED_FULL_SCANS = {'get_all_users'}
+
+# Paginated queries allowed to sort their matching rows, because no index can return them in order
+ALLOWED_SORTS = {
+    # A text search sorts the files the full-text index matched, by score or by column: the score
+    # only exists for the matches, and no B-tree returns just the matches in column order
+    'text search': r'file_matches|MATCH \(files\.filename\) AGAINST',
+    # Folder sizes live in folder_stats, joined to the folders being listed: only folders are sorted, never files
+    'folder size': r'ORDER BY folder_stats(_\d+)?\.total_size',
+    # Folder search matches names with LIKE '%...%' inside a path range, then sorts the matches
+    'folder search': r'folders\.name LIKE',
+}
+
+# Every sort_by the listing pages offer
+SORTS = ('name', 'size', 'date', 'type', 'folder')
+
+def create_explain_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('EXPLAIN_DATABASE_URL', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    database.rebuild_search_index()
+    for i in range(20):
+        database.create_folder(f'root/projects/p{i}/docs')
+    batch = []
+    for i in range(rows):
+        batch.append({
+            'filename': f'report_{i}.pdf' if i % 3 else f'holiday photo {i}.jpg',
+            'file_id': f'file_id_{i}',
+            'folder': f'root/projects/p{i % 20}/docs',
+            'size': i * 37 % 100000,
+            'mime_type': 'application/pdf' if i % 3 else 'image/jpeg',
+            'is_deleted': i % 50 == 0
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(File), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(File), batch)
+    db.session.commit()
+    database.add_user('admin', 'admin')
+    user = database.add_user('alice', 'alice')
+    database.update_user_paths(user.id, ['root/projects/p1', 'root/projects/p2'])
+    return user.id
+
+def workload(user_id):
+    """Yields (label, callable) pairs covering the queries in database.py."""
+    folder = 'root/projects/p3/docs'
+    folder_id = database.get_folder_id_by_path(folder)
+    deleted_folder_id = database.get_folder_id_by_path('root/projects/p10')
+    file = File.query.filter_by(folder=folder, is_deleted=False).first()
+
+    yield 'get_file_by_id', lambda: database.get_file_by_id(file.id)
+    yield 'get_db_id_by_file_id', lambda: database.get_db_id_by_file_id(file.file_id)
+    yield 'get_file_by_telegram_file_id', lambda: database.get_file_by_telegram_file_id(file.file_id)
+    yield 'get_filename_by_telegram_file_id', lambda: database.get_filename_by_telegram_file_id(file.file_id)
+    yield 'is_file_deleted', lambda: database.is_file_deleted(file.file_id)
+    yield 'get_folder_by_id', lambda: database.get_folder_by_id(folder_id)
+    yield 'get_folder_ancestors', lambda: database.get_folder_ancestors(folder)
+    yield 'get_folder_contents', lambda: database.get_folder_contents(folder)
+    yield 'get_folder_contents_for_user', lambda: database.get_folder_contents_for_user(user_id, 'root/projects/p1/docs')
+    yield 'get_all_files_in_folder', lambda: database.get_all_files_in_folder('root/projects/p4')
+    yield 'get_all_users', database.get_all_users
+    yield 'get_user_by_username', lambda: database.get_user_by_username('alice')
+    yield 'get_user_paths', lambda: database.get_user_paths(user_id)
+
+    def paginate(files, folders, sort_by, sort_order):
+        # The first page, the next and previous pages from its cursors, and a page by number
+        page = database.paginate_files_and_folders(files, folders, sort_by, sort_order, 20)
+        database.paginate_files_and_folders(files, folders, sort_by, sort_order, 20, cursor=page[3])
+        if page[3]:
+            database.paginate_files_and_folders(files, folders, sort_by, sort_order, 20, before=page[3])
+        database.paginate_files_and_folders(files, folders, sort_by, sort_order, 20, page=3)
+
+    admin_id = database.get_user_by_username('admin').id
+    listings = {
+        'index': lambda sort_by: (database.get_all_files_query_for_user(admin_id), None),
+        'index for user': lambda sort_by: (database.get_all_files_query_for_user(user_id), None),
+        'folder': lambda sort_by: database.get_folder_contents_query(folder),
+        'folder for user': lambda sort_by: database.get_folder_contents_query_for_user(user_id, 'root/projects/p1/docs'),
+        'recycle bin': lambda sort_by: database.get_deleted_items_query(),
+        'search': lambda sort_by: database.search_query('photo', 'root/projects', None, sort_by=sort_by),
+        'search without text': lambda sort_by: database.search_query(None, 'root/projects/p5', None, sort_by=sort_by),
+        'search folders': lambda sort_by: database.search_query('docs', 'root/projects', 'folder', sort_by=sort_by),
+    }
+    for listing, queries in listings.items():
+        sorts = SORTS + (database.RELEVANCE,) if listing.startswith('search') else SORTS
+        for sort_by in sorts:
+            for sort_order in ('asc', 'desc'):
+                def paginate_listing(queries=queries, sort_by=sort_by, sort_order=sort_order):
+                    paginate(*queries(sort_by), sort_by, sort_order)
+                yield f'paginate {listing} by {sort_by} {sort_order}', paginate_listing
+
+    yield 'search_files relevance', lambda: database.search_files('report 12', None, None, sort_by='relevance')
+    yield 'search_files by name', lambda: database.search_files('photo', 'root/projects/p5', None, sort_by='name', sort_order='asc')
+    yield 'search_files by size range', lambda: database.search_files(None, None, None, min_size=1000, max_size=2000)
+    yield 'search_folders', lambda: database.search_folders('docs', 'root/projects', sort_by='name', sort_order='asc')
+
+    yield 'rename_item folder', lambda: database.rename_item(database.get_folder_id_by_path('root/projects/p6'), 'p6b', is_folder=True)
+    yield 'move_items', lambda: database.move_items([{'id': database.get_folder_id_by_path('root/projects/p7'), 'type': 'folder'}], 'root/projects/p8')
+    yield 'copy_items', lambda: database.copy_items([{'id': database.get_folder_id_by_path('root/projects/p9'), 'type': 'folder'}], 'root')
+    yield 'delete_item', lambda: database.delete_item([{'id': deleted_folder_id, 'type': 'folder'}])
+    yield 'restore_items', lambda: database.restore_items([{'id': deleted_folder_id, 'type': 'folder'}])
+    yield 'permanent_delete_items', lambda: database.permanent_delete_items([{'id': file.id, 'type': 'file'}])
+
+def record_statements(label_holder, statements):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Plain INSERT ... VALUES statements have no plan worth checking
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if executemany or verb not in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT') or (verb == 'INSERT' and 'SELECT' not in statement.upper()):
+            return
+        statements.append((label_holder[0], statement, parameters))
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return before_cursor_execute
+
+def _is_paginated(statement):
+    return re.search(r'\bLIMIT\b', statement, re.IGNORECASE) is not None
+
+def plan_problems(statement, parameters):
+    """
+    Returns what the database's EXPLAIN says is wrong with the statement: tables it reads in full,
+    and, for a paginated query, a sort of every matching row before the LIMIT is applied.
+    """
+    table_names = {table.name for table in db.metadata.sorted_tables}
+    sorts = _is_paginated(statement) and not any(re.search(pattern, statement) for pattern in ALLOWED_SORTS.values())
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if db.engine.dialect.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            problems = []
+            for row in cursor.fetchall():
+                detail = row[-1]
+                # "SCAN files" reads every row, "SCAN files USING INDEX ..." every index entry
+                match = re.match(r'SCAN (\w+)', detail)
+                if match and re.sub(r'_\d+$', '', match.group(1)) in table_names:
+                    problems.append(detail)
+                elif re.match(r'SCAN files_fts VIRTUAL TABLE INDEX \d+:=', detail):
+                    # Constrained by rowid: the full-text MATCH runs again for every row of an outer loop
+                    problems.append(detail)
+                elif sorts and detail.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in detail:
+                    problems.append(detail)
+            return problems
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        problems = [f"{row['table']} ({row['type']})" for row in rows if row.get('type') in ('ALL', 'index')]
+        if sorts:
+            problems += [f"{row['table']} (filesort)" for row in rows if 'Using filesort' in (row.get('Extra') or '')]
+        return problems
+    finally:
+        connection.close()
+
+@click.command()
+@click.option('--rows', default=20000, help='Number of files to seed.')
+@click.option('--verbose', is_flag=True, help='Print every statement, not only the regressions.')
+def explain(rows, verbose):
+    """Fail if any query in database.py scans a whole table, or any paginated one sorts its rows."""
+    app = create_explain_app()
+    with app.app_context():
+        click.echo(f'Seeding {rows} files...')
+        user_id = seed(rows)
+
+        label = [None]
+        statements = []
+        listener = record_statements(label, statements)
+        for label[0], run in workload(user_id):
+            run()
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+        failures = 0
+        for statement_label, statement, parameters in statements:
+            problems = plan_problems(statement, parameters)
+            if problems and statement_label not in ALLOWED_FULL_SCANS:
+                failures += 1
+                click.echo(f'REGRESSION in {statement_label}: {", ".join(problems)}\n    {" ".join(statement.split())}')
+            elif verbose:
+                click.echo(f'ok   {statement_label}: {" ".join(statement.split())[:120]}')
+
+        click.echo(f'{len(statements)} statements checked, {failures} regressions.')
+        sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    explain()
@@ -0,0 +1,100 @@
+import hashlib
+import uuid
+from urllib.parse import quote
+from flask import Response
+from werkzeug.http import http_date
+
+# Requests asking for more ranges than this are answered with the whole file
+MAX_RANGES = 16
+
+def file_etag(file_id):
+    """A strong ETag for a Telegram file. The content behind a file_id never changes, so the id alone identifies it."""
+    return '"' + hashlib.sha1(file_id.encode()).hexdigest() + '"'
+
+def if_range_matches(request, etag, last_modified=None):
+    """True unless an If-Range header names a different version of the file than the one being served."""
+    if 'If-Range' not in request.headers:
+        return True
+    if_range = request.if_range
+    if if_range.etag:
+        # If-Range only accepts strong validators
+        return not request.headers['If-Range'].lstrip().startswith('W/') and if_range.etag == etag.strip('"')
+    if if_range.date and last_modified:
+        return int(last_modified.timestamp()) <= int(if_range.date.timestamp())
+    return False
+
+def parse_ranges(request, size):
+    """
+    Returns the byte ranges requested for a file of `size` bytes as sorted, non-overlapping
+    (start, stop) pairs with stop exclusive, None if the whole file should be sent, or [] if
+    none of the ranges can be satisfied.
+    """
+    requested = request.range
+    if requested is None or requested.units != 'bytes' or len(requested.ranges) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for start, stop in requested.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def file_headers(etag, last_modified=None, filename=None):
+    """The validator and disposition headers every response for a file carries, whatever its status."""
+    headers = {'Accept-Ranges': 'bytes', 'ETag': etag}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    if filename:
+        headers['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(filename)}"
+    return headers
+
+def ranged_response(request, size, read_range, mimetype, etag, last_modified=None, filename=None):
+    """
+    Builds a 200, 206 or 416 response for a file of `size` bytes. read_range(start, stop) must return
+    an iterable of the bytes in [start, stop); it is only called for the parts actually sent.
+    """
+    headers = file_headers(etag, last_modified, filename)
+    ranges = parse_ranges(request, size) if if_range_matches(request, etag, last_modified) else None
+
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return Response(read_range(0, size), 200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(read_range(start, stop), 206, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+
+    def multipart_body():
+        for i, (start, stop) in enumerate(ranges):
+            yield (b'\r\n' if i else b'') + part_headers[i]
+            yield from read_range(start, stop)
+        yield closing
+
+    headers['Content-Length'] = str(sum(len(h) for h in part_headers) + 2 * (len(ranges) - 1)
+                                    + sum(stop - start for start, stop in ranges) + len(closing))
+    return Response(multipart_body(), 206, headers=headers, content_type=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
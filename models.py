@@ -5,17 +5,62 @@ db = SQLAlchemy()
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Folder listings sorted by name, and the live/deleted split for date and size sorts
+        db.Index('ix_files_deleted_folder_filename', 'is_deleted', 'folder', 'filename'),
+        db.Index('ix_files_deleted_upload_date', 'is_deleted', 'upload_date'),
+        db.Index('ix_files_deleted_size', 'is_deleted', 'size'),
+        # The index page and the recycle bin sorted by name, type and folder. Keyset pages order by
+        # (column, id), which these give since every index entry ends with the row id
+        db.Index('ix_files_deleted_filename', 'is_deleted', 'filename'),
+        db.Index('ix_files_deleted_mime_type', 'is_deleted', 'mime_type'),
+        db.Index('ix_files_deleted_folder', 'is_deleted', 'folder'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String, nullable=False)
-    file_id = db.Column(db.String, nullable=False)
+    file_id = db.Column(db.String, nullable=False, index=True)
     folder = db.Column(db.String, nullable=False, index=True)
     size = db.Column(db.Integer)
     mime_type = db.Column(db.String)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     thumbnail_file_id = db.Column(db.String)
-    is_deleted = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    is_deleted = db.Column(db.Boolean, nullable=False, default=False)
+    deleted_at = db.Column(db.DateTime)
     cover_file_id = db.Column(db.String)
     message_link = db.Column(db.String)
+    # Identify the same content across rows: a SHA-256 of the bytes for files uploaded here,
+    # and Telegram's file_unique_id, which stays the same for every file_id of one file
+    content_hash = db.Column(db.String(64), index=True)
+    file_unique_id = db.Column(db.String, index=True)
+
+class Folder(db.Model):
+    __tablename__ = 'folders'
+    __table_args__ = (
+        # Subfolder listings, then the recycle bin, sorted by name, date and path
+        db.Index('ix_folders_parent_deleted_name', 'parent_id', 'is_deleted', 'name'),
+        db.Index('ix_folders_parent_deleted_upload_date', 'parent_id', 'is_deleted', 'upload_date'),
+        db.Index('ix_folders_parent_deleted_path', 'parent_id', 'is_deleted', 'path'),
+        db.Index('ix_folders_deleted_name', 'is_deleted', 'name'),
+        db.Index('ix_folders_deleted_upload_date', 'is_deleted', 'upload_date'),
+        db.Index('ix_folders_deleted_path', 'is_deleted', 'path'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('folders.id', ondelete='CASCADE'))
+    name = db.Column(db.String, nullable=False)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    path = db.Column(db.String, nullable=False, unique=True)
+    upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    is_deleted = db.Column(db.Boolean, nullable=False, default=False)
+    deleted_at = db.Column(db.DateTime)
+    stats = db.relationship('FolderStats', uselist=False, lazy='joined', viewonly=True)
+
+class FolderStats(db.Model):
+    """Totals over the live files in a folder's whole subtree, kept up to date by delta."""
+    __tablename__ = 'folder_stats'
+    folder_id = db.Column(db.Integer, db.ForeignKey('folders.id', ondelete='CASCADE'), primary_key=True)
+    total_size = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    last_modified = db.Column(db.DateTime)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -27,7 +72,52 @@ class User(db.Model):
 class UserPath(db.Model):
     __tablename__ = 'user_paths'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     path = db.Column(db.String, nullable=False)
 
 
+class UploadTask(db.Model):
+    """A file staged on local disk waiting to be uploaded to Telegram by the upload workers."""
+    __tablename__ = 'upload_tasks'
+    __table_args__ = (
+        # Workers claim the next task by status, then highest priority, then oldest
+        db.Index('ix_upload_tasks_status_priority', 'status', 'priority', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # None for uploads streamed straight from the request, which are never staged on disk
+    file_path = db.Column(db.String)
+    filename = db.Column(db.String, nullable=False)
+    folder = db.Column(db.String, nullable=False)
+    mime_type = db.Column(db.String)
+    size = db.Column(db.BigInteger)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String, nullable=False, default='queued')
+    bytes_uploaded = db.Column(db.BigInteger, nullable=False, default=0)
+    content_hash = db.Column(db.String(64))
+    deduplicated = db.Column(db.Boolean, default=False)
+    error = db.Column(db.String)
+    telegram_file_id = db.Column(db.String)
+    user_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'folder': self.folder,
+            'mime_type': self.mime_type,
+            'size': self.size,
+            'priority': self.priority,
+            'status': self.status,
+            'streamed': self.file_path is None,
+            'bytes_uploaded': self.bytes_uploaded,
+            'progress': round(self.bytes_uploaded / self.size * 100, 1) if self.size else None,
+            'error': self.error,
+            'telegram_file_id': self.telegram_file_id,
+            'deduplicated': bool(self.deduplicated),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,178 @@
+import logging
+import queue
+import threading
+import uuid
+from datetime import datetime
+import bot_handler
+from config import PREWARM_WORKERS, PREWARM_MAX_QUEUED_FILES, PREWARM_CACHE_SHARE
+
+logger = logging.getLogger(__name__)
+
+# Why a file of a prewarm job was not queued
+SKIP_REASONS = ('cached', 'in_flight', 'queued', 'over_budget', 'queue_full')
+
+class PrewarmJob:
+    """Progress of one request to download files into the cache, as reported by the API."""
+
+    def __init__(self, description, user=None):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.user = user
+        self.status = 'queued'
+        self.total_files = 0
+        self.queued_files = 0
+        self.queued_bytes = 0
+        self.cached_files = 0
+        self.cached_bytes = 0
+        self.failed_files = 0
+        self.cancelled_files = 0
+        self.skipped = dict.fromkeys(SKIP_REASONS, 0)
+        self.cancelled = False
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    @property
+    def pending_files(self):
+        return self.queued_files - self.cached_files - self.failed_files - self.cancelled_files
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'status': self.status,
+            'total_files': self.total_files,
+            'queued_files': self.queued_files,
+            'queued_bytes': self.queued_bytes,
+            'cached_files': self.cached_files,
+            'cached_bytes': self.cached_bytes,
+            'failed_files': self.failed_files,
+            'cancelled_files': self.cancelled_files,
+            'skipped': dict(self.skipped),
+            'progress': round((self.queued_files - self.pending_files) / self.queued_files * 100, 1) if self.queued_files else 100.0,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class PrewarmEngine:
+    """
+    Downloads files into the cache ahead of time on a fixed pool of worker threads fed by one
+    bounded queue. Files already cached, already downloading or already queued are skipped, and
+    the bytes queued at any time are kept within a share of the cache size, so prewarming a large
+    folder does not evict what it has just cached.
+    """
+
+    def __init__(self, workers=PREWARM_WORKERS, max_queued=PREWARM_MAX_QUEUED_FILES, cache_share=PREWARM_CACHE_SHARE,
+                 max_finished_jobs=50):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.cache_share = cache_share
+        self.max_finished_jobs = max_finished_jobs
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._queued = {}
+        self._queued_bytes = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    @property
+    def budget_bytes(self):
+        """Most bytes that may be queued at once; 0 when the cache has no size limit."""
+        return int(bot_handler.cache_manager.max_bytes * self.cache_share)
+
+    def submit(self, files, description, user=None):
+        """Queues (telegram_file_id, size) pairs for caching and returns the job tracking them."""
+        job = PrewarmJob(description, user)
+        job.total_files = len(files)
+        budget = self.budget_bytes
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            for file_id, size in files:
+                reason = self._skip_reason(file_id, size or 0, budget)
+                if reason:
+                    job.skipped[reason] += 1
+                    continue
+                self._queued[file_id] = size or 0
+                self._queued_bytes += size or 0
+                job.queued_files += 1
+                job.queued_bytes += size or 0
+                self._queue.put((job, file_id, size))
+            if not job.queued_files:
+                job.status = 'completed'
+                job.finished_at = datetime.utcnow()
+            self._start_workers()
+        logger.info(f"Prewarm '{description}': {job.queued_files} of {job.total_files} files queued, skipped {job.skipped}.")
+        return job
+
+    def cancel(self, job_id):
+        """Drops the files of a job that have not started downloading yet. Returns False if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def metrics(self):
+        with self._lock:
+            return {'queued_files': len(self._queued), 'queued_bytes': self._queued_bytes,
+                    'budget_bytes': self.budget_bytes, 'workers': self.workers}
+
+    def _skip_reason(self, file_id, size, budget):
+        if file_id in self._queued:
+            return 'queued'
+        status, _ = bot_handler.get_cache_status(file_id)
+        if status == 'completed':
+            return 'cached'
+        if status == 'caching':
+            return 'in_flight'
+        if len(self._queued) >= self.max_queued:
+            return 'queue_full'
+        if budget and self._queued_bytes + size > budget:
+            return 'over_budget'
+        return None
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self._jobs.values() if job.finished_at]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job.id]
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            thread = threading.Thread(target=self._run, name=f'prewarm-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job, file_id, size = self._queue.get()
+            cancelled = job.cancelled
+            cached = False
+            try:
+                if not cancelled:
+                    job.status = 'running'
+                    cached = bot_handler.download_file_to_cache(file_id, job.user, size)
+            except Exception as e:
+                logger.error(f"Prewarming {file_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._queued_bytes -= self._queued.pop(file_id, 0)
+                    if cancelled:
+                        job.cancelled_files += 1
+                    elif cached:
+                        job.cached_files += 1
+                        job.cached_bytes += size or 0
+                    else:
+                        job.failed_files += 1
+                    if not job.pending_files:
+                        job.status = 'cancelled' if job.cancelled else 'completed'
+                        job.finished_at = datetime.utcnow()
+
+prewarm_engine = PrewarmEngine()
@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import database
+from models import db
+
+logger = logging.getLogger(__name__)
+
+class PurgeJob:
+    """Progress of one recycle-bin purge, as reported by the API."""
+
+    def __init__(self, description):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = 'queued'
+        self.total_files = 0
+        self.total_folders = 0
+        self.purged_files = 0
+        self.purged_folders = 0
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    def to_dict(self):
+        total = self.total_files + self.total_folders
+        purged = self.purged_files + self.purged_folders
+        return {
+            'id': self.id,
+            'description': self.description,
+            'status': self.status,
+            'total_files': self.total_files,
+            'total_folders': self.total_folders,
+            'purged_files': self.purged_files,
+            'purged_folders': self.purged_folders,
+            'progress': round(purged / total * 100, 1) if total else (100.0 if self.status == 'completed' else 0.0),
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class PurgeEngine:
+    """
+    Runs recycle-bin purges on a single background thread, one job at a time, so requests only
+    queue a job and return. Each job deletes in bounded batches with a short pause in between,
+    which keeps every transaction short and lets live traffic through.
+    """
+
+    def __init__(self, batch_size=database.PURGE_BATCH_SIZE, pause_seconds=0.05, max_finished_jobs=50):
+        self.app = None
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._retention_thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def _submit(self, description, scope_factory):
+        job = PurgeJob(description)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='purge-worker', daemon=True)
+                self._worker.start()
+        self._queue.put((job, scope_factory))
+        return job
+
+    def empty_recycle_bin(self):
+        return self._submit('Empty recycle bin', database.purge_scope_for_all)
+
+    def purge_items(self, items):
+        return self._submit(f'Permanently delete {len(items)} item(s)', lambda: database.purge_scope_for_items(items))
+
+    def purge_older_than(self, days):
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        return self._submit(f'Purge items deleted more than {days} day(s) ago', lambda: database.purge_scope_for_retention(cutoff))
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self._jobs.values() if job.finished_at]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job.id]
+
+    def _run(self):
+        while True:
+            job, scope_factory = self._queue.get()
+            with self.app.app_context():
+                try:
+                    job.status = 'running'
+                    file_filter, folder_filter = scope_factory()
+                    job.total_files, job.total_folders = database.count_purge_scope(file_filter, folder_filter)
+                    for kind, deleted in database.iter_purge(file_filter, folder_filter, self.batch_size):
+                        if kind == 'files':
+                            job.purged_files += deleted
+                        else:
+                            job.purged_folders += deleted
+                        time.sleep(self.pause_seconds)
+                    job.status = 'completed'
+                    logger.info(f"Purge '{job.description}' finished: {job.purged_files} files, {job.purged_folders} folders.")
+                except Exception as e:
+                    db.session.rollback()
+                    job.status = 'failed'
+                    job.error = str(e)
+                    logger.error(f"Purge '{job.description}' failed: {e}")
+                finally:
+                    db.session.remove()
+                    job.finished_at = datetime.utcnow()
+
+    def start_retention(self, days, interval_minutes):
+        """Queues a purge of everything deleted more than `days` days ago every `interval_minutes`."""
+        if days <= 0 or self._retention_thread is not None:
+            return
+
+        def retention_worker():
+            logger.info(f"Recycle bin retention started: purging items deleted more than {days} day(s) ago every {interval_minutes} minutes.")
+            while True:
+                self.purge_older_than(days)
+                time.sleep(interval_minutes * 60)
+
+        self._retention_thread = threading.Thread(target=retention_worker, name='purge-retention', daemon=True)
+        self._retention_thread.start()
+
+purge_engine = PurgeEngine()
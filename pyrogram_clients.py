@@ -7,7 +7,7 @@ import os # 導入 os 模組，用於操作文件系統
 from pyrogram import Client
 from pyrogram.errors import PeerIdInvalid
 from pyrogram.handlers import RawUpdateHandler
-from config import API_ID, API_HASH, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID # 從 config 導入配置參數
+from config import API_ID, API_HASH, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, PYROGRAM_WORKERS, PYROGRAM_DOWNLOAD_PARALLELISM # 從 config 導入配置參數
 from database import add_file
 
 logging.basicConfig(level=logging.INFO) # 配置日誌級別為 INFO
@@ -26,7 +26,9 @@ class PyrogramClientManager: # Pyrogram 客戶端管理器類
                 "pyrogram_client",
                 api_id=API_ID,
                 api_hash=API_HASH,
-                bot_token=TELEGRAM_BOT_TOKEN
+                bot_token=TELEGRAM_BOT_TOKEN,
+                # 每個下載分段各佔一個傳輸名額，否則並行下載會被 Pyrogram 串行化
+                max_concurrent_transmissions=PYROGRAM_WORKERS * max(PYROGRAM_DOWNLOAD_PARALLELISM, 1)
             )
             # WAL mode handler
             self.wal_mode_set = False
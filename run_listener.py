@@ -10,7 +10,7 @@ from datetime import datetime
 
 # Import necessary components from the Flask app
 from app import create_app
-from database import add_file, get_folder_id_by_path, create_folder
+from database import add_files_bulk
 
 # --- Setup ---
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -35,30 +35,21 @@ client = Client(
     bot_token=TELEGRAM_BOT_TOKEN
 )
 
-# --- New Database Function (Adapter) ---
-def add_file_with_folder_creation(filename, file_id, folder, size=None, mime_type=None, thumbnail_file_id=None, message_link=None):
-    """Ensures parent folders exist before adding the file, using the new database functions."""
+# --- Database Function (Adapter) ---
+def add_files_with_folder_creation(records):
+    """Adds file records in one transaction, creating their folders as needed. Returns the number added."""
     try:
         with flask_app.app_context():
-            path_parts = folder.split('/')
-            current_path = ""
-            for i, part in enumerate(path_parts):
-                if i == 0:
-                    current_path = part
-                else:
-                    current_path = f"{current_path}/{part}"
-                
-                if get_folder_id_by_path(current_path) is None:
-                    logger.info(f"Creating folder marker for: {current_path}")
-                    create_folder(current_path)
-
-            # Now that folders are created, add the file
-            add_file(filename, file_id, folder, size, mime_type, thumbnail_file_id, message_link)
-            logger.info(f"Successfully added file to DB: {filename} in folder {folder}")
-        return True
+            outcomes = add_files_bulk(records)
     except Exception as e:
-        logger.error(f"Database error in add_file_with_folder_creation: {e}")
-        return False
+        logger.error(f"Database error in add_files_with_folder_creation: {e}")
+        return 0
+    for outcome in outcomes:
+        if outcome['added']:
+            logger.info(f"Successfully added file to DB: {outcome['filename']}")
+        else:
+            logger.error(f"Failed to add file to DB: {outcome['filename']}: {outcome['error']}")
+    return sum(1 for outcome in outcomes if outcome['added'])
 
 # --- Custom Argument Parsing (from old script) ---
 def parse_custom_args(command_text: str):
@@ -124,6 +115,8 @@ def extract_media_info(message: Message):
         return None
 
     file_id = getattr(media, 'file_id', None)
+    # Stays the same for every file_id of one file, so re-posted copies are recognised on ingest
+    file_unique_id = getattr(media, 'file_unique_id', None)
     mime_type = getattr(media, 'mime_type', 'application/octet-stream')
     file_name = getattr(media, 'file_name', None)
     file_size = getattr(media, 'file_size', 0)
@@ -146,7 +139,7 @@ def extract_media_info(message: Message):
         ext = mimetypes.guess_extension(mime_type) or ''
         file_name = f"{file_id}{ext}"
 
-    return file_id, file_name, mime_type, file_size, thumbnail_file_id
+    return file_id, file_name, mime_type, file_size, thumbnail_file_id, file_unique_id
 
 # --- Event Handlers (from old script) ---
 @client.on_message(filters.command("savdb"))
@@ -185,8 +178,6 @@ async def save_file_id(client: Client, message: Message):
     if not target_folder.startswith('root'):
         target_folder = f'root/{target_folder}'
 
-    saved_count = 0
-    failed_count = 0
     messages_to_process = []
 
     if args['batch']:
@@ -238,10 +229,11 @@ async def save_file_id(client: Client, message: Message):
     if 'processing_msg' not in locals():
         processing_msg = await message.reply_text(f"🔍 Processing {len(messages_to_process)} message(s)...")
 
+    records = []
     for msg in messages_to_process:
         media_info = extract_media_info(msg)
         if media_info:
-            file_id, file_name, mime_type, file_size, thumbnail_file_id = media_info
+            file_id, file_name, mime_type, file_size, thumbnail_file_id, file_unique_id = media_info
             
             if args['name'] and not (args['batch'] or args['interval']):
                 new_name = args['name']
@@ -257,11 +249,19 @@ async def save_file_id(client: Client, message: Message):
                 chat_id_str = chat_id_str[4:]
             message_link = f"https://t.me/c/{chat_id_str}/{msg.id}"
 
-            if add_file_with_folder_creation(file_name, file_id, target_folder, file_size, mime_type, thumbnail_file_id, message_link):
-                saved_count += 1
-            else:
-                failed_count += 1
-        await asyncio.sleep(0.1)
+            records.append({
+                'filename': file_name,
+                'file_id': file_id,
+                'folder': target_folder,
+                'size': file_size,
+                'mime_type': mime_type,
+                'thumbnail_file_id': thumbnail_file_id,
+                'message_link': message_link,
+                'file_unique_id': file_unique_id
+            })
+
+    saved_count = add_files_with_folder_creation(records)
+    failed_count = len(records) - saved_count
 
     try:
         reply_text = f"✅ Operation Complete!\n\n- **Target Folder**: `{target_folder}`\n"
@@ -279,7 +279,7 @@ async def handle_monitored_file(client: Client, message: Message):
     
     media_info = extract_media_info(message)
     if media_info:
-        file_id, file_name, mime_type, file_size, thumbnail_file_id = media_info
+        file_id, file_name, mime_type, file_size, thumbnail_file_id, file_unique_id = media_info
         # Get chat title and create a safe folder name from it
         chat_title = message.chat.title if message.chat.title else str(message.chat.id)
         safe_chat_title = re.sub(r'[\\/*?:\"<>|]', "", chat_title)
@@ -292,7 +292,16 @@ async def handle_monitored_file(client: Client, message: Message):
             chat_id_str = chat_id_str[4:]
         message_link = f"https://t.me/c/{chat_id_str}/{message.id}"
 
-        add_file_with_folder_creation(file_name, file_id, monitored_folder, file_size, mime_type, thumbnail_file_id, message_link)
+        add_files_with_folder_creation([{
+            'filename': file_name,
+            'file_id': file_id,
+            'folder': monitored_folder,
+            'size': file_size,
+            'mime_type': mime_type,
+            'thumbnail_file_id': thumbnail_file_id,
+            'message_link': message_link,
+            'file_unique_id': file_unique_id
+        }])
     else:
         logger.warning(f"Could not extract file information from message: {message}")
 
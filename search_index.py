@@ -0,0 +1,173 @@
+import logging
+import re
+import sqlite3
+from sqlalchemy import Table, Column, Integer, String, Float, MetaData, text, literal_column, inspect, select
+from sqlalchemy.dialects.mysql import match
+from models import db, File
+
+logger = logging.getLogger(__name__)
+
+RELEVANCE = 'relevance'
+
+# The FTS5 virtual table lives outside db.metadata so create_all/drop_all never treat it as a plain table
+fts_metadata = MetaData()
+files_fts = Table(
+    'files_fts', fts_metadata,
+    Column('rowid', Integer),
+    Column('filename', String),
+    Column('rank', Float)
+)
+
+def _tokens(query_text):
+    return re.findall(r'\w+', query_text or '')
+
+class LikeSearchIndex:
+    """Fallback used when the database has no full-text support: a plain substring scan."""
+    name = 'like'
+
+    def ensure(self):
+        return False
+
+    def rebuild(self):
+        return File.query.count()
+
+    def filter(self, query, query_text):
+        return query.filter(File.filename.like(f'%{query_text}%'))
+
+    def rank(self, query, query_text):
+        return self.filter(query, query_text).order_by(File.filename.asc(), File.id.asc())
+
+class SQLiteFTS5Index(LikeSearchIndex):
+    """
+    SQLite FTS5 external-content index over files.filename.
+    Triggers keep it in sync with every INSERT, UPDATE OF filename and DELETE on files,
+    including the set-based statements used for move and copy.
+    """
+    name = 'fts5'
+
+    SETUP_STATEMENTS = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+            filename, content='files', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF filename ON files BEGIN
+            INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+            INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+        END""",
+    ]
+
+    def ensure(self):
+        """Creates the index and its triggers if missing. Returns True if the index had to be built."""
+        created = not inspect(db.engine).has_table('files_fts')
+        for statement in self.SETUP_STATEMENTS:
+            db.session.execute(text(statement))
+        db.session.commit()
+        if created:
+            self.rebuild()
+        return created
+
+    def rebuild(self):
+        db.session.execute(text("INSERT INTO files_fts(files_fts) VALUES ('rebuild')"))
+        db.session.commit()
+        return File.query.count()
+
+    def _match_expression(self, query_text):
+        # Every token must match, each as a prefix: "report 20" finds "Report_2024.pdf"
+        return ' '.join(f'"{token}"*' for token in _tokens(query_text))
+
+    def _matches(self, query_text):
+        """The rowid and rank of every file matching the query, as a CTE computed once per statement."""
+        matches = select(files_fts.c.rowid, files_fts.c.rank).where(
+            literal_column('files_fts').op('MATCH')(self._match_expression(query_text))
+        ).cte('file_matches')
+        # Joined directly, or through a CTE SQLite folds back in, the planner tends to walk files and run
+        # the MATCH once per row; materialized, the matches are found once and looked up by rowid
+        if sqlite3.sqlite_version_info >= (3, 35):
+            matches = matches.prefix_with('MATERIALIZED')
+        return matches
+
+    def filter(self, query, query_text):
+        if not _tokens(query_text):
+            return super().filter(query, query_text)
+        matches = self._matches(query_text)
+        return query.join(matches, matches.c.rowid == File.id)
+
+    def rank(self, query, query_text):
+        if not _tokens(query_text):
+            return super().rank(query, query_text)
+        matches = self._matches(query_text)
+        # FTS5's rank is bm25(), where smaller means more relevant
+        return query.join(matches, matches.c.rowid == File.id).order_by(matches.c.rank.asc(), File.id.asc())
+
+class MySQLFulltextIndex(LikeSearchIndex):
+    """
+    InnoDB FULLTEXT index with the ngram parser, so CJK filenames without spaces are tokenized too.
+    InnoDB maintains it on every write to files by itself.
+    """
+    name = 'fulltext'
+    INDEX_NAME = 'ix_files_filename_fulltext'
+
+    def _has_index(self):
+        return any(index['name'] == self.INDEX_NAME for index in inspect(db.engine).get_indexes('files'))
+
+    def ensure(self):
+        if self._has_index():
+            return False
+        db.session.execute(text(f'ALTER TABLE files ADD FULLTEXT INDEX {self.INDEX_NAME} (filename) WITH PARSER ngram'))
+        db.session.commit()
+        return True
+
+    def rebuild(self):
+        if self._has_index():
+            db.session.execute(text(f'ALTER TABLE files DROP INDEX {self.INDEX_NAME}'))
+            db.session.commit()
+        self.ensure()
+        return File.query.count()
+
+    def _match(self, query_text):
+        boolean_query = ' '.join(f'+{token}*' for token in _tokens(query_text))
+        return match(File.filename, against=boolean_query).in_boolean_mode()
+
+    def filter(self, query, query_text):
+        if not _tokens(query_text):
+            return super().filter(query, query_text)
+        return query.filter(self._match(query_text))
+
+    def rank(self, query, query_text):
+        if not _tokens(query_text):
+            return super().rank(query, query_text)
+        # MATCH ... AGAINST returns a relevance score where larger means more relevant
+        return self.filter(query, query_text).order_by(self._match(query_text).desc(), File.id.asc())
+
+_index_by_engine = {}
+
+def get_search_index():
+    """Returns the search index for the current database, falling back to LIKE when FTS is unavailable."""
+    engine_url = str(db.engine.url)
+    if engine_url not in _index_by_engine:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            index = SQLiteFTS5Index()
+        elif dialect == 'mysql':
+            index = MySQLFulltextIndex()
+        else:
+            index = LikeSearchIndex()
+        try:
+            if index.ensure():
+                logger.info(f"Built the '{index.name}' filename search index.")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Full-text search index unavailable, falling back to LIKE search: {e}")
+            index = LikeSearchIndex()
+        _index_by_engine[engine_url] = index
+    return _index_by_engine[engine_url]
+
+def rebuild_search_index():
+    """Rebuilds the filename search index from the files table. Returns the number of files indexed."""
+    _index_by_engine.pop(str(db.engine.url), None)
+    return get_search_index().rebuild()
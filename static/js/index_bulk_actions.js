@@ -279,7 +279,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (downloadToServerOnlyBtn) {
             downloadToServerOnlyBtn.addEventListener('click', function() {
                 if (currentFileId) {
-                    fetch(`/cache_file/${currentFileId}`, { method: 'POST' })
+                    fetch(`/api/cache_file/${currentFileId}`, { method: 'POST' })
                         .then(response => response.json())
                         .then(data => {
                             if (data.success) {
@@ -303,34 +303,41 @@ document.addEventListener('DOMContentLoaded', function() {
     const bulkDownloadBtn = document.getElementById('bulkDownloadToServerBtn');
     if (bulkDownloadBtn) {
         bulkDownloadBtn.addEventListener('click', async function() {
-            const checkboxes = document.querySelectorAll('.item-checkbox:checked');
-            const fileIds = Array.from(checkboxes)
-                .filter(cb => cb.dataset.itemType === 'file')
-                .map(cb => cb.dataset.telegramFileId);
+            // Folders are sent as they are; the server queues every file inside them
+            const selectedItems = Array.from(document.querySelectorAll('.item-checkbox:checked'))
+                .map(cb => ({
+                    id: cb.dataset.itemId,
+                    type: cb.dataset.itemType
+                }));
 
-            if (fileIds.length === 0) {
-                alert('Please select at least one file to download.'); // Reverted to alert
+            if (selectedItems.length === 0) {
+                alert('Please select at least one file or folder to download.');
                 return;
             }
 
             const myModal = bootstrap.Modal.getInstance(document.getElementById('copyLinksModal'));
             myModal.hide();
 
-            alert(`Starting background download for ${fileIds.length} files.`); // Reverted to alert
-
-            for (const fileId of fileIds) {
-                try {
-                    const response = await fetch(`/cache_file/${fileId}`, { method: 'POST' });
-                    const data = await response.json();
-                    if (!data.success) {
-                        alert(`Failed to start download for file ID: ${fileId}.`); // Reverted to alert
-                    }
-                } catch (error) {
-                    console.error('Error starting download for file ID:', fileId, error);
-                    alert(`An error occurred for file ID: ${fileId}.`); // Reverted to alert
+            try {
+                const response = await fetch('/api/prewarm', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ items: selectedItems }),
+                });
+                const job = await response.json();
+                if (!response.ok) {
+                    alert('Failed to start background download: ' + job.message);
+                    return;
                 }
-                // Small delay between requests to avoid overwhelming the server
-                await new Promise(resolve => setTimeout(resolve, 200));
+                const skipped = Object.values(job.skipped).reduce((a, b) => a + b, 0);
+                alert(`Queued ${job.queued_files} of ${job.total_files} files for background download` +
+                      (skipped ? ` (${job.skipped.cached} already cached, ${job.skipped.in_flight + job.skipped.queued} already in progress, ` +
+                                 `${job.skipped.over_budget + job.skipped.queue_full} over the cache budget or queue limit).` : '.'));
+            } catch (error) {
+                console.error('Error starting background download:', error);
+                alert('An error occurred while starting the background download.');
             }
         });
     }
@@ -0,0 +1,284 @@
+import concurrent.futures
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from cache_manager import CacheManager
+
+logger = logging.getLogger(__name__)
+
+# Output formats of resized variants and their MIME types
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+# Telegram stores thumbnails as JPEG
+ORIGINAL_MIMETYPE = 'image/jpeg'
+
+def render_variant(data, width, fmt, quality=80):
+    """Scales an image down (never up) to `width` pixels wide, keeping its aspect ratio, and encodes it as WebP or JPEG."""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width > width:
+            image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA', 'L') or (fmt == 'jpeg' and image.mode == 'RGBA'):
+            image = image.convert('RGBA' if fmt == 'webp' else 'RGB')
+        out = io.BytesIO()
+        if fmt == 'webp':
+            image.save(out, 'WEBP', quality=quality, method=4)
+        else:
+            image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+def render_image_thumbnail(src, dst, width, height):
+    """
+    Writes a JPEG no larger than width x height of an image. JPEGs are decoded straight at a reduced
+    scale with draft(), so a large photo never has to be decoded at full resolution.
+    """
+    with Image.open(src) as image:
+        if image.format == 'JPEG':
+            image.draft('RGB', (width, height))
+        image.thumbnail((width, height))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(dst, 'JPEG', quality=85)
+
+def render_video_thumbnail(src, dst, width, height, seek_seconds=1.0, timeout=60):
+    """
+    Writes a JPEG no larger than width x height of a video frame near seek_seconds with ffmpeg. The seek
+    comes before -i, so ffmpeg jumps to the nearest keyframe instead of decoding everything before it.
+    Videos shorter than seek_seconds fall back to their first frame.
+    """
+    scale = f"scale='min({width},iw)':'min({height},ih)':force_original_aspect_ratio=decrease"
+    for seek in (seek_seconds, 0):
+        command = ['ffmpeg', '-v', 'error', '-ss', str(seek), '-i', src, '-frames:v', '1', '-vf', scale, '-q:v', '2', '-y', dst]
+        process = subprocess.run(command, capture_output=True, timeout=timeout)
+        if process.returncode == 0 and os.path.exists(dst) and os.path.getsize(dst):
+            return
+    raise RuntimeError(f"ffmpeg could not extract a frame: {process.stderr.decode(errors='replace').strip()}")
+
+def content_key(path, sample_bytes=1024 * 1024, full_hash_limit=16 * 1024 * 1024):
+    """
+    Hash identifying a file by content. Files up to full_hash_limit are hashed whole; larger ones (videos)
+    by their size and samples from the start, middle and end, which is where frame data and indexes live.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(size.to_bytes(8, 'little'))
+    with open(path, 'rb') as f:
+        if size <= full_hash_limit:
+            for chunk in iter(lambda: f.read(sample_bytes), b''):
+                digest.update(chunk)
+        else:
+            for offset in (0, (size - sample_bytes) // 2, size - sample_bytes):
+                f.seek(offset)
+                digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+class ThumbnailGenerator:
+    """
+    Makes the thumbnails sent along with uploads in a bounded pool of worker processes, so decoding a
+    large image or running ffmpeg never holds up an event loop or the GIL. Results are cached on disk
+    by source content and size, and concurrent requests for the same source share one render.
+    """
+
+    def __init__(self, cache_dir, workers=2, width=320, height=320, disk_bytes=64 * 1024 * 1024, timeout=120):
+        self.workers = max(workers, 1)
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+        self.disk = CacheManager(cache_dir, max_bytes=disk_bytes)
+        self.disk.scan()
+        self._pool = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker processes. They are forked, so this is best called early, before the
+        application starts its threads; otherwise the first thumbnail starts them.
+        """
+        with self._lock:
+            pool = self._executor()
+        pool.submit(int).result()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+        return self._pool
+
+    def generate(self, src, mime_type):
+        """Returns the path of a JPEG thumbnail of an image or video file, or None if it has none or rendering failed."""
+        if mime_type.startswith('image/'):
+            render = render_image_thumbnail
+        elif mime_type.startswith('video/'):
+            render = render_video_thumbnail
+        else:
+            return None
+        try:
+            key = f'{content_key(src)}.{self.width}x{self.height}.jpg'
+        except OSError as e:
+            logger.error(f"Could not read {src} for its thumbnail: {e}")
+            return None
+
+        with self._lock:
+            path = self.disk.lookup(key)
+            if path:
+                return path
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = concurrent.futures.Future()
+        if not owner:
+            # The same content is being rendered already, for another upload
+            return future.result()
+
+        path = None
+        try:
+            path = self._render(render, src, key)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            future.set_result(path)
+        return path
+
+    def _render(self, render, src, key):
+        if not self.disk.begin_write(key):
+            return None
+        path = self.disk.path(key)
+        try:
+            with self._lock:
+                pool = self._executor()
+            pool.submit(render, src, path + '.tmp', self.width, self.height).result(timeout=self.timeout)
+            os.replace(path + '.tmp', path)
+            self.disk.record_write(key, os.path.getsize(path))
+            self.disk.finish_write(key)
+            return path
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. a decoder crashed); the next render gets a fresh pool
+                with self._lock:
+                    self._pool = None
+            logger.error(f"Could not generate a thumbnail for {src}: {e!r}")
+            self.disk.end_write(key)
+            self.disk.remove(key)
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            return None
+
+class ThumbnailService:
+    """
+    Serves thumbnails, and resized WebP/JPEG variants of them, from three tiers: a memory LRU of hot
+    images, a size-limited disk cache of generated variants, and finally the original fetched through
+    fetch_original(file_id). Requested widths are rounded up to one of `widths` so the number of
+    variants per thumbnail stays bounded.
+    """
+
+    def __init__(self, cache_dir, fetch_original, widths=(64, 128, 256, 512, 1024), memory_bytes=32 * 1024 * 1024,
+                 disk_bytes=256 * 1024 * 1024, quality=80):
+        self.fetch_original = fetch_original
+        self.widths = sorted(widths)
+        self.quality = quality
+        self.memory_bytes = memory_bytes
+        self.disk = CacheManager(cache_dir, max_bytes=disk_bytes)
+        self.disk.scan()
+        self._memory = OrderedDict()
+        self._memory_total = 0
+        self._lock = threading.Lock()
+
+    def pick_width(self, requested):
+        """The smallest variant width at least as wide as `requested`, or the widest one."""
+        for width in self.widths:
+            if width >= requested:
+                return width
+        return self.widths[-1]
+
+    @staticmethod
+    def key(file_id, width=None, fmt=None):
+        """Identifies one rendition of a thumbnail; it is also the variant's file name in the disk cache."""
+        return file_id if width is None else f'{file_id}.{width}.{fmt}'
+
+    def get(self, file_id, width=None, fmt='jpeg'):
+        """Returns (data, mimetype) of the original thumbnail, or with `width` set, of a resized variant."""
+        key = self.key(file_id, width, fmt)
+        mimetype = ORIGINAL_MIMETYPE if width is None else FORMATS[fmt]
+        data = self._memory_get(key)
+        if data is not None:
+            return data, mimetype
+
+        if width is None:
+            # The original already lives in the file cache, fetch_original reads it from there
+            data = self.fetch_original(file_id)
+        else:
+            data = self._disk_get(key)
+            if data is None:
+                data = render_variant(self.fetch_original(file_id), width, fmt, self.quality)
+                self._disk_put(key, data)
+        self._memory_put(key, data)
+        return data, mimetype
+
+    def forget(self, file_id):
+        """Drops every cached rendition of a thumbnail."""
+        keys = [self.key(file_id)] + [self.key(file_id, width, fmt) for width in self.widths for fmt in FORMATS]
+        with self._lock:
+            for key in keys:
+                data = self._memory.pop(key, None)
+                if data is not None:
+                    self._memory_total -= len(data)
+        for key in keys[1:]:
+            self.disk.remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_total = 0
+        self.disk.scan()
+        return self.disk.clear()
+
+    def _memory_get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def _memory_put(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_total -= len(previous)
+            self._memory[key] = data
+            self._memory_total += len(data)
+            while self._memory_total > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_total -= len(evicted)
+
+    def _disk_get(self, key):
+        with self.disk.pin(key):
+            path = self.disk.lookup(key)
+            if not path:
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+    def _disk_put(self, key, data):
+        # Another request rendering the same variant is already writing it
+        if not self.disk.begin_write(key):
+            return
+        path = self.disk.path(key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self.disk.record_write(key, len(data))
+            self.disk.finish_write(key)
+        except OSError as e:
+            logger.error(f"Could not store thumbnail variant {key}: {e}")
+            self.disk.end_write(key)
+            self.disk.remove(key)
@@ -0,0 +1,392 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pyrogram import StopTransmission
+import database
+from config import UPLOAD_WORKERS, UPLOAD_STAGING_DIR, UPLOAD_STREAM_BUFFER_MB, TELEGRAM_CHAT_ID
+from user_handler import (bot_client_pool, send_file_with_pyrogram, send_stream_with_pyrogram, thumbnail_generator,
+                          UPLOAD_PART_SIZE)
+
+logger = logging.getLogger(__name__)
+
+class TransferProgress:
+    """Bytes sent so far by a running upload, with its rate over the last few seconds for speed and ETA."""
+
+    def __init__(self, total, window_seconds=5.0):
+        self.total = total or 0
+        self.current = 0
+        self.stopped = False
+        self.window_seconds = window_seconds
+        self._samples = deque([(time.monotonic(), 0)])
+
+    async def update(self, current, total):
+        """Pyrogram's progress callback; it runs on the client pool's loop after every uploaded part."""
+        if self.stopped:
+            raise StopTransmission()
+        now = time.monotonic()
+        self.current = current
+        self.total = total or self.total
+        self._samples.append((now, current))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window_seconds:
+            self._samples.popleft()
+
+    @property
+    def bytes_per_second(self):
+        (start, sent_at_start), (end, sent) = self._samples[0], self._samples[-1]
+        return (sent - sent_at_start) / (end - start) if end > start else 0.0
+
+    @property
+    def eta_seconds(self):
+        rate = self.bytes_per_second
+        return round((self.total - self.current) / rate) if rate and self.total else None
+
+class UploadStream:
+    """
+    Bounded buffer between a request thread writing an upload body as it arrives and the upload coroutine
+    on the client pool's loop reading it in parts. A full buffer blocks the writer, so the browser can
+    never get more than max_bytes ahead of Telegram, and reads wait in a thread instead of on the loop.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max(max_bytes, UPLOAD_PART_SIZE)
+        self._chunks = deque()
+        self._buffered = 0
+        self._finished = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        """Blocks while the buffer is full. Returns False once the transfer was closed."""
+        with self._cond:
+            while self._buffered >= self.max_bytes and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self._cond.notify_all()
+            return True
+
+    def finish(self):
+        """Marks the end of the data; reads drain what is left and then return b''."""
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def close(self):
+        """Ends the transfer from either side: writes return False and reads return b'' from now on."""
+        with self._cond:
+            self._closed = True
+            self._chunks.clear()
+            self._buffered = 0
+            self._cond.notify_all()
+
+    def _read(self, n):
+        with self._cond:
+            while self._buffered < n and not self._finished and not self._closed:
+                self._cond.wait()
+            out = bytearray()
+            while self._chunks and len(out) < n:
+                chunk = self._chunks.popleft()
+                wanted = n - len(out)
+                if len(chunk) > wanted:
+                    self._chunks.appendleft(chunk[wanted:])
+                    chunk = chunk[:wanted]
+                out += chunk
+            self._buffered -= len(out)
+            self._cond.notify_all()
+            return bytes(out)
+
+    async def read(self, n):
+        return await asyncio.to_thread(self._read, n)
+
+class UploadEngine:
+    """
+    Uploads the files of the upload_tasks table to Telegram on a fixed pool of worker threads. Each
+    worker claims the queued task with the highest priority, uploads it on a client of the shared
+    bot client pool and adds the file to the database when done. Progress is written back every
+    second, which is also when a worker notices its task was paused, cancelled or deleted and stops
+    the transfer. The queue lives in the database, so tasks survive restarts.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, staging_dir=UPLOAD_STAGING_DIR, stream_buffer_bytes=UPLOAD_STREAM_BUFFER_MB * 1024 * 1024,
+                 poll_seconds=5.0, flush_seconds=1.0):
+        self.app = None
+        self.workers = workers
+        self.staging_dir = staging_dir
+        self.stream_buffer_bytes = stream_buffer_bytes
+        self.poll_seconds = poll_seconds
+        self.flush_seconds = flush_seconds
+        self._active = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        """Queues again the tasks that were uploading at the last shutdown and starts the workers."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        with self.app.app_context():
+            requeued = database.requeue_interrupted_upload_tasks()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted upload task(s).")
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f'upload-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Upload engine started with {self.workers} worker(s).")
+
+    def wake(self):
+        """Lets idle workers look for queued tasks now rather than at their next poll."""
+        self._wake.set()
+
+    def submit(self, stream, filename, folder, mime_type=None, priority=0, user_id=None):
+        """
+        Stages an uploaded file stream on disk, hashing it on the way, and queues it. Content that is
+        already stored completes at once as a new entry for the existing file. Returns the new task.
+        """
+        os.makedirs(self.staging_dir, exist_ok=True)
+        file_path = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        with open(file_path, 'wb') as f:
+            while True:
+                chunk = stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        task = database.add_upload_task(file_path, filename, folder, size=os.path.getsize(file_path), mime_type=mime_type,
+                                        priority=priority, user_id=user_id, content_hash=digest.hexdigest())
+        existing = database.find_file_by_content(content_hash=task.content_hash)
+        if existing is not None and database.claim_upload_task(task.id):
+            self._add_duplicate(task, existing)
+        else:
+            self.wake()
+        return task
+
+    def stream(self, stream, size, filename, folder, mime_type=None, user_id=None):
+        """
+        Uploads a request body of `size` bytes to Telegram while it is still arriving, without staging it
+        on disk. The upload starts right away on the calling (request) thread, outside the workers and
+        their priorities; it is listed with the other tasks and can be cancelled, but not paused, since
+        there is no staged copy to resume from. Returns the finished task.
+        """
+        task = database.add_upload_task(None, filename, folder, size=size, mime_type=mime_type, user_id=user_id, status='uploading')
+        progress = TransferProgress(size)
+        self._active[task.id] = progress
+        buffer = UploadStream(self.stream_buffer_bytes)
+        digest = hashlib.sha256()
+        received = 0
+        try:
+            logger.info(f"Streaming upload task {task.id}: {filename} ({size} bytes) to {folder}")
+            future = bot_client_pool.submit(send_stream_with_pyrogram(buffer, filename, mime_type, size, progress=progress.update))
+            # An upload that ends early must not leave the request thread blocked on a full buffer
+            future.add_done_callback(lambda _: buffer.close())
+            flushed_at = time.monotonic()
+            while received < size:
+                chunk = stream.read(min(UPLOAD_PART_SIZE, size - received))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                received += len(chunk)
+                if not buffer.write(chunk):
+                    break
+                if time.monotonic() - flushed_at >= self.flush_seconds:
+                    flushed_at = time.monotonic()
+                    if not database.record_upload_progress(task.id, progress.current):
+                        progress.stopped = True
+            if received == size:
+                buffer.finish()
+                task.content_hash = digest.hexdigest()
+                database.db.session.commit()
+            else:
+                buffer.close()
+            self._finish(task, progress, self._wait(future, task.id, progress))
+        except Exception as e:
+            buffer.close()
+            database.db.session.rollback()
+            database.finish_upload_task(task.id, 'failed', error=str(e))
+            logger.error(f"Streaming upload task {task.id} failed: {e}")
+        finally:
+            self._active.pop(task.id, None)
+        return database.get_upload_task(task.id)
+
+    def set_status(self, task_ids, status):
+        """Pauses, resumes or cancels tasks; running uploads stop within flush_seconds. Returns the tasks that changed."""
+        tasks = database.bulk_update_upload_task_status(task_ids, status)
+        if status == 'queued':
+            self.wake()
+        elif status == 'cancelled':
+            for task in tasks:
+                if task.id not in self._active:
+                    self._remove_staged(task.file_path)
+        return tasks
+
+    def delete(self, task_ids):
+        """Deletes tasks and their staged files; running uploads stop within flush_seconds."""
+        for file_path in database.bulk_delete_upload_tasks(task_ids):
+            self._remove_staged(file_path)
+
+    def set_priority(self, task_id, priority):
+        task = database.update_upload_task_priority(task_id, priority)
+        self.wake()
+        return task
+
+    def describe(self, task):
+        """The task's to_dict(), with the live transfer rate and ETA while it is uploading."""
+        data = task.to_dict()
+        progress = self._active.get(task.id)
+        data['bytes_per_second'] = None
+        data['eta_seconds'] = None
+        if progress is not None and task.status == 'uploading':
+            data['bytes_uploaded'] = progress.current
+            if progress.total:
+                data['progress'] = round(progress.current / progress.total * 100, 1)
+            data['bytes_per_second'] = round(progress.bytes_per_second)
+            data['eta_seconds'] = progress.eta_seconds
+        return data
+
+    def metrics(self):
+        return {'workers': self.workers, 'active': len(self._active),
+                'bytes_per_second': round(sum(progress.bytes_per_second for progress in list(self._active.values())))}
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    task = database.claim_next_upload_task()
+                    if task is not None:
+                        self._upload(task)
+                except Exception as e:
+                    logger.error(f"Upload worker error: {e}")
+                    task = None
+                finally:
+                    database.db.session.remove()
+            if task is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _upload(self, task):
+        task_id = task.id
+        progress = TransferProgress(task.size)
+        self._active[task_id] = progress
+        try:
+            if not os.path.exists(task.file_path):
+                database.finish_upload_task(task_id, 'failed', error='The staged file is missing.')
+                return
+            if not task.content_hash:
+                # Queued before uploads were hashed
+                task.content_hash = file_sha256(task.file_path)
+                database.db.session.commit()
+            existing = database.find_file_by_content(content_hash=task.content_hash)
+            if existing is not None:
+                self._add_duplicate(task, existing)
+                return
+            mime_type = task.mime_type or 'application/octet-stream'
+            # Rendered in the thumbnail process pool and cached by content, so it is not removed afterwards
+            thumbnail_path = thumbnail_generator.generate(task.file_path, mime_type)
+            logger.info(f"Uploading task {task_id}: {task.filename} ({task.size} bytes) to {task.folder}")
+            future = bot_client_pool.submit(send_file_with_pyrogram(
+                task.file_path, task.filename, mime_type, task.size, thumbnail_path, progress=progress.update))
+            self._finish(task, progress, self._wait(future, task_id, progress))
+        except Exception as e:
+            database.db.session.rollback()
+            database.finish_upload_task(task_id, 'failed', error=str(e))
+            logger.error(f"Upload task {task_id} failed: {e}")
+        finally:
+            self._active.pop(task_id, None)
+
+    def _wait(self, future, task_id, progress):
+        """Waits for an upload, writing its progress back every flush_seconds and stopping it once the task is no longer uploading."""
+        while True:
+            try:
+                return future.result(timeout=self.flush_seconds)
+            except concurrent.futures.TimeoutError:
+                if not database.record_upload_progress(task_id, progress.current):
+                    progress.stopped = True
+
+    def _finish(self, task, progress, result):
+        file_id, name_or_error, uploaded_mime_type, size, thumbnail_file_id, message_id, file_unique_id = result
+        if file_id:
+            outcome = database.add_files_bulk([{
+                'filename': name_or_error, 'file_id': file_id, 'folder': task.folder, 'size': size,
+                'mime_type': uploaded_mime_type, 'thumbnail_file_id': thumbnail_file_id,
+                'message_link': self._message_link(message_id), 'content_hash': task.content_hash,
+                'file_unique_id': file_unique_id
+            }])[0]
+            if not outcome['added']:
+                self._fail_catalog(task, outcome)
+                return
+            database.finish_upload_task(task.id, 'completed', telegram_file_id=file_id, bytes_uploaded=size)
+            self._remove_staged(task.file_path)
+            logger.info(f"Upload task {task.id} completed: {task.filename}")
+        elif progress.stopped or not database.record_upload_progress(task.id, progress.current):
+            # Paused, cancelled or deleted while uploading; only a paused task keeps its staged file
+            current = database.get_upload_task(task.id)
+            if current is None or current.status == 'cancelled':
+                self._remove_staged(task.file_path)
+            logger.info(f"Upload task {task.id} stopped: {current.status if current else 'deleted'}")
+        else:
+            database.finish_upload_task(task.id, 'failed', error=name_or_error)
+            logger.error(f"Upload task {task.id} failed: {name_or_error}")
+
+    def _add_duplicate(self, task, existing):
+        """Completes an uploading task whose content is already stored: a new entry for the existing file, nothing sent."""
+        outcome = database.add_files_bulk([{
+            'filename': task.filename, 'file_id': existing.file_id, 'folder': task.folder, 'size': existing.size,
+            'mime_type': existing.mime_type or task.mime_type, 'thumbnail_file_id': existing.thumbnail_file_id,
+            'message_link': existing.message_link, 'content_hash': task.content_hash,
+            'file_unique_id': existing.file_unique_id
+        }])[0]
+        if not outcome['added']:
+            self._fail_catalog(task, outcome)
+            return
+        database.finish_upload_task(task.id, 'completed', telegram_file_id=existing.file_id,
+                                    bytes_uploaded=task.size, deduplicated=True)
+        self._remove_staged(task.file_path)
+        logger.info(f"Upload task {task.id} completed without uploading: {task.filename} has the content of {existing.filename}")
+
+    @staticmethod
+    def _fail_catalog(task, outcome):
+        """Fails a task whose file could not be added to the catalog, keeping the staged file so it can be retried."""
+        database.finish_upload_task(task.id, 'failed', error=outcome['error'])
+        logger.error(f"Upload task {task.id} could not be added to the catalog: {outcome['error']}")
+
+    @staticmethod
+    def _message_link(message_id):
+        chat_id_str = str(TELEGRAM_CHAT_ID or '')
+        if not message_id or not chat_id_str:
+            return None
+        if chat_id_str.startswith('-100'):
+            chat_id_str = chat_id_str[4:]
+        return f"https://t.me/c/{chat_id_str}/{message_id}"
+
+    @staticmethod
+    def _remove_staged(file_path):
+        if not file_path:
+            return
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove staged upload {file_path}: {e}")
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+upload_engine = UploadEngine()
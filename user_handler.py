@@ -1,20 +1,27 @@
-from pyrogram import Client, filters # 從 pyrogram 導入 Client 和 filters
+from pyrogram import Client, filters, raw, types, StopTransmission # 從 pyrogram 導入 Client、filters、原始 API 和類型
 from pyrogram.errors import SessionPasswordNeeded, PhoneCodeInvalid, PhoneNumberInvalid, PeerIdInvalid # 從 pyrogram.errors 導入錯誤類型
-from config import API_ID, API_HASH, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT # 從 config 導入配置參數
+from pyrogram.session import Session # 導入 Session，用於上傳文件分塊的媒體會話
+from config import (API_ID, API_HASH, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT,
+                    BOT_CLIENT_POOL_SIZE, BOT_CLIENT_HEALTH_CHECK_SECONDS, THUMBNAIL_WORKERS,
+                    UPLOAD_THUMBNAIL_CACHE_DIR, UPLOAD_THUMBNAIL_CACHE_MB, UPLOAD_STREAM_PARALLEL_PARTS) # 從 config 導入配置參數
 import os # 導入 os 模組，用於操作文件系統
 import asyncio # 導入 asyncio 模組，用於異步操作
+import functools # 導入 functools 模組，用於包裝函數
+import hashlib # 導入 hashlib 模組，用於計算小文件的 MD5
+import math # 導入 math 模組，用於計算分塊數
+import time # 導入 time 模組，用於記錄客戶端閒置時間
+from contextlib import asynccontextmanager # 導入異步上下文管理器裝飾器
 import logging # 導入 logging 模組，用於日誌記錄
 import queue # 導入 queue 模組，用於隊列操作
 import threading # 導入 threading 模組，用於多線程
-from PIL import Image # 導入 Pillow 庫的 Image 模組
-import subprocess # 導入 subprocess 模組，用於運行外部命令（如 ffmpeg）
+from thumbnails import ThumbnailGenerator # 導入在進程池中生成縮略圖的類
 
 logging.basicConfig(level=logging.INFO) # 配置日誌級別為 INFO
 
 # Bot 賬戶的會話名稱
 BOT_SESSION_NAME = "bot_account_session"
 
-async def get_bot_client(): # 獲取 Bot 客戶端的異步函數
+async def get_bot_client(session_name=BOT_SESSION_NAME): # 獲取 Bot 客戶端的異步函數
     """
     初始化並返回一個用於 Bot 賬戶的 Pyrogram 客戶端。
     """
@@ -23,7 +30,7 @@ async def get_bot_client(): # 獲取 Bot 客戶端的異步函數
         raise ValueError("API_ID, API_HASH, and TELEGRAM_BOT_TOKEN must be configured for bot client.") # 拋出值錯誤
 
     app = Client( # 創建 Pyrogram 客戶端實例
-        BOT_SESSION_NAME, # 會話名稱
+        session_name, # 會話名稱
         api_id=API_ID, # API ID
         api_hash=API_HASH, # API Hash
         bot_token=TELEGRAM_BOT_TOKEN # Bot Token
@@ -37,98 +44,309 @@ async def get_bot_client(): # 獲取 Bot 客戶端的異步函數
         logging.error(f"Error starting Pyrogram bot client: {e}") # 記錄啟動錯誤
         raise # 重新拋出異常
 
-async def send_file_with_pyrogram(file_path, file_name, mime_type, file_size, thumbnail_path=None): # 使用 Pyrogram 發送文件的異步函數
+class BotClientPool: # Bot 客戶端池類
+    """
+    Long-lived Pyrogram bot clients shared by every operation in this module, so uploads and deletes
+    no longer pay for a connection handshake each. The clients live on one dedicated event loop thread,
+    like PyrogramRunner's; they are started lazily on first use, each with its own session file, and
+    one that has been idle for a while is checked with get_me() and reconnected before it is lent out.
+    """
+
+    def __init__(self, size=BOT_CLIENT_POOL_SIZE, health_check_seconds=BOT_CLIENT_HEALTH_CHECK_SECONDS):
+        self.size = max(size, 1) # 客戶端數量上限
+        self.health_check_seconds = health_check_seconds # 閒置多久後需要檢查連接
+        self.loop = None # 客戶端所在的事件循環
+        self.thread = None # 運行事件循環的線程
+        self._lock = threading.Lock() # 保護事件循環的啟動
+        self._idle = None # 空閒客戶端隊列，在事件循環中創建
+        self._created = 0 # 已創建的客戶端數量
+
+    def _start_loop(self):
+        asyncio.set_event_loop(self.loop) # 設置當前線程的事件循環
+        self.loop.run_forever() # 永久運行事件循環
+
+    def start(self):
+        """Starts the pool's event loop thread if it is not running yet. Clients connect on first use."""
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.loop = asyncio.new_event_loop() # 創建新的事件循環
+                self._idle = None
+                self._created = 0
+                self.thread = threading.Thread(target=self._start_loop, name='bot-client-pool', daemon=True) # 創建守護線程
+                self.thread.start() # 啟動線程
+
+    def submit(self, coro):
+        """Schedules a coroutine on the pool's loop from any thread; returns a concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Runs a coroutine on the pool's loop and blocks until it returns."""
+        return self.submit(coro).result()
+
+    async def call(self, coro):
+        """Awaits a coroutine on the pool's loop, whichever loop the caller runs on."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.loop: # 已在客戶端池的事件循環中
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def _session_name(self, index):
+        # 第一個客戶端沿用原有的會話文件，其餘各用一個，避免爭用同一個 SQLite 文件
+        return BOT_SESSION_NAME if index == 0 else f"{BOT_SESSION_NAME}_{index}"
+
+    async def _acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue() # 在客戶端池的事件循環中創建隊列
+        if self._idle.empty() and self._created < self.size: # 沒有空閒客戶端且未達上限時創建新的
+            index = self._created
+            self._created += 1
+            try:
+                return index, await get_bot_client(self._session_name(index)), time.monotonic()
+            except Exception:
+                self._created -= 1
+                raise
+        index, app, last_used = await self._idle.get() # 等待空閒客戶端
+        if not app.is_connected or time.monotonic() - last_used > self.health_check_seconds:
+            app = await self._check(index, app) # 檢查連接，必要時重連
+        return index, app, last_used
+
+    async def _check(self, index, app):
+        """Returns app if it still answers, otherwise a freshly started replacement."""
+        if app.is_connected:
+            try:
+                await asyncio.wait_for(app.get_me(), timeout=10) # 健康檢查
+                return app
+            except Exception as e:
+                logging.warning(f"Pooled Pyrogram client {index} failed its health check: {e}. Reconnecting.") # 記錄健康檢查失敗
+        try:
+            if app.is_connected:
+                await app.stop() # 停止失效的客戶端
+        except Exception as e:
+            logging.warning(f"Error stopping pooled Pyrogram client {index}: {e}") # 記錄停止錯誤
+        try:
+            return await get_bot_client(self._session_name(index)) # 重新連接
+        except Exception:
+            self._created -= 1 # 重連失敗，讓下一次借用重新創建
+            raise
+
+    @asynccontextmanager
+    async def client(self):
+        """Lends a started client for the duration of the block. Must be used on the pool's loop (see on_pool_loop)."""
+        index, app, _ = await self._acquire()
+        healthy = True
+        try:
+            yield app
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            healthy = False # 連接錯誤，歸還後下次借用前先檢查
+            raise
+        finally:
+            self._idle.put_nowait((index, app, time.monotonic() if healthy else 0.0)) # 歸還客戶端
+
+    async def _stop_all(self):
+        while self._idle is not None and not self._idle.empty():
+            index, app, _ = self._idle.get_nowait()
+            if app.is_connected:
+                await app.stop() # 停止客戶端
+        self._created = 0
+
+    def stop(self):
+        """Stops the idle clients; clients currently lent out are left alone."""
+        if self.thread is not None and self.thread.is_alive():
+            self.run(self._stop_all())
+            logging.info("Pyrogram bot client pool stopped.") # 記錄客戶端池已停止
+
+# 全局客戶端池
+bot_client_pool = BotClientPool()
+
+# 上傳時附帶的縮略圖在進程池中生成，按文件內容緩存
+thumbnail_generator = ThumbnailGenerator(UPLOAD_THUMBNAIL_CACHE_DIR, workers=THUMBNAIL_WORKERS, width=THUMBNAIL_WIDTH,
+                                         height=THUMBNAIL_HEIGHT, disk_bytes=UPLOAD_THUMBNAIL_CACHE_MB * 1024 * 1024)
+
+def on_pool_loop(func): # 讓異步函數在客戶端池的事件循環中執行的裝飾器
+    """Makes a coroutine function run on the client pool's loop, so callers on any event loop can await it."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await bot_client_pool.call(func(*args, **kwargs))
+    return wrapper
+
+@on_pool_loop
+async def send_file_with_pyrogram(file_path, file_name, mime_type, file_size, thumbnail_path=None, progress=None): # 使用 Pyrogram 發送文件的異步函數
     """
     使用 Pyrogram 通過 Bot 賬戶將文件上傳到 Telegram。
     接受 file_path 和可選的 thumbnail_path。
+    progress(current, total) 在每個分塊上傳後調用，拋出 StopTransmission 可中止上傳。
     """
     if not API_ID or not API_HASH or not TELEGRAM_BOT_TOKEN: # 檢查配置參數是否設置
-        return None, "API_ID, API_HASH, and TELEGRAM_BOT_TOKEN are not configured for Pyrogram bot upload.", None, None, None, None # 返回錯誤信息
+        return None, "API_ID, API_HASH, and TELEGRAM_BOT_TOKEN are not configured for Pyrogram bot upload.", None, None, None, None, None # 返回錯誤信息
 
     thumbnail_file_id = None # 縮略圖文件 ID
 
-    app = None # 初始化應用
     try:
-        app = await get_bot_client() # 獲取 Bot 客戶端
-        
-        target_chat_id = TELEGRAM_CHAT_ID # 目標聊天 ID
-        try:
-            # 嘗試將 chat_id 轉換為整數（如果它是數字字符串）
-            if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
-                target_chat_id = int(target_chat_id) # 轉換為整數
-            logging.info(f"Attempting to get chat info for chat ID: {target_chat_id} (Type: {type(target_chat_id)})") # 記錄獲取聊天信息
-            chat_info = await app.get_chat(target_chat_id) # 獲取聊天信息
-            logging.info(f"Successfully retrieved chat info for {target_chat_id}: {chat_info.title}") # 記錄成功獲取聊天信息
-        except PeerIdInvalid as e: # 捕獲 PeerIdInvalid 錯誤
-            logging.error(f"PEER_ID_INVALID error for chat {target_chat_id}: {e}. This usually means the bot is not in the chat/channel or does not have permissions. Please add the bot to the chat/channel and ensure it has necessary permissions (e.g., Post Messages for channels).") # 記錄錯誤信息
-            return None, f"Telegram says: [400 PEER_ID_INVALID] - The peer id being used is invalid or not known yet. Make sure you meet the peer before interacting with it ", None, None, None, None # 返回錯誤信息
-        except Exception as e: # 捕獲其他異常
-            logging.error(f"Failed to get chat info for {target_chat_id}: {e}") # 記錄錯誤信息
-            return None, f"Failed to get chat info for {target_chat_id}: {e}", None, None, None, None # 返回錯誤信息
-
-        # 如果提供了縮略圖且存在，則上傳縮略圖
-        if thumbnail_path and os.path.exists(thumbnail_path): # 如果縮略圖路徑存在且文件存在
+        async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
+
+            target_chat_id = TELEGRAM_CHAT_ID # 目標聊天 ID
             try:
-                thumb_message = await app.send_photo(chat_id=target_chat_id, photo=thumbnail_path) # 發送縮略圖
-                if thumb_message and thumb_message.photo: # 如果消息存在且包含照片
-                    thumbnail_file_id = thumb_message.photo.file_id # 獲取縮略圖文件 ID
-                    logging.info(f"Thumbnail uploaded, file_id: {thumbnail_file_id}") # 記錄縮略圖上傳成功
-            except Exception as e: # 捕獲上傳錯誤
-                logging.error(f"Error uploading thumbnail: {e}") # 記錄錯誤信息
-                thumbnail_file_id = None # 縮略圖文件 ID 設置為 None
-
-        # 根據 MIME 類型確定適當的 Pyrogram 方法
-        message = None # 初始化消息
-
-        if mime_type.startswith("image/"): # 如果是圖片類型
-            # 對於大於 1MB 的圖片，作為文檔發送
-            if file_size and file_size > 1 * 1024 * 1024: # 1MB
-                logging.info(f"Image {file_name} is larger than 1MB, sending as document.") # 記錄圖片太大，作為文檔發送
-                message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path) # 發送文檔
-            else:
+                # 嘗試將 chat_id 轉換為整數（如果它是數字字符串）
+                if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
+                    target_chat_id = int(target_chat_id) # 轉換為整數
+                logging.info(f"Attempting to get chat info for chat ID: {target_chat_id} (Type: {type(target_chat_id)})") # 記錄獲取聊天信息
+                chat_info = await app.get_chat(target_chat_id) # 獲取聊天信息
+                logging.info(f"Successfully retrieved chat info for {target_chat_id}: {chat_info.title}") # 記錄成功獲取聊天信息
+            except PeerIdInvalid as e: # 捕獲 PeerIdInvalid 錯誤
+                logging.error(f"PEER_ID_INVALID error for chat {target_chat_id}: {e}. This usually means the bot is not in the chat/channel or does not have permissions. Please add the bot to the chat/channel and ensure it has necessary permissions (e.g., Post Messages for channels).") # 記錄錯誤信息
+                return None, f"Telegram says: [400 PEER_ID_INVALID] - The peer id being used is invalid or not known yet. Make sure you meet the peer before interacting with it ", None, None, None, None, None # 返回錯誤信息
+            except Exception as e: # 捕獲其他異常
+                logging.error(f"Failed to get chat info for {target_chat_id}: {e}") # 記錄錯誤信息
+                return None, f"Failed to get chat info for {target_chat_id}: {e}", None, None, None, None, None # 返回錯誤信息
+
+            # 如果提供了縮略圖且存在，則上傳縮略圖
+            if thumbnail_path and os.path.exists(thumbnail_path): # 如果縮略圖路徑存在且文件存在
                 try:
-                    message = await app.send_photo(chat_id=target_chat_id, photo=file_path) # 發送照片
-                except (PeerIdInvalid, Exception) as e: # 捕獲特定的 Telegram 錯誤
-                    logging.warning(f"Failed to send photo {file_name} directly: {e}. Attempting to send as document instead.") # 警告發送失敗，嘗試作為文檔發送
-                    message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path) # 發送文檔
-        elif mime_type.startswith("video/"): # 如果是視頻類型
-            message = await app.send_video(chat_id=target_chat_id, video=file_path, file_name=file_name, thumb=thumbnail_path) # 發送視頻
-        else:
-            message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path) # 發送文檔
-        
-        # 從發送的消息中提取文件 ID、文件名、MIME 類型和大小
-        if message: # 如果消息存在
-            message_id = message.id # 消息 ID
-            if message.photo: # 如果是照片
-                file_id = message.photo.file_id # 文件 ID
-                uploaded_file_name = file_name # 使用原始文件名
-                size = message.photo.file_size # 文件大小
-                uploaded_mime_type = "image/jpeg" # Telegram 將照片轉換為 JPEG
-            elif message.video: # 如果是視頻
-                file_id = message.video.file_id # 文件 ID
-                uploaded_file_name = message.video.file_name or file_name # 文件名
-                size = message.video.file_size # 文件大小
-                uploaded_mime_type = message.video.mime_type # MIME 類型
-            elif message.document: # 如果是文檔
-                file_id = message.document.file_id # 文件 ID
-                uploaded_file_name = message.document.file_name or file_name # 文件名
-                size = message.document.file_size # 文件大小
-                uploaded_mime_type = message.document.mime_type # MIME 類型
+                    thumb_message = await app.send_photo(chat_id=target_chat_id, photo=thumbnail_path) # 發送縮略圖
+                    if thumb_message and thumb_message.photo: # 如果消息存在且包含照片
+                        thumbnail_file_id = thumb_message.photo.file_id # 獲取縮略圖文件 ID
+                        logging.info(f"Thumbnail uploaded, file_id: {thumbnail_file_id}") # 記錄縮略圖上傳成功
+                except Exception as e: # 捕獲上傳錯誤
+                    logging.error(f"Error uploading thumbnail: {e}") # 記錄錯誤信息
+                    thumbnail_file_id = None # 縮略圖文件 ID 設置為 None
+
+            # 根據 MIME 類型確定適當的 Pyrogram 方法
+            message = None # 初始化消息
+
+            if mime_type.startswith("image/"): # 如果是圖片類型
+                # 對於大於 1MB 的圖片，作為文檔發送
+                if file_size and file_size > 1 * 1024 * 1024: # 1MB
+                    logging.info(f"Image {file_name} is larger than 1MB, sending as document.") # 記錄圖片太大，作為文檔發送
+                    message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path, progress=progress) # 發送文檔
+                else:
+                    try:
+                        message = await app.send_photo(chat_id=target_chat_id, photo=file_path, progress=progress) # 發送照片
+                    except (PeerIdInvalid, Exception) as e: # 捕獲特定的 Telegram 錯誤
+                        logging.warning(f"Failed to send photo {file_name} directly: {e}. Attempting to send as document instead.") # 警告發送失敗，嘗試作為文檔發送
+                        message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path, progress=progress) # 發送文檔
+            elif mime_type.startswith("video/"): # 如果是視頻類型
+                message = await app.send_video(chat_id=target_chat_id, video=file_path, file_name=file_name, thumb=thumbnail_path, progress=progress) # 發送視頻
             else:
-                return None, "Failed to get file details from the sent message.", None, None, None, None # 返回錯誤信息
-            
-            return file_id, uploaded_file_name, uploaded_mime_type, size, thumbnail_file_id, message_id # 返回文件信息
-        else:
-            return None, "Failed to send file to Telegram.", None, None, None, None # 返回錯誤信息
+                message = await app.send_document(chat_id=target_chat_id, document=file_path, file_name=file_name, thumb=thumbnail_path, progress=progress) # 發送文檔
+
+            # 從發送的消息中提取文件 ID、文件名、MIME 類型和大小
+            if message: # 如果消息存在
+                message_id = message.id # 消息 ID
+                if message.photo: # 如果是照片
+                    file_id = message.photo.file_id # 文件 ID
+                    file_unique_id = message.photo.file_unique_id # 文件唯一 ID，同一文件的所有 file_id 共用
+                    uploaded_file_name = file_name # 使用原始文件名
+                    size = message.photo.file_size # 文件大小
+                    uploaded_mime_type = "image/jpeg" # Telegram 將照片轉換為 JPEG
+                elif message.video: # 如果是視頻
+                    file_id = message.video.file_id # 文件 ID
+                    file_unique_id = message.video.file_unique_id # 文件唯一 ID，同一文件的所有 file_id 共用
+                    uploaded_file_name = message.video.file_name or file_name # 文件名
+                    size = message.video.file_size # 文件大小
+                    uploaded_mime_type = message.video.mime_type # MIME 類型
+                elif message.document: # 如果是文檔
+                    file_id = message.document.file_id # 文件 ID
+                    file_unique_id = message.document.file_unique_id # 文件唯一 ID，同一文件的所有 file_id 共用
+                    uploaded_file_name = message.document.file_name or file_name # 文件名
+                    size = message.document.file_size # 文件大小
+                    uploaded_mime_type = message.document.mime_type # MIME 類型
+                else:
+                    return None, "Failed to get file details from the sent message.", None, None, None, None, None # 返回錯誤信息
+
+                return file_id, uploaded_file_name, uploaded_mime_type, size, thumbnail_file_id, message_id, file_unique_id # 返回文件信息
+            else:
+                return None, "Failed to send file to Telegram.", None, None, None, None, None # 返回錯誤信息
 
     except Exception as e: # 捕獲異常
         logging.error(f"Error during Pyrogram upload: {e}") # 記錄 Pyrogram 上傳錯誤
-        return None, str(e), None, None, None, None # 返回錯誤信息
+        return None, str(e), None, None, None, None, None # 返回錯誤信息
+
+# Telegram 上傳分塊大小，除最後一塊外每塊都必須正好是這個大小
+UPLOAD_PART_SIZE = 512 * 1024
+
+async def _save_stream(app, reader, file_size, file_name, progress=None, parallel_parts=UPLOAD_STREAM_PARALLEL_PARTS): # 從流中分塊上傳文件的異步函數
+    """
+    Uploads file_size bytes from reader (an object with `async read(n)`) as saveFilePart/saveBigFilePart
+    parts, like Client.save_file does for a local file, but awaiting every read so the loop is never
+    blocked while the data is still arriving. Up to parallel_parts parts are in flight at once.
+    """
+    total_parts = math.ceil(file_size / UPLOAD_PART_SIZE) # 分塊總數
+    is_big = file_size > 10 * 1024 * 1024 # 大於 10MB 的文件使用 saveBigFilePart
+    file_id = app.rnd_id() # 本次上傳的文件 ID
+    md5_sum = None if is_big else hashlib.md5() # 小文件需要提供 MD5
+    session = Session(app, await app.storage.dc_id(), await app.storage.auth_key(), await app.storage.test_mode(), is_media=True) # 媒體會話
+    await session.start() # 啟動會話
+    pending = set() # 正在上傳的分塊
+    try:
+        for part in range(total_parts): # 逐塊讀取並上傳
+            chunk = await reader.read(UPLOAD_PART_SIZE) # 等待下一塊數據
+            if len(chunk) != min(UPLOAD_PART_SIZE, file_size - part * UPLOAD_PART_SIZE): # 數據比聲明的大小短
+                raise IOError(f"Upload stream ended at part {part} of {total_parts}.")
+            if md5_sum is not None:
+                md5_sum.update(chunk) # 更新 MD5
+            if is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=chunk)
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=chunk)
+            if len(pending) >= parallel_parts: # 在途分塊已滿，等待其中一個完成
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result() # 分塊上傳失敗時拋出異常
+            pending.add(asyncio.ensure_future(session.invoke(rpc))) # 上傳分塊
+            if progress:
+                await progress(min((part + 1) * UPLOAD_PART_SIZE, file_size), file_size) # 報告進度，可拋出 StopTransmission
+        await asyncio.gather(*pending) # 等待剩餘分塊完成
+        pending = set()
     finally:
-        if app and app.is_connected: # 如果應用存在且已連接
-            await app.stop() # 停止應用
-            logging.info("Pyrogram bot client stopped.") # 記錄客戶端已停止
+        for task in pending:
+            task.cancel() # 取消未完成的分塊
+        await session.stop() # 停止會話
+
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum=md5_sum.hexdigest())
+
+@on_pool_loop
+async def send_stream_with_pyrogram(reader, file_name, mime_type, file_size, progress=None): # 使用 Pyrogram 邊接收邊上傳文件的異步函數
+    """
+    使用 Pyrogram 通過 Bot 賬戶將一個數據流作為文檔上傳到 Telegram，不需要本地文件。
+    reader 提供 async read(n)，file_size 必須事先知道。返回值與 send_file_with_pyrogram 相同。
+    """
+    if not API_ID or not API_HASH or not TELEGRAM_BOT_TOKEN: # 檢查配置參數是否設置
+        return None, "API_ID, API_HASH, and TELEGRAM_BOT_TOKEN are not configured for Pyrogram bot upload.", None, None, None, None, None # 返回錯誤信息
+
+    try:
+        async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
+            target_chat_id = TELEGRAM_CHAT_ID # 目標聊天 ID
+            if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
+                target_chat_id = int(target_chat_id) # 轉換為整數
+            peer = await app.resolve_peer(target_chat_id) # 在上傳前確認聊天可訪問
+
+            file = await _save_stream(app, reader, file_size, file_name, progress) # 邊接收邊上傳分塊
+            media = raw.types.InputMediaUploadedDocument( # 已上傳的文檔
+                mime_type=mime_type or "application/octet-stream",
+                file=file,
+                attributes=[raw.types.DocumentAttributeFilename(file_name=file_name)]
+            )
+            r = await app.invoke(raw.functions.messages.SendMedia(peer=peer, media=media, random_id=app.rnd_id(), message="")) # 發送消息
+            for update in r.updates: # 從更新中找到新消息
+                if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+                    message = await types.Message._parse(app, update.message, {u.id: u for u in r.users}, {c.id: c for c in r.chats}) # 解析消息
+                    if message.document: # 如果是文檔
+                        document = message.document
+                        return document.file_id, document.file_name or file_name, document.mime_type, document.file_size, None, message.id, document.file_unique_id # 返回文件信息
+            return None, "Failed to get file details from the sent message.", None, None, None, None, None # 返回錯誤信息
+    except StopTransmission: # 上傳被暫停或取消
+        return None, "Upload stopped.", None, None, None, None, None # 返回錯誤信息
+    except Exception as e: # 捕獲異常
+        logging.error(f"Error during streamed Pyrogram upload: {e}") # 記錄上傳錯誤
+        return None, str(e), None, None, None, None, None # 返回錯誤信息
 
+@on_pool_loop
 async def upload_thumbnail_with_pyrogram(thumbnail_path): # 使用 Pyrogram 上傳縮略圖的異步函數
     """
     使用 Pyrogram 通過 Bot 賬戶將縮略圖文件上傳到 Telegram 並返回其 file_id。
@@ -141,77 +359,34 @@ async def upload_thumbnail_with_pyrogram(thumbnail_path): # 使用 Pyrogram 上
         logging.warning(f"Thumbnail path is invalid or file does not exist: {thumbnail_path}") # 記錄警告信息
         return None # 返回 None
 
-    app = None # 初始化應用
     try:
-        app = await get_bot_client() # 獲取 Bot 客戶端
-        target_chat_id = TELEGRAM_CHAT_ID # 目標聊天 ID
-        try:
-            if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
-                target_chat_id = int(target_chat_id) # 轉換為整數
-            await app.get_chat(target_chat_id) # 確保聊天可訪問
-        except Exception as e: # 捕獲異常
-            logging.error(f"Failed to get chat info for {target_chat_id} during thumbnail upload: {e}") # 記錄錯誤信息
-            return None # 返回 None
+        async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
+            target_chat_id = TELEGRAM_CHAT_ID # 目標聊天 ID
+            try:
+                if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
+                    target_chat_id = int(target_chat_id) # 轉換為整數
+                await app.get_chat(target_chat_id) # 確保聊天可訪問
+            except Exception as e: # 捕獲異常
+                logging.error(f"Failed to get chat info for {target_chat_id} during thumbnail upload: {e}") # 記錄錯誤信息
+                return None # 返回 None
 
-        thumb_message = await app.send_photo(chat_id=target_chat_id, photo=thumbnail_path) # 發送照片
-        if thumb_message and thumb_message.photo: # 如果消息存在且包含照片
-            logging.info(f"Thumbnail uploaded successfully, file_id: {thumb_message.photo.file_id}") # 記錄縮略圖上傳成功
-            return thumb_message.photo.file_id # 返回文件 ID
-        else:
-            logging.error("Failed to get file_id from uploaded thumbnail message.") # 記錄無法從上傳的縮略圖消息中獲取文件 ID
-            return None # 返回 None
+            thumb_message = await app.send_photo(chat_id=target_chat_id, photo=thumbnail_path) # 發送照片
+            if thumb_message and thumb_message.photo: # 如果消息存在且包含照片
+                logging.info(f"Thumbnail uploaded successfully, file_id: {thumb_message.photo.file_id}") # 記錄縮略圖上傳成功
+                return thumb_message.photo.file_id # 返回文件 ID
+            else:
+                logging.error("Failed to get file_id from uploaded thumbnail message.") # 記錄無法從上傳的縮略圖消息中獲取文件 ID
+                return None # 返回 None
     except Exception as e: # 捕獲異常
         logging.error(f"Error uploading thumbnail with Pyrogram: {e}") # 記錄 Pyrogram 上傳縮略圖錯誤
         return None # 返回 None
-    finally:
-        if app and app.is_connected: # 如果應用存在且已連接
-            await app.stop() # 停止應用
-            logging.info("Pyrogram bot client stopped.") # 記錄客戶端已停止
 
 async def generate_thumbnail(file_path, mime_type): # 生成縮略圖的異步函數
+    """在進程池中生成縮略圖，不阻塞事件循環；返回縮略圖路徑（由縮略圖緩存管理，使用後不要刪除）或 None。"""
     logging.info(f"Generating thumbnail for {file_path} with dimensions: {THUMBNAIL_WIDTH}x{THUMBNAIL_HEIGHT}") # 記錄生成縮略圖信息
-    thumbnail_output_path = None # 縮略圖輸出路徑
-    try:
-        if mime_type.startswith("image/"): # 如果是圖片類型
-            img = Image.open(file_path) # 打開圖片文件
-            if img.mode == 'RGBA': # 如果圖片模式是 RGBA
-                img = img.convert('RGB') # 轉換為 RGB 模式
-            img.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)) # 生成縮略圖
-            thumbnail_output_path = f"{file_path}.tHuMb20821132.jpg" # 構建縮略圖輸出路徑
-            try:
-                img.save(thumbnail_output_path, "JPEG") # 保存縮略圖為 JPEG 格式
-                logging.info(f"Image thumbnail saved to: {thumbnail_output_path}") # 記錄縮略圖保存成功
-            except Exception as save_e:
-                logging.error(f"Error saving image thumbnail {thumbnail_output_path}: {save_e}") # 記錄保存縮略圖錯誤
-                thumbnail_output_path = None
-        elif mime_type.startswith("video/"): # 如果是視頻類型
-            thumbnail_output_path = f"{file_path}.tHuMb20821132.jpg" # 構建縮略圖輸出路徑
-            # 使用 ffmpeg 從視頻中提取一幀
-            command = [ # ffmpeg 命令
-                "ffmpeg",
-                "-i", file_path,
-                "-ss", "00:00:01", # 在 1 秒處截圖
-                "-vframes", "1",
-                "-q:v", "2", # 質量（2 非常高，1-31，越低越好）
-                "-y", # 覆蓋輸出文件
-                thumbnail_output_path
-            ]
-            process = await asyncio.create_subprocess_exec( # 創建子進程
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate() # 獲取標準輸出和標準錯誤
-            if process.returncode != 0: # 如果返回碼不為 0
-                logging.error(f"ffmpeg thumbnail generation failed: {stderr.decode()}") # 記錄錯誤信息
-                thumbnail_output_path = None # 縮略圖輸出路徑設置為 None
-            else:
-                logging.info(f"Video thumbnail saved to: {thumbnail_output_path}") # 記錄縮略圖保存成功
-    except Exception as e: # 捕獲異常
-        logging.error(f"Error generating thumbnail for {file_path}: {e}") # 記錄生成縮略圖錯誤
-        thumbnail_output_path = None # 縮略圖輸出路徑設置為 None
-    return thumbnail_output_path # 返回縮略圖輸出路徑
+    return await asyncio.to_thread(thumbnail_generator.generate, file_path, mime_type) # 在線程中等待進程池的結果
 
+@on_pool_loop
 async def delete_telegram_message(chat_id, message_id): # 刪除 Telegram 消息的異步函數
     """
     使用 Bot 賬戶從 Telegram 刪除消息。
@@ -220,75 +395,77 @@ async def delete_telegram_message(chat_id, message_id): # 刪除 Telegram 消息
         logging.error("Configuration error: API_ID, API_HASH, and TELEGRAM_BOT_TOKEN must be configured for bot client to delete messages.") # 記錄配置錯誤
         return False # 返回 False
 
-    app = None # 初始化應用
     try:
-        app = await get_bot_client() # 獲取 Bot 客戶端
-        logging.info(f"Attempting to delete message {message_id} from chat {chat_id}") # 記錄嘗試刪除消息信息
-        await app.delete_messages(chat_id, message_id) # 刪除消息
-        logging.info(f"Message {message_id} deleted successfully from chat {chat_id}.") # 記錄消息刪除成功
-        return True # 返回 True
+        async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
+            logging.info(f"Attempting to delete message {message_id} from chat {chat_id}") # 記錄嘗試刪除消息信息
+            await app.delete_messages(chat_id, message_id) # 刪除消息
+            logging.info(f"Message {message_id} deleted successfully from chat {chat_id}.") # 記錄消息刪除成功
+            return True # 返回 True
     except Exception as e: # 捕獲異常
         logging.error(f"Error deleting message {message_id} from chat {chat_id}: {e}") # 記錄刪除消息錯誤
         return False # 返回 False
-    finally:
-        if app and app.is_connected: # 如果應用存在且已連接
-            await app.stop() # 停止應用
-            logging.info("Pyrogram bot client stopped.") # 記錄客戶端已停止
 
-async def scan_channel_history(chat_id, db_add_file_func): # 掃描頻道歷史記錄的異步函數
+SCAN_BATCH_SIZE = 500 # 每批寫入數據庫的文件記錄數
+
+@on_pool_loop
+async def scan_channel_history(chat_id, db_add_files_func): # 掃描頻道歷史記錄的異步函數
     """
-    掃描給定 chat_id 的歷史記錄並將文件信息添加到數據庫。
+    掃描給定 chat_id 的歷史記錄並將文件信息分批添加到數據庫。
+    db_add_files_func 接收文件記錄列表（add_files_bulk 的格式），每批一個事務。
     """
     if not API_ID or not API_HASH or not TELEGRAM_BOT_TOKEN: # 檢查配置參數是否設置
         logging.error("Configuration error: API_ID, API_HASH, and TELEGRAM_BOT_TOKEN are not configured for scanning.") # 記錄配置錯誤
         return # 返回
 
-    app = None # 初始化應用
+    records = [] # 待寫入的文件記錄
     try:
-        app = await get_bot_client() # 獲取 Bot 客戶端
-        logging.info(f"Starting scan for chat_id: {chat_id}") # 記錄開始掃描信息
-        
-        target_chat_id = chat_id # 目標聊天 ID
-        try:
-            # 嘗試將 chat_id 轉換為整數（如果它是數字字符串）
-            if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
-                target_chat_id = int(target_chat_id) # 轉換為整數
-            logging.info(f"Attempting to get chat info for chat ID: {target_chat_id} (Type: {type(target_chat_id)})") # 記錄獲取聊天信息
-            chat_info = await app.get_chat(target_chat_id) # 獲取聊天信息
-            logging.info(f"Successfully retrieved chat info for {target_chat_id}: {chat_info.title}") # 記錄成功獲取聊天信息
-        except PeerIdInvalid as e: # 捕獲 PeerIdInvalid 錯誤
-            logging.error(f"PEER_ID_INVALID error for chat {target_chat_id}: {e}. This usually means the bot is not in the chat/channel or does not have permissions. Please add the bot to the chat/channel and ensure it has necessary permissions (e.g., Post Messages for channels).") # 記錄錯誤信息
-            return # 返回
-        except Exception as e: # 捕獲其他異常
-            logging.error(f"Failed to get chat info for {target_chat_id} before scanning: {e}") # 記錄錯誤信息
-            return # 返回
-
-        async for message in app.get_chat_history(target_chat_id): # 遍歷聊天歷史記錄
-            if message.document: # 如果是文檔
-                file_id = message.document.file_id # 文件 ID
-                file_name = message.document.file_name or "Unknown File" # 文件名
-                folder = "scanned_files" # 默認文件夾
-                db_add_file_func(file_name, file_id, folder) # 添加文件到數據庫
-                logging.info(f"Scanned file: {file_name} (ID: {file_id})") # 記錄掃描文件信息
-            elif message.photo: # 如果是照片
-                # 對於照片，我們可以使用最大尺寸的文件 ID
-                file_id = message.photo.file_id # 文件 ID
-                file_name = f"photo_{message.photo.file_id}.jpg" # 文件名
-                folder = "scanned_photos" # 文件夾
-                db_add_file_func(file_name, file_id, folder) # 添加文件到數據庫
-                logging.info(f"Scanned photo: {file_name} (ID: {file_id})") # 記錄掃描照片信息
-            # 如果需要，添加更多媒體類型（例如，視頻，音頻）
+        async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
+            logging.info(f"Starting scan for chat_id: {chat_id}") # 記錄開始掃描信息
+
+            target_chat_id = chat_id # 目標聊天 ID
+            try:
+                # 嘗試將 chat_id 轉換為整數（如果它是數字字符串）
+                if isinstance(target_chat_id, str) and target_chat_id.startswith('-100'): # 如果是頻道 ID
+                    target_chat_id = int(target_chat_id) # 轉換為整數
+                logging.info(f"Attempting to get chat info for chat ID: {target_chat_id} (Type: {type(target_chat_id)})") # 記錄獲取聊天信息
+                chat_info = await app.get_chat(target_chat_id) # 獲取聊天信息
+                logging.info(f"Successfully retrieved chat info for {target_chat_id}: {chat_info.title}") # 記錄成功獲取聊天信息
+            except PeerIdInvalid as e: # 捕獲 PeerIdInvalid 錯誤
+                logging.error(f"PEER_ID_INVALID error for chat {target_chat_id}: {e}. This usually means the bot is not in the chat/channel or does not have permissions. Please add the bot to the chat/channel and ensure it has necessary permissions (e.g., Post Messages for channels).") # 記錄錯誤信息
+                return # 返回
+            except Exception as e: # 捕獲其他異常
+                logging.error(f"Failed to get chat info for {target_chat_id} before scanning: {e}") # 記錄錯誤信息
+                return # 返回
+
+            async for message in app.get_chat_history(target_chat_id): # 遍歷聊天歷史記錄
+                if message.document: # 如果是文檔
+                    file_id = message.document.file_id # 文件 ID
+                    file_name = message.document.file_name or "Unknown File" # 文件名
+                    folder = "root/scanned_files" # 默認文件夾
+                    records.append({'filename': file_name, 'file_id': file_id, 'folder': folder, 'size': message.document.file_size, 'mime_type': message.document.mime_type, 'file_unique_id': message.document.file_unique_id}) # 加入待寫入記錄
+                    logging.info(f"Scanned file: {file_name} (ID: {file_id})") # 記錄掃描文件信息
+                elif message.photo: # 如果是照片
+                    # 對於照片，我們可以使用最大尺寸的文件 ID
+                    file_id = message.photo.file_id # 文件 ID
+                    file_name = f"photo_{message.photo.file_id}.jpg" # 文件名
+                    folder = "root/scanned_photos" # 文件夾
+                    records.append({'filename': file_name, 'file_id': file_id, 'folder': folder, 'size': message.photo.file_size, 'mime_type': 'image/jpeg', 'file_unique_id': message.photo.file_unique_id}) # 加入待寫入記錄
+                    logging.info(f"Scanned photo: {file_name} (ID: {file_id})") # 記錄掃描照片信息
+                # 如果需要，添加更多媒體類型（例如，視頻，音頻）
+
+                if len(records) >= SCAN_BATCH_SIZE: # 達到批量大小時寫入數據庫
+                    db_add_files_func(records)
+                    records = []
 
     except Exception as e: # 捕獲異常
         logging.error(f"Error during channel history scan: {e}") # 記錄頻道歷史掃描錯誤
     finally:
-        if app and app.is_connected: # 如果應用存在且已連接
-            await app.stop() # 停止應用
-            logging.info("Pyrogram bot client stopped.") # 記錄客戶端已停止
+        if records: # 寫入最後一批（包括掃描中斷前已收集的記錄）
+            db_add_files_func(records)
 
+@on_pool_loop
 async def get_file_info(message_id): # 獲取文件信息的異步函數
-    app = await get_bot_client() # 獲取 Bot 客戶端
-    try:
+    async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
         # 獲取消息
         message = await app.get_messages(TELEGRAM_CHAT_ID, int(message_id)) # 獲取消息
         if not message: # 如果消息不存在
@@ -315,41 +492,28 @@ async def get_file_info(message_id): # 獲取文件信息的異步函數
             return file_name, file_size # 返回文件名和文件大小
         else:
             return None, None # 返回 None
-    finally:
-        if app and app.is_connected: # 如果應用存在且已連接
-            await app.stop() # 停止應用
 
 def stream_file(message_id): # 流式傳輸文件的函數
-    """使用工作線程處理異步操作，從 Telegram 流式傳輸文件。"""
+    """在客戶端池的事件循環中處理異步操作，從 Telegram 流式傳輸文件。"""
     q = queue.Queue() # 創建隊列
     stop_event = threading.Event() # 創建停止事件
 
-    def worker(): # 工作線程函數
-        async def stream_async(): # 異步流式傳輸函數
-            app = None # 初始化應用
-            try:
-                app = await get_bot_client() # 獲取 Bot 客戶端
+    async def stream_async(): # 異步流式傳輸函數
+        try:
+            async with bot_client_pool.client() as app: # 從客戶端池借用 Bot 客戶端
                 async for chunk in app.iter_download(message_id): # 迭代下載塊
                     if stop_event.is_set(): # 如果停止事件已設置
                         logging.info(f"Streaming stopped for file_id {message_id} by client.") # 記錄流式傳輸停止信息
                         break # 跳出循環
                     q.put(chunk) # 將塊放入隊列
-            except Exception as e: # 捕獲異常
-                logging.error(f"Error in stream_file worker thread: {e}") # 記錄工作線程錯誤
-                q.put(e) # 將錯誤放入隊列
-            finally:
-                if app and app.is_connected: # 如果應用存在且已連接
-                    await app.stop() # 停止應用
-                q.put(None)  # 發送信號表示完成
-
-        # 每個線程都需要自己的事件循環。
-        loop = asyncio.new_event_loop() # 創建新的事件循環
-        asyncio.set_event_loop(loop) # 設置當前線程的事件循環
-        loop.run_until_complete(stream_async()) # 運行異步任務直到完成
-        loop.close() # 關閉事件循環
-
-    thread = threading.Thread(target=worker) # 創建線程
-    thread.start() # 啟動線程
+        except Exception as e: # 捕獲異常
+            logging.error(f"Error in stream_file worker: {e}") # 記錄錯誤
+            q.put(e) # 將錯誤放入隊列
+        finally:
+            q.put(None)  # 發送信號表示完成
+
+    # 在客戶端池的事件循環中運行，不再為每次串流創建線程和事件循環
+    future = bot_client_pool.submit(stream_async()) # 提交異步任務
 
     try:
         while True: # 無限循環
@@ -363,4 +527,4 @@ def stream_file(message_id): # 流式傳輸文件的函數
         logging.info(f"Client disconnected, stopping stream for file_id {message_id}.") # 記錄客戶端斷開連接
         stop_event.set() # 設置停止事件
     finally:
-        thread.join() # 等待線程結束
+        future.result() # 等待異步任務結束